@@ -18,6 +18,12 @@ const int pinServo = 2;
 int pulsomin = 500;
 int pulsomax = 2440;
 Servo miServo;    //Creacion del objeto servomotor
+int anguloServo = 0;    //Ultimo angulo enviado al servo
+//El servo no informa su posicion, el tiempo de giro se estima con estos valores
+const int msPorGrado = 3;    //Tiempo de giro por grado, con margen para el peso de la paleta
+const int msMargen = 50;    //Tiempo extra para que la paleta deje de vibrar
+char filtroPendiente = 0;    //Filtro que se esta moviendo, 0 si la paleta esta quieta
+unsigned long filtroListoEn = 0;    //millis() en que el filtro pendiente termina de moverse
 
 // Configuración motor paso a paso
 const int stepsPerRevolution = 200;
@@ -96,6 +102,15 @@ void setup() {
       f:r ---> activa el filtro rojo
       f:g ---> activa el filtro verde
       f:b ---> activa el filtro azul
+
+  Mensajes enviados al programa
+
+  POS: #   Posicion actual en pasos, se envia cada 200 ms
+  DONE: #  Se envia una sola vez cuando termina un movimiento (p###f, p###b o g#)
+           con la posicion final, asi el programa no tiene que esperar el siguiente POS
+  FILTER: x  Se envia cuando el filtro x termino de girar (tiempo estimado con msPorGrado),
+             asi el programa puede tomar la imagen sin esperar un tiempo fijo
+  LED: #   Se envia despues de cada comando on, off o led# con el valor PWM aplicado al LED
   */
   Serial.println("Iniciado con exito.");
 }
@@ -154,10 +169,12 @@ void loop() {
     } else if (command == "on") {
       ledEncendido = true;
       analogWrite(ledPin, map(ledIntensity, 1, 10, 25, 255));
+      avisarLed();
 
     } else if (command == "off") {
       ledEncendido = false;
       analogWrite(ledPin, 0);
+      avisarLed();
 
     } else if (command.startsWith("led")) {
       int nivel = command.substring(3).toInt();
@@ -167,6 +184,7 @@ void loop() {
           analogWrite(ledPin, map(nivel, 1, 10, 25, 255));
         }
       }
+      avisarLed();
 
     } else if (command.startsWith("g")) {
       long objetivo = command.substring(1).toInt();
@@ -194,6 +212,13 @@ void loop() {
     }
   }
 
+  // Avisar cuando el filtro termina de girar
+  if (filtroPendiente != 0 && (long)(millis() - filtroListoEn) >= 0) {
+    Serial.print("FILTER: ");
+    Serial.println(filtroPendiente);
+    filtroPendiente = 0;
+  }
+
   // Imprimir posición actual
   static unsigned long lastPrintTime = 0;
   unsigned long now = millis();
@@ -220,7 +245,8 @@ void moveSteps(long steps, int direction) {
   }
 
   motor.setSpeed(0);
-  Serial.print("POS: ");
+  //Avisar al programa que el movimiento termino
+  Serial.print("DONE: ");
   Serial.println(motor.currentPosition());
 }
 
@@ -230,7 +256,12 @@ void moverAPosicion(long destino) {
 
   if (destino > 0 || destino < -maxSteps) {return;}
 
-  if (destino == actual) {return;}
+  if (destino == actual) {
+    //Ya esta en la posicion deseada, se avisa igual para no dejar esperando al programa
+    Serial.print("DONE: ");
+    Serial.println(actual);
+    return;
+  }
 
   activarMotor(true);
 
@@ -251,6 +282,8 @@ void moverAPosicion(long destino) {
   activarMotor(false);
 
   //Serial.print("Posición final alcanzada: ");
+  //Avisar al programa que el movimiento termino
+  Serial.print("DONE: ");
   Serial.println(motor.currentPosition());
 }
 
@@ -270,6 +303,17 @@ void moverFiltro(char filtro) {
   miServo.write(angulo);
   Serial.print("Filtro cambiado a: ");
   Serial.println(filtro);
+
+  //El aviso FILTER se envia desde loop() cuando pase el tiempo de giro estimado
+  filtroListoEn = millis() + (unsigned long)abs(angulo - anguloServo) * msPorGrado + msMargen;
+  filtroPendiente = filtro;
+  anguloServo = angulo;
+}
+
+//Funcion para avisar al programa el valor PWM aplicado al LED
+void avisarLed() {
+  Serial.print("LED: ");
+  Serial.println(ledEncendido ? map(ledIntensity, 1, 10, 25, 255) : 0);
 }
 
 
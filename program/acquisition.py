@@ -0,0 +1,367 @@
+"""
+Camera acquisition thread and frame ring buffer.
+
+A single Acquisition thread owns the camera device: it grabs every frame
+the driver delivers and publishes it into a FrameRing, a small set of
+preallocated frame slots with sequence numbers. The live previews, the
+video recording and the measurements read from the ring instead of
+calling read() on the device themselves, so they no longer compete for
+frames and one consumer can not starve another.
+
+Reading does not copy: the frames returned by the ring are views into its
+slots. A slot is reused after RING_SLOTS newer frames, so a consumer that
+keeps a frame for longer than that must copy it, or check with
+FrameRing.is_valid() after using it that it was not overwritten meanwhile.
+"""
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# Number of frames kept by the ring, about a quarter of a second at 30 fps
+RING_SLOTS = 8
+
+# Most camera drivers keep a few frames in a buffer. Grabbing a buffered
+# frame returns at once, while grabbing with an empty buffer blocks until
+# the sensor delivers the next frame. A grab that blocked for at least
+# FRESH_GRAB_FRACTION of the frame period returns a frame from the sensor,
+# exposed at most one frame period before the grab returned.
+FRESH_GRAB_FRACTION = 0.5
+# Frame rate assumed when the driver does not report one
+DEFAULT_FPS = 30.0
+# Number of frames after which frame_after() accepts a frame even if it
+# can not tell when it was exposed, e.g. with a driver that never blocks
+MAX_DRAINED_FRAMES = 10
+# Consecutive failed grabs after which the device is considered lost
+MAX_FAILED_GRABS = 50
+# Maximum time in seconds stop() waits for the thread to finish a grab
+STOP_TIMEOUT = 2.0
+
+# A published frame.
+#   seq: sequence number, 0 for the first frame after the camera opened
+#   timestamp: time.monotonic() when the grab returned
+#   fresh: True if the grab waited for the sensor (see FRESH_GRAB_FRACTION)
+#   image: view of the ring slot holding the raw BGR frame
+Frame = namedtuple("Frame", ["seq", "timestamp", "fresh", "image"])
+
+
+class FrameRing:
+    """
+    Fixed set of preallocated frame slots written by one thread.
+
+    Frame n is stored in slot n % slots. The writer marks a slot as being
+    written before filling it and stores its sequence number afterwards,
+    so readers never need a lock: a frame is valid as long as its slot
+    still holds its sequence number (the seqlock pattern). A condition
+    variable is only used to wake up the readers that wait for new frames.
+
+    Parameters
+    ----------
+    slots : int, optional
+        Number of frames kept. Default is RING_SLOTS.
+    """
+
+    def __init__(self, slots=RING_SLOTS):
+        self.slots = slots
+        self._images = None                             # (slots, h, w, 3), allocated with the first frame
+        self._seqs = np.full(slots, -1, dtype=np.int64) # sequence number in each slot, -1 while written
+        self._timestamps = np.zeros(slots)
+        self._fresh = np.zeros(slots, dtype=bool)
+        self.latest_seq = -1                            # sequence number of the newest complete frame
+        self._published = threading.Condition()
+
+    # --- Writer side, used only by the acquisition thread --- #
+
+    def claim(self):
+        """
+        Marks the next slot as being written and returns it, so the device
+        can decode the next frame directly into it.
+
+        Returns
+        -------
+        numpy array or None
+            The slot, or None before the first frame allocated the ring.
+        """
+        slot = (self.latest_seq + 1) % self.slots
+        self._seqs[slot] = -1
+        return None if self._images is None else self._images[slot]
+
+    def commit(self, image, timestamp, fresh):
+        """
+        Publishes the frame in the slot returned by claim().
+
+        Parameters
+        ----------
+        image : numpy array
+            The frame. Copied into the slot unless it already is the slot.
+        timestamp : float
+            time.monotonic() when the grab returned.
+        fresh : bool
+            True if the grab waited for the sensor.
+        """
+        seq = self.latest_seq + 1
+        slot = seq % self.slots
+        if self._images is None or self._images.shape[1:] != image.shape:
+            # First frame, or the resolution changed: (re)allocate every slot
+            self._images = np.empty((self.slots,) + image.shape, dtype=image.dtype)
+            self._seqs[:] = -1
+        if image.ctypes.data != self._images[slot].ctypes.data:
+            # The device returned its own array instead of filling the slot
+            np.copyto(self._images[slot], image)
+        self._timestamps[slot] = timestamp
+        self._fresh[slot] = fresh
+        self._seqs[slot] = seq
+        with self._published:
+            self.latest_seq = seq
+            self._published.notify_all()
+
+    # --- Reader side --- #
+
+    def get(self, seq):
+        """
+        Returns frame seq, or None if it was not published yet or was
+        already overwritten.
+        """
+        if seq < 0 or seq > self.latest_seq:
+            return None
+        slot = seq % self.slots
+        frame = Frame(seq, self._timestamps[slot], self._fresh[slot], self._images[slot])
+        # The slot may have been rewritten while the fields were read
+        return frame if self._seqs[slot] == seq else None
+
+    def is_valid(self, frame):
+        """True if the slot of frame still holds it, i.e. its image was not overwritten."""
+        return self._seqs[frame.seq % self.slots] == frame.seq
+
+    def latest(self):
+        """
+        Returns the newest frame without waiting.
+
+        Returns
+        -------
+        Frame or None
+            None if no frame was published yet.
+        """
+        while True:
+            seq = self.latest_seq
+            if seq < 0:
+                return None
+            frame = self.get(seq)
+            if frame is not None:
+                return frame
+
+    def next_after(self, seq, timeout=None):
+        """
+        Returns the first frame newer than seq, waiting for it if needed.
+        If the reader fell so far behind that frame seq + 1 was overwritten,
+        the oldest frame still in the ring is returned.
+
+        Parameters
+        ----------
+        seq : int
+            Sequence number of the last frame the reader used, -1 for none.
+        timeout : float or None, optional
+            Maximum time to wait in seconds. None waits forever.
+
+        Returns
+        -------
+        Frame or None
+            None if the timeout expired.
+        """
+        with self._published:
+            if not self._published.wait_for(lambda: self.latest_seq > seq, timeout):
+                return None
+        while True:
+            # Oldest frame that can still be in the ring
+            first = max(seq + 1, self.latest_seq - self.slots + 2)
+            frame = self.get(first)
+            if frame is not None:
+                return frame
+            seq = first
+
+    def consecutive(self, n, after=None, timeout=None):
+        """
+        Returns n consecutive frames, waiting until they are all published.
+
+        Parameters
+        ----------
+        n : int
+            Number of frames, at most slots - 1 so the first one is not
+            overwritten while the last one is written.
+        after : int, optional
+            The frames start at seq after + 1. Default is the newest frame.
+        timeout : float or None, optional
+            Maximum time to wait in seconds. None waits forever.
+
+        Returns
+        -------
+        list of Frame or None
+            None if the timeout expired or the frames were overwritten
+            before they could be returned.
+        """
+        if not 0 < n < self.slots:
+            raise ValueError(f"Between 1 and {self.slots - 1} consecutive frames can be read, not {n}.")
+        start = (self.latest_seq if after is None else after) + 1
+        with self._published:
+            if not self._published.wait_for(lambda: self.latest_seq >= start + n - 1, timeout):
+                return None
+        frames = [self.get(s) for s in range(start, start + n)]
+        return None if any(f is None for f in frames) else frames
+
+
+class Acquisition:
+    """
+    Thread that owns a camera device and publishes its frames in a FrameRing.
+
+    Parameters
+    ----------
+    device : cv2.VideoCapture or compatible object
+        An opened device. Only the acquisition thread uses it once started,
+        and the thread releases it when it stops.
+    slots : int, optional
+        Number of frames kept in the ring. Default is RING_SLOTS.
+
+    Attributes
+    ----------
+    ring : FrameRing
+        The published frames.
+    frame_period : float
+        Time between two frames reported by the device, in seconds. Read
+        once here, so the consumers never call the device.
+    metrics : dict
+        Statistics of the acquisition, updated with every frame:
+            published: frames published since the start
+            buffer_depth: frames that were waiting in the driver buffer
+                before the last grab that waited for the sensor
+            grab_wait: seconds the last grab waited
+            grab_to_retrieve: seconds between the end of the last grab and
+                its decoded image
+    """
+
+    def __init__(self, device, slots=RING_SLOTS):
+        import cv2
+
+        self.device = device
+        self.ring = FrameRing(slots)
+        fps = device.get(cv2.CAP_PROP_FPS)
+        self.frame_period = 1.0 / (fps if fps and fps > 0 else DEFAULT_FPS)
+        self.metrics = {"published": 0, "buffer_depth": 0, "grab_wait": None, "grab_to_retrieve": None}
+        self._running = False
+        self._thread = None
+
+    @property
+    def running(self):
+        """True while the acquisition thread is running."""
+        return self._running and self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Starts the acquisition thread. Returns the acquisition itself."""
+        self._running = True
+        # daemon=True means the thread stops if the main program exits
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Stops the thread, which releases the device when it exits.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum time to wait for the thread in seconds. Default is STOP_TIMEOUT.
+
+        Returns
+        -------
+        bool
+            False if the thread is still inside a grab or a retrieve when
+            the timeout expires. It then releases the device as soon as
+            that call returns, the device is never released under it.
+        """
+        self._running = False
+        if self._thread is None:
+            # Never started, no thread owns the device
+            self.device.release()
+            return True
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _loop(self):
+        """Grabs and publishes frames until stop() is called or the device is lost."""
+        try:
+            self._grab_frames()
+        finally:
+            # The thread owns the device, so it is released here and never
+            # while a grab or a retrieve is running
+            self._running = False
+            self.device.release()
+
+    def _grab_frames(self):
+        """The loop of _loop(), returns when stopped or the device is lost."""
+        period = self.frame_period
+        buffered = 0
+        failed = 0
+        while self._running:
+            start = time.monotonic()
+            if not self.device.grab():
+                failed += 1
+                if failed >= MAX_FAILED_GRABS:
+                    break
+                time.sleep(period)
+                continue
+            end = time.monotonic()
+            failed = 0
+
+            fresh = end - start >= FRESH_GRAB_FRACTION * period
+            if fresh:
+                self.metrics["buffer_depth"] = buffered
+                buffered = 0
+            else:
+                buffered += 1
+
+            # Decode directly into the next slot of the ring when possible
+            slot = self.ring.claim()
+            ret, image = self.device.retrieve() if slot is None else self.device.retrieve(slot)
+            if not ret:
+                continue
+            self.ring.commit(image, end, fresh)
+            self.metrics["published"] += 1
+            self.metrics["grab_wait"] = end - start
+            self.metrics["grab_to_retrieve"] = time.monotonic() - end
+
+    def frame_after(self, after, timeout=None):
+        """
+        Returns the first frame that was exposed after the given time,
+        e.g. when the last move was acknowledged. Frames that came from the
+        driver buffer can not be dated and are skipped, unless the driver
+        never waits for the sensor (see MAX_DRAINED_FRAMES).
+
+        Parameters
+        ----------
+        after : float
+            A time.monotonic() value.
+        timeout : float or None, optional
+            Maximum time to wait in seconds. None waits forever.
+
+        Returns
+        -------
+        Frame or None
+            None if the timeout expired.
+        """
+        period = self.frame_period
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Frames published before 'after' can not qualify
+        frame = self.ring.latest()
+        seq = -1 if frame is None else frame.seq
+        for _ in range(MAX_DRAINED_FRAMES):
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            frame = self.ring.next_after(seq, remaining)
+            if frame is None:
+                return None
+            # The whole exposure of a fresh frame is after timestamp - period
+            if frame.fresh and frame.timestamp - period >= after:
+                return frame
+            seq = frame.seq
+        return frame
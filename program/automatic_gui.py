@@ -1,7 +1,8 @@
 import tkinter as tk
-from tkinter import simpledialog
+from tkinter import simpledialog, messagebox
 from camera_functions import start_live_view, turn_off_camera_auto
-from focal_measurements import automatic_measurement, save_measurement_data, do_reference
+from focal_measurements import automatic_measurement, save_measurement_in_background, do_reference, MeasurementError
+import os
 import threading
 from pathlib import Path
 
@@ -10,6 +11,9 @@ from pathlib import Path
 # This prevents the user from opening multiple instances of the same window.
 _auto_window = None
 
+# Interval in milliseconds at which the window checks the progress of a save
+SAVE_POLL_INTERVAL = 100
+
 
 class ToolTip:
     """
@@ -103,7 +107,9 @@ def open_auto_mode_window(root):
         "images_z1": [],     # list of captured images at position z1
         "images_z2": [],     # list of captured images at position z2
         "tables": {},        # result tables per filter for saving
-        "path_base": ""      # base folder path where data will be saved
+        "path_base": "",     # base folder path where data will be saved
+        "telemetry": {},     # timing, time stamp and reference of the run
+        "modo": None,        # calculation mode of the run
     }
 
     # --- Window setup ---
@@ -153,16 +159,21 @@ def open_auto_mode_window(root):
         result_text.configure(state='disabled')
 
     # --- Display measurement results ---
-    def show_results(local_results):
+    def show_results(local_results, telemetry=None):
         """
         Clears the results area and displays the focal length results
-        for each filter (white, red, green, blue).
+        for each filter (white, red, green, blue), followed by the run
+        time of the measurement when telemetry is given. Filters whose
+        computation failed are listed with their error, and reported in a
+        warning dialog.
         Called from the main thread after the measurement thread finishes.
         """
         # Enable writing to clear and update the text area
         result_text.configure(state='normal')
         # Clear all previous content
         result_text.delete(1.0, tk.END)
+        # Errors of the filters that failed, shown together at the end
+        failed = []
 
         # Loop through each filter and display its results
         for flt in ['w', 'r', 'g', 'b']:
@@ -176,6 +187,12 @@ def open_auto_mode_window(root):
                 result_text.insert(tk.END, "  Data not available.\n\n")
                 continue
 
+            # The image of this filter could not be captured or analyzed
+            if "error" in data:
+                result_text.insert(tk.END, f"  Error: {data['error']}\n\n")
+                failed.append(f"Error in filter '{flt}': {data['error']}")
+                continue
+
             # Extract the focal length values from the dictionary
             focal = data.get('effective_focal', 0)
             err_focal = data.get('error_effective_focal', 0)
@@ -185,9 +202,19 @@ def open_auto_mode_window(root):
             result_text.insert(tk.END, f"  Effective focal length: {focal:.2f} ± {err_focal:.2f} mm\n")
             result_text.insert(tk.END, f"  Δf: {delta_f:.2f} mm\n\n")
 
+        # Show how long the run took and how much of it was image processing
+        if telemetry:
+            result_text.insert(tk.END, f"Run time: {telemetry['total_time']:.1f} s "
+                                       f"(image processing {telemetry['processing_time']:.1f} s, "
+                                       f"{telemetry['processing_share']:.0%}, results ready "
+                                       f"{telemetry['post_capture_latency'] * 1e3:.0f} ms after the last image)\n")
+
         # Disable again to prevent user edits
         result_text.configure(state='disabled')
 
+        if failed:
+            messagebox.showwarning("Error", "\n".join(failed), parent=_auto_window)
+
     # --- Start automatic measurement ---
     def start_measurement():
         """
@@ -211,17 +238,27 @@ def open_auto_mode_window(root):
                 """
                 # Get the currently selected calculation mode (1, 2 or 3)
                 mode = mode_var.get()
-                # Run the full automatic measurement and unpack all return values
-                r, iz1, iz2, t, pb = automatic_measurement(z1, z2, mode)
+                try:
+                    # Run the full automatic measurement and unpack all return values
+                    r, iz1, iz2, t, pb, tm = automatic_measurement(z1, z2, mode)
+                except Exception as e:
+                    # e.g. the motor did not reach a position in time
+                    # Report it from the main thread and stop the task. The
+                    # message is built here, e is unbound after the except block
+                    message = f"\n Measurement failed: {e}\n"
+                    _auto_window.after(0, lambda: append_result(message))
+                    return
                 # Store all results in the shared dictionary for later saving
                 measurement_data["results"] = r
                 measurement_data["images_z1"] = iz1
                 measurement_data["images_z2"] = iz2
                 measurement_data["tables"] = t
                 measurement_data["path_base"] = pb
+                measurement_data["telemetry"] = tm
+                measurement_data["modo"] = mode
                 # Schedule show_results to run in the main thread
                 # after(0) means "run as soon as possible in the main thread"
-                _auto_window.after(0, lambda: show_results(r))
+                _auto_window.after(0, lambda: show_results(r, tm))
 
             # Start the task in a background thread
             # daemon=True means the thread stops if the main program exits
@@ -240,6 +277,10 @@ def open_auto_mode_window(root):
         Saves the measurement results, images and tables to disk.
         First checks that a measurement has been run and data is available.
         Then optionally asks the user for a custom folder name.
+
+        The files are written by the background writer (see persistence.py),
+        so the window keeps responding. The Save button shows the progress
+        and the result is reported when the last file is written.
         """
         # Check that all required data is available before saving
         if (measurement_data["results"]
@@ -273,18 +314,51 @@ def open_auto_mode_window(root):
                 z1 = float(entry_z1.get())
                 z2 = float(entry_z2.get())
 
-                # Call the save function with all collected data
-                save_measurement_data(
+                # Queue the files and return at once, the window stays usable.
+                # The button is disabled until the save finished so the same
+                # measurement is not saved twice
+                save_button.config(text="Saving...", state="disabled")
+                job = save_measurement_in_background(
                     measurement_data["images_z1"],
                     measurement_data["images_z2"],
                     measurement_data["tables"],
                     measurement_data["path_base"],
                     z1,
-                    z2
+                    z2,
+                    results=measurement_data["results"],
+                    reference=measurement_data["telemetry"].get("reference"),
+                    modo=measurement_data["modo"],
+                    timestamp=measurement_data["telemetry"].get("timestamp"),
+                    lens_id=entry_lens.get().strip() or None,
                 )
-                # Notify the user that saving was successful
-                append_result("\n Data saved successfully.\n")
+
+                # The window polled for the progress, _auto_window is reset
+                # if it is closed before the save finished
+                window = _auto_window
+
+                def show_progress():
+                    """
+                    Shows the number of files written on the Save button and
+                    reports the end of the save. Runs in the main thread: the
+                    writer thread never calls Tk, so closing the program can
+                    wait for it without blocking each other.
+                    """
+                    if not window.winfo_exists():
+                        return
+                    if not job.finished:
+                        save_button.config(text=f"Saving {job.done}/{len(job.paths)}...")
+                        window.after(SAVE_POLL_INTERVAL, show_progress)
+                        return
+                    save_button.config(text="Save Data", state="normal")
+                    if job.errors:
+                        names = ", ".join(os.path.basename(path) for path, _ in job.errors)
+                        append_result(f"\n Error saving data: {job.errors[0][1]} ({names})\n")
+                    else:
+                        append_result("\n Data saved successfully.\n")
+
+                window.after(SAVE_POLL_INTERVAL, show_progress)
             except Exception as e:
+                save_button.config(text="Save Data", state="normal")
                 # Show the error message if something went wrong
                 append_result(f"\n Error saving data: {e}\n")
         else:
@@ -299,13 +373,29 @@ def open_auto_mode_window(root):
         Running in a thread prevents the GUI from freezing during capture.
         """
         def reference_task():
-            """Inner function that runs do_reference() in the background."""
+            """
+            Inner function that runs do_reference() in the background.
+            The outcome is shown from the main thread using after(0),
+            since GUI updates must happen in the main thread.
+            """
             try:
                 # Capture the reference image
-                do_reference()
+                folder = do_reference()
+            except MeasurementError as e:
+                # An image could not be captured or its blobs not found
+                message = (f"The measurements were wrong in image with filter {e.filter}.\n"
+                           f"Please ensure better darkness conditions.\n\n{e}")
+                _auto_window.after(0, lambda: messagebox.showwarning("Error", message, parent=_auto_window))
+                return
             except Exception as e:
-                # Show any errors in the results area
-                append_result(f"\n Error capturing reference: {e}\n")
+                # Show any other errors in the results area, e.g. a motor
+                # timeout. Built here, e is unbound after the except block
+                error = f"\n Error capturing reference: {e}\n"
+                _auto_window.after(0, lambda: append_result(error))
+                return
+            # Notify the user that the reference was saved successfully
+            _auto_window.after(0, lambda: messagebox.showinfo(
+                "Reference taken", f"Reference and images saved in:\n{folder.resolve()}", parent=_auto_window))
 
         # Start the reference capture in a background thread
         threading.Thread(target=reference_task, daemon=True).start()
@@ -368,6 +458,12 @@ def open_auto_mode_window(root):
     entry_z2 = tk.Entry(left_frame)
     entry_z2.pack(pady=5)
 
+    # Lens ID: optional name of the measured lens, saved with the run so
+    # the history of a lens can be queried, see run_index.py
+    tk.Label(left_frame, text="Lens ID (optional):", font=("Helvetica", 12), bg="#f0f0f0").pack()
+    entry_lens = tk.Entry(left_frame)
+    entry_lens.pack(pady=5)
+
     # --- Measurement mode selection ---
     # mode_var stores the currently selected mode (1, 2 or 3)
     # Must be defined before add_mode_option is called
@@ -405,8 +501,9 @@ def open_auto_mode_window(root):
               command=start_measurement).pack(side="left", padx=10)
 
     # Button to save the measurement results and images to disk
-    tk.Button(button_frame, text="Save Data", font=("Helvetica", 10, "bold"),
-              command=save_data).pack(side="left", padx=10)
+    save_button = tk.Button(button_frame, text="Save Data", font=("Helvetica", 10, "bold"),
+                            command=save_data)
+    save_button.pack(side="left", padx=10)
 
     # --- Results area ---
     # Text widget to display measurement results and status messages
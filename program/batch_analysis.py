@@ -0,0 +1,385 @@
+"""
+Offline re-analysis of saved measurements.
+
+save_measurement_data() keeps the 8 images of every automatic measurement,
+in a run archive (see run_archive.py) or as PNG files (z1_w.png ...
+z2_b.png) for older runs. This script finds those run folders in a data
+directory, detects the blobs again and recomputes the focal length of
+every run and filter with the current reference and calculation mode, so
+the results of old measurements can be updated after the detection
+improves or with another modo, without measuring again.
+
+Run from the program/ folder, for example:
+    python batch_analysis.py                      # the data/ folder of the application
+    python batch_analysis.py D:/slidebench/data --modo 2 --workers 8
+
+The runs are analyzed in parallel by a pool of processes, one run per
+task. Only measurement_core is used, so no window or device is needed.
+
+The results of every run are kept in an index file in the data directory,
+together with a signature of what they were computed from: the size and
+modification time of the run's images or archive, the reference
+distances, the calculation mode and the source of measurement_core.py. A
+run whose signature did not change is not analyzed again, so re-running
+the script over thousands of historical runs only processes the new or
+modified ones.
+All the results, new and cached, are then written to one CSV table.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import measurement_core
+from measurement_core import FILTERS, CaptureError, focal_distance_with_table
+from persistence import EXCEL_PATTERN, FOLDER_PATTERN
+from run_archive import ARCHIVE_FILENAME, RunArchive
+
+# --- Configuration --- #
+# Files written in the data directory
+INDEX_FILENAME = "batch_index.json"
+OUTPUT_FILENAME = "batch_results.csv"
+# Reference distances, relative to the data directory (see focal_measurements.py)
+REFERENCE_RELPATH = os.path.join("reference", "reference_y0.npy")
+# The index is written after this many analyzed runs, so an interrupted
+# batch keeps most of its work
+INDEX_SAVE_EVERY = 100
+# Version of the index file, changed when its layout changes
+INDEX_VERSION = 1
+
+# Columns of the results table, one row per run and filter
+COLUMNS = ["run", "timestamp", "z1", "z2", "modo", "filter",
+           "effective_focal", "error_effective_focal", "delta_f", "error"]
+
+
+def image_names(position):
+    """Returns the image filenames of one position (1 or 2), in FILTERS order."""
+    return [f"z{position}_{f}.png" for f in FILTERS]
+
+
+def find_runs(data_dir):
+    """
+    Finds the measurement folders below a data directory.
+
+    A folder is a run if it contains a run archive or at least one of the
+    z1 images, the folder name is not used because the user can save a
+    run anywhere. The z1 and z2 positions are read from the archive, from
+    the Excel filename, or from the default folder name, in this order.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory to search, including its subfolders.
+
+    Returns
+    -------
+    list of dict
+        One dict per run, sorted by path, with:
+            path: absolute path of the folder
+            archive: path of the run archive, None for PNG images
+            run: path relative to data_dir, used as the run identifier
+            z1, z2: positions in mm, None if they could not be found
+            timestamp: 'YYYYmmdd_HHMMSS' from the archive or the folder name, or ''
+    """
+    runs = []
+    z1_names = set(image_names(1))
+    for folder, subfolders, files in os.walk(data_dir):
+        # Walk in a stable order, the results table follows it
+        subfolders.sort()
+        archive = os.path.join(folder, ARCHIVE_FILENAME) if ARCHIVE_FILENAME in files else None
+        if archive is None and z1_names.isdisjoint(files):
+            continue
+        name = os.path.basename(folder)
+        z1 = z2 = None
+        timestamp = ""
+        folder_match = FOLDER_PATTERN.match(name)
+        if folder_match:
+            z1, z2 = float(folder_match.group(1)), float(folder_match.group(2))
+            timestamp = folder_match.group(3) or ""
+        for filename in files:
+            excel_match = EXCEL_PATTERN.match(filename)
+            if excel_match:
+                # The Excel filename is kept when the user renames the folder
+                z1, z2 = float(excel_match.group(1)), float(excel_match.group(2))
+                break
+        if archive is not None:
+            try:
+                # Only the header of the archive is read
+                metadata = RunArchive(archive).metadata
+                z1, z2 = metadata["z1"], metadata["z2"]
+                timestamp = metadata.get("timestamp") or timestamp
+            except (OSError, ValueError, KeyError):
+                # Reported by analyze_run() when it can not read the images
+                pass
+        runs.append({"path": folder, "archive": archive, "run": os.path.relpath(folder, data_dir),
+                     "z1": z1, "z2": z2, "timestamp": timestamp})
+    return sorted(runs, key=lambda r: r["run"])
+
+
+def run_signature(run, settings_key):
+    """
+    Returns a string that changes whenever an input of the run changes.
+
+    Only the file sizes and modification times are read, not the images
+    themselves, so checking thousands of runs takes a few seconds.
+
+    Parameters
+    ----------
+    run : dict
+        A run returned by find_runs().
+    settings_key : str
+        Key of the reference, mode and analysis code, see settings_key().
+
+    Returns
+    -------
+    str
+        SHA-1 hex digest.
+    """
+    parts = [settings_key, repr(run["z1"]), repr(run["z2"])]
+    names = [ARCHIVE_FILENAME] if run["archive"] else image_names(1) + image_names(2)
+    for name in names:
+        try:
+            stat = os.stat(os.path.join(run["path"], name))
+            parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{name}:missing")
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+
+def settings_key(y0, modo):
+    """
+    Returns a key of everything besides the images that the results depend
+    on: the reference distances, the calculation mode and the analysis code.
+
+    Parameters
+    ----------
+    y0 : numpy array
+        4x8 reference distances.
+    modo : int
+        Calculation mode (1, 2, or 3).
+
+    Returns
+    -------
+    str
+        SHA-1 hex digest.
+    """
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(y0, dtype=np.float64).tobytes())
+    digest.update(f"modo={modo}".encode())
+    # Any change to the detection or the formulas invalidates the cache
+    try:
+        with open(measurement_core.__file__, "rb") as f:
+            digest.update(f.read())
+    except OSError:
+        pass
+    return digest.hexdigest()
+
+
+# Reference and mode of the worker processes, set once by _init_worker()
+# instead of being sent with every run
+_worker_y0 = None
+_worker_modo = 1
+
+
+def _init_worker(y0, modo):
+    """Initializes a worker process of the pool."""
+    global _worker_y0, _worker_modo
+    import cv2
+
+    _worker_y0 = y0
+    _worker_modo = modo
+    # The pool already uses every core, OpenCV's own threads would only
+    # compete with the other workers
+    cv2.setNumThreads(1)
+
+
+def analyze_run(run, y0=None, modo=None):
+    """
+    Recomputes the focal length of every filter of one run.
+
+    Parameters
+    ----------
+    run : dict
+        A run returned by find_runs().
+    y0 : numpy array, optional
+        4x8 reference distances. Default is the one given to the worker.
+    modo : int, optional
+        Calculation mode (1, 2, or 3). Default is the one given to the worker.
+
+    Returns
+    -------
+    list of dict
+        One row per filter with the COLUMNS of the results table. A filter
+        that fails has its message in 'error' and no results.
+    """
+    import cv2
+
+    y0 = _worker_y0 if y0 is None else y0
+    modo = _worker_modo if modo is None else modo
+    rows = []
+    for idx, flt in enumerate(FILTERS):
+        row = {"run": run["run"], "timestamp": run["timestamp"], "z1": run["z1"], "z2": run["z2"],
+               "modo": modo, "filter": flt, "effective_focal": None,
+               "error_effective_focal": None, "delta_f": None, "error": ""}
+        try:
+            if run["z1"] is None or run["z2"] is None:
+                raise ValueError("The z1 and z2 positions are not in the folder or Excel filename")
+            if run["archive"]:
+                # Reads only the two images of this filter from the archive
+                archive = RunArchive(run["archive"])
+                images = [archive.image(1, flt), archive.image(2, flt)]
+            else:
+                images = []
+                for name in (f"z1_{flt}.png", f"z2_{flt}.png"):
+                    path = os.path.join(run["path"], name)
+                    img = cv2.imread(path) if os.path.exists(path) else None
+                    if img is None:
+                        raise CaptureError(f"Cannot read the image: {name}")
+                    images.append(img)
+            z1, z2 = sorted([run["z1"], run["z2"]])
+            # Same dz as automatic_measurement()
+            results, _ = focal_distance_with_table(y0[idx], images[0], images[1], abs(z2 - z1), idx, modo)
+            row["effective_focal"], row["error_effective_focal"], row["delta_f"] = (float(v) for v in results)
+        except Exception as e:
+            # A failed filter does not stop the other filters or runs
+            row["error"] = str(e)
+        rows.append(row)
+    return rows
+
+
+def load_index(path):
+    """Returns the runs of the index file, or an empty dict if it is missing or outdated."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if index.get("version") != INDEX_VERSION:
+        return {}
+    return index.get("runs", {})
+
+
+def save_index(path, runs):
+    """Writes the index file, replacing the old one only once it is complete."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": INDEX_VERSION, "runs": runs}, f)
+    os.replace(tmp_path, path)
+
+
+def batch_analysis(data_dir, reference=None, modo=1, workers=None, output=None, force=False, progress=print):
+    """
+    Re-analyzes every run below a data directory and writes the results table.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory with the measurement folders.
+    reference : str, optional
+        Path of the reference_y0.npy file. Default is the one in data_dir.
+    modo : int, optional
+        Calculation mode (1, 2, or 3). Default is 1.
+    workers : int, optional
+        Number of worker processes. Default is the number of CPUs.
+    output : str, optional
+        Path of the CSV table. Default is OUTPUT_FILENAME in data_dir.
+    force : bool, optional
+        If True, analyzes every run again, ignoring the index. Default is False.
+    progress : callable, optional
+        Called with a message as the runs are analyzed. Default is print.
+
+    Returns
+    -------
+    tuple
+        (table, stats): the results as a DataFrame with COLUMNS, and a dict
+        with the number of runs found, analyzed and taken from the index,
+        and the analysis time in seconds.
+
+    Raises
+    ------
+    FileNotFoundError
+        If there is no reference file.
+    """
+    import pandas as pd
+
+    reference = reference or os.path.join(data_dir, REFERENCE_RELPATH)
+    if not os.path.exists(reference):
+        raise FileNotFoundError(f"No reference file in {reference}.")
+    y0 = np.load(reference)
+    output = output or os.path.join(data_dir, OUTPUT_FILENAME)
+    index_path = os.path.join(data_dir, INDEX_FILENAME)
+
+    runs = find_runs(data_dir)
+    key = settings_key(y0, modo)
+    cached = {} if force else load_index(index_path)
+    # Runs that are no longer on disk are dropped from the index
+    index = {}
+    pending = []
+    for run in runs:
+        signature = run_signature(run, key)
+        entry = cached.get(run["run"])
+        if entry is not None and entry["signature"] == signature:
+            index[run["run"]] = entry
+        else:
+            pending.append((run, signature))
+
+    progress(f"{len(runs)} runs found, {len(runs) - len(pending)} unchanged, {len(pending)} to analyze")
+    start = time.perf_counter()
+    if pending:
+        workers = workers or os.cpu_count() or 1
+        # Several runs per task keep the pool busy without sending each run
+        # separately, but small enough chunks that the progress moves
+        chunksize = max(1, min(16, len(pending) // (workers * 4)))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(y0, modo)) as executor:
+            # map() returns the results in order, as soon as each one is ready
+            rows_per_run = executor.map(analyze_run, (run for run, _ in pending), chunksize=chunksize)
+            for done, ((run, signature), rows) in enumerate(zip(pending, rows_per_run), start=1):
+                index[run["run"]] = {"signature": signature, "rows": rows}
+                if done % INDEX_SAVE_EVERY == 0 or done == len(pending):
+                    save_index(index_path, index)
+                    progress(f"{done}/{len(pending)} runs analyzed")
+    elif set(index) != set(cached):
+        # Nothing new, but some runs were deleted
+        save_index(index_path, index)
+    elapsed = time.perf_counter() - start
+
+    table = pd.DataFrame([row for run in runs for row in index[run["run"]]["rows"]], columns=COLUMNS)
+    table.to_csv(output, index=False)
+    stats = {"runs": len(runs), "analyzed": len(pending), "cached": len(runs) - len(pending),
+             "time": elapsed}
+    return table, stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute the focal lengths of saved SlideBench measurements")
+    parser.add_argument("data_dir", nargs="?",
+                        help="folder with the measurement folders. Default is the data/ folder of the application")
+    parser.add_argument("--modo", type=int, default=1, choices=[1, 2, 3], help="calculation mode")
+    parser.add_argument("--reference", metavar="FILE",
+                        help=f"reference distances to use. Default is DATA_DIR/{REFERENCE_RELPATH}")
+    parser.add_argument("--workers", type=int, help="number of worker processes. Default is the number of CPUs")
+    parser.add_argument("--output", metavar="FILE", help=f"CSV table to write. Default is DATA_DIR/{OUTPUT_FILENAME}")
+    parser.add_argument("--force", action="store_true", help="analyze every run again, ignoring the index")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir
+    if data_dir is None:
+        # Imported here, utils loads the mm/steps table when imported
+        from utils import external_folder
+        data_dir = external_folder("data")
+
+    try:
+        table, stats = batch_analysis(data_dir, args.reference, args.modo, args.workers,
+                                      args.output, args.force)
+    except FileNotFoundError as e:
+        parser.exit(1, f"{e}\n")
+
+    failed = (table["error"] != "").sum()
+    print(f"{stats['analyzed']} runs analyzed in {stats['time']:.1f} s, {stats['cached']} taken from the index")
+    print(f"{len(table)} results written to {args.output or os.path.join(data_dir, OUTPUT_FILENAME)}"
+          + (f", {failed} filters failed" if failed else ""))
@@ -0,0 +1,444 @@
+"""
+Micro-benchmarks for the performance sensitive parts of SlideBench.
+
+Run from the program/ folder, for example:
+    python benchmarks.py conversion
+
+Each benchmark prints its results to the console so the numbers can be
+compared before and after a change. None of them need the Arduino or the
+camera to be connected.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+def _per_call_time(func, values, repeat=3):
+    """
+    Calls func once for each value and returns the best average time per
+    call in microseconds over several repetitions.
+
+    Parameters
+    ----------
+    func : callable
+        The function to measure. Called with a single argument.
+    values : sequence
+        The arguments to pass to func, one call per value.
+    repeat : int, optional
+        How many times the whole sequence is timed. The fastest run is kept
+        to reduce the influence of other processes. Default is 3.
+
+    Returns
+    -------
+    float
+        The average time per call in microseconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for v in values:
+            func(v)
+        best = min(best, time.perf_counter() - start)
+    return best / len(values) * 1e6
+
+
+# ==========================================================
+#  STEP / MM CONVERSION
+# ==========================================================
+
+def bench_conversion(n_calls=2000):
+    """
+    Compares the per-call latency of the step/mm conversion functions in
+    utils against the previous pandas implementation, which scanned the
+    whole DataFrame with a boolean mask on every call.
+
+    Parameters
+    ----------
+    n_calls : int, optional
+        Number of random values converted per measurement. Default is 2000.
+    """
+    import pandas as pd
+    import utils
+
+    # Rebuild the DataFrame the old implementation used
+    conversion_df = pd.DataFrame({'millimeters': utils.mm_table, 'steps': utils.steps_table})
+
+    def pandas_mm_to_steps(mm_value):
+        mm_value = round(float(mm_value), 2)
+        matches = conversion_df.index[conversion_df['millimeters'] == mm_value]
+        return int(conversion_df.loc[matches[0], 'steps'])
+
+    def pandas_steps_to_mm(steps_value):
+        matches = conversion_df.index[conversion_df['steps'] == steps_value]
+        return float(conversion_df.loc[matches[0], 'millimeters'])
+
+    rng = np.random.default_rng(0)
+    steps_values = [int(s) for s in rng.integers(0, utils.steps_table[-1], n_calls)]
+    mm_values = [round(float(m), 2) for m in rng.uniform(0, utils.mm_table[-1], n_calls)]
+
+    # The pandas path is much slower, so fewer calls are enough to time it
+    n_slow = max(1, n_calls // 20)
+
+    print(f"Conversion table: {len(utils.mm_table)} rows")
+    print(f"{'function':<22}{'pandas (us)':>14}{'numpy (us)':>14}{'speedup':>10}")
+    for name, old, new, values in [
+        ("mm_to_steps", pandas_mm_to_steps, utils.mm_to_steps, mm_values),
+        ("steps_to_mm", pandas_steps_to_mm, utils.steps_to_mm, steps_values),
+    ]:
+        t_old = _per_call_time(old, values[:n_slow])
+        t_new = _per_call_time(new, values)
+        print(f"{name:<22}{t_old:>14.2f}{t_new:>14.2f}{t_old / t_new:>9.0f}x")
+
+    # Batch versions: one call converts every value
+    for name, func, values in [
+        ("mm_to_steps_array", utils.mm_to_steps_array, mm_values),
+        ("steps_to_mm_array", utils.steps_to_mm_array, steps_values),
+    ]:
+        t_batch = _per_call_time(func, [np.asarray(values)]) / len(values)
+        print(f"{name:<22}{'':>14}{t_batch:>14.3f}   (per value, batch of {len(values)})")
+
+
+# ==========================================================
+#  STARTUP
+# ==========================================================
+
+def _time_in_subprocess(code, repeat=3):
+    """
+    Runs a snippet of Python code in a fresh interpreter and returns the
+    fastest wall time, in milliseconds, that the snippet reported.
+    The snippet must print the elapsed seconds on its last output line.
+    A fresh interpreter is needed so that modules already imported by this
+    process do not hide the real import cost.
+    """
+    best = float("inf")
+    here = os.path.dirname(os.path.abspath(__file__))
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], cwd=here,
+                             capture_output=True, text=True, check=True).stdout
+        best = min(best, float(out.strip().splitlines()[-1]))
+    return best * 1e3
+
+
+def bench_startup():
+    """
+    Measures how long loading the step/mm conversion table takes at
+    startup: the previous pandas CSV parse, the first start that compiles
+    the binary cache, and the later starts that memory-map it.
+    """
+    import utils
+
+    timer = "import time; t = time.perf_counter(); {}; print(time.perf_counter() - t)"
+    previous = timer.format(f"import pandas as pd; pd.read_csv({utils.csv_path!r})")
+
+    cache_path = utils.calibration_cache_path()
+
+    def remove_cache():
+        for path in (cache_path, os.path.splitext(cache_path)[0] + ".key"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Cold start: remove the cache before every run so each one rebuilds it
+    cold = float("inf")
+    for _ in range(3):
+        remove_cache()
+        cold = min(cold, _time_in_subprocess(timer.format("import utils"), repeat=1))
+
+    print(f"{'pandas read_csv (previous)':<34}{_time_in_subprocess(previous):>10.1f} ms")
+    print(f"{'import utils, cache rebuilt':<34}{cold:>10.1f} ms")
+    print(f"{'import utils, cache reused':<34}{_time_in_subprocess(timer.format('import utils')):>10.1f} ms")
+
+
+def bench_imports(module="main_gui", top=12):
+    """
+    Import-time profile of the modules loaded before the connection window
+    can open, using the interpreter's own -X importtime option.
+
+    Prints the total import time of the module, the heaviest top level
+    packages it pulls in, and whether the heavy optional dependencies
+    (pandas, sklearn, cv2, openpyxl, pygrabber) were loaded.
+
+    Parameters
+    ----------
+    module : str, optional
+        The module to import. Default is 'main_gui', which is what main.py
+        imports before calling open_window_conexion().
+    top : int, optional
+        How many packages to list. Default is 12.
+    """
+    heavy = ["pandas", "sklearn", "cv2", "openpyxl", "pygrabber", "requests"]
+    code = (f"import sys, {module}; "
+            f"print(','.join(m for m in {heavy!r} if m in sys.modules))")
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=here,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr.strip().splitlines()[-1])
+        return
+
+    # Each stderr line looks like: 'import time:  self | cumulative | name'
+    # The self time of every module is added to its top level package, so
+    # the listing shows which dependency is responsible for the time
+    self_time = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cum, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        self_time[package] = self_time.get(package, 0) + int(own)
+        if name.strip() == module:
+            total = int(cum)
+
+    print(f"import {module}: {total / 1e3:.1f} ms")
+    for package, us in sorted(self_time.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"  {package:<28}{us / 1e3:>10.1f} ms")
+    loaded = result.stdout.strip()
+    print(f"heavy modules loaded: {loaded if loaded else 'none'}")
+
+
+# ==========================================================
+#  FRAME PREPROCESSING
+# ==========================================================
+
+def bench_preprocessing(n_frames=100):
+    """
+    Compares the previous per-consumer frame preparation, a reversed numpy
+    view of the whole frame made contiguous, with the shared FramePipeline
+    of preprocessing.py, on a random 1920x1080 frame. Also compares the
+    live preview rendering before and after downscaling first, and the
+    stacking of 3 measurement frames with numpy and with FrameStack.
+
+    For each method prints the time per frame, the bytes written per frame
+    and the bytes of the new arrays allocated per frame.
+
+    Parameters
+    ----------
+    n_frames : int, optional
+        Number of frames processed per measurement. Default is 100.
+    """
+    import tracemalloc
+
+    from preprocessing import FramePipeline, FrameStack
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (1080, 1920, 3), dtype=np.uint8)
+    pipeline = FramePipeline()
+    owned = pipeline.bgr(frame, copy=True)
+    out_bytes = owned.nbytes
+
+    methods = [
+        # name, function, bytes written per frame
+        ("numpy view + ascontiguousarray (RGB)",
+         lambda f: np.ascontiguousarray(f[::-1, ::-1, ::-1][:, 420:1500, :]), out_bytes),
+        ("FramePipeline.rgb (reused buffer)", pipeline.rgb, 2 * out_bytes),
+        ("numpy view + ascontiguousarray (BGR)",
+         lambda f: np.ascontiguousarray(f[::-1, ::-1][:, 420:1500]), out_bytes),
+        ("FramePipeline.bgr (reused buffer)", pipeline.bgr, out_bytes),
+        ("FramePipeline.bgr (copy=True)", lambda f: pipeline.bgr(f, copy=True), out_bytes),
+    ]
+
+    # Both methods must produce the same image
+    assert np.array_equal(methods[0][1](frame), pipeline.rgb(frame))
+    assert np.array_equal(methods[2][1](frame), pipeline.bgr(frame))
+
+    # Live preview: the previous full size PIL image resized to 400x400,
+    # and FramePipeline.preview, which downscales before orienting.
+    # tracemalloc does not see the memory PIL allocates for its images
+    from PIL import Image
+    preview_bytes = 400 * 400 * 3
+    methods += [
+        ("PIL resize to 400x400 (preview)",
+         lambda f: Image.fromarray(pipeline.rgb(f)).resize((400, 400)), 2 * out_bytes + preview_bytes),
+        ("FramePipeline.preview (400x400)", lambda f: pipeline.preview(f, (400, 400)), 3 * preview_bytes),
+    ]
+
+    print(f"Raw frame {frame.nbytes / 1e6:.1f} MB, region of interest {out_bytes / 1e6:.1f} MB")
+    print(f"{'method':<40}{'ms/frame':>10}{'MB written':>12}{'MB allocated':>14}")
+    for name, func, written in methods:
+        ms = _per_call_time(func, [frame] * n_frames) / 1e3
+        # Allocations of one call, measured separately so tracing does not slow down the timing
+        tracemalloc.start()
+        func(frame)
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:<40}{ms:>10.2f}{written / 1e6:>12.1f}{allocated / 1e6:>14.1f}")
+
+    # Stacking: numpy over copies of the oriented frames, and FrameStack,
+    # which orients each frame directly into its own buffers
+    frames = [rng.integers(0, 256, frame.shape, dtype=np.uint8) for _ in range(3)]
+
+    def numpy_stack(reduce):
+        stack = np.stack([pipeline.bgr(f, copy=True) for f in frames])
+        return np.rint(reduce(stack, axis=0)).astype(np.uint8)
+
+    def frame_stack(stack):
+        stack.reset()
+        for f in frames:
+            pipeline.bgr(f, out=stack.slot(owned.shape))
+            stack.push()
+        return stack.result()
+
+    mean_stack, median_stack = FrameStack(3, "mean"), FrameStack(3, "median")
+    # Same images, up to the rounding of the mean
+    assert np.abs(numpy_stack(np.mean).astype(int) - frame_stack(mean_stack)).max() <= 1
+    assert np.array_equal(numpy_stack(np.median), frame_stack(median_stack))
+    print()
+    print(f"{'stacking of 3 frames':<40}{'ms':>10}")
+    for name, func in [("np.mean of copies", lambda _: numpy_stack(np.mean)),
+                       ("FrameStack mean", lambda _: frame_stack(mean_stack)),
+                       ("np.median of copies", lambda _: numpy_stack(np.median)),
+                       ("FrameStack median", lambda _: frame_stack(median_stack))]:
+        print(f"{name:<40}{_per_call_time(func, [None] * 5) / 1e3:>10.2f}")
+
+
+# ==========================================================
+#  BLOB DETECTION
+# ==========================================================
+
+def _loop_centroids(gray_img, label_map, stats, labels):
+    """The previous centroid computation of compute_distances_to_center, one blob at a time."""
+    centers = []
+    for i in labels:
+        x, y, w, h, _ = stats[i]
+        roi = gray_img[y:y+h, x:x+w]
+        mask = (label_map[y:y+h, x:x+w] == i).astype(np.uint8)
+        I = (roi * mask).astype(np.float32)
+        total_intensity = I.sum()
+        yy, xx = np.indices(I.shape)
+        centers.append(((xx * I).sum() / total_intensity + x, (yy * I).sum() / total_intensity + y))
+    return np.array(centers)
+
+
+def _detection_images(folder=None):
+    """
+    Returns (name, image, filter index) for the detection benchmark: the
+    PNG images of folder, or 1080x1080 frames of the simulated bench for
+    every filter and a few lens positions when folder is None.
+
+    Images saved by the program are named after their filter, e.g. w.png
+    for a reference or z1_r.png for a measurement, which gives the index.
+    Other names use the white (mean of the channels) conversion.
+    """
+    import cv2
+    from focal_measurements import FILTERS
+
+    images = []
+    if folder is not None:
+        for name in sorted(os.listdir(folder)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() != ".png":
+                continue
+            img = cv2.imread(os.path.join(folder, name))
+            idx = FILTERS.index(stem[-1]) if stem[-1] in FILTERS else 0
+            images.append((name, img, idx))
+        return images
+
+    import simulator
+    import utils
+    from preprocessing import FramePipeline
+
+    sim = simulator.Simulation()
+    sim._open_device(115200)
+    # Only render(), the sensor thread is not needed
+    sim.camera.release()
+    pipeline = FramePipeline()
+    for z in (0, 20, 40):
+        for idx, f in enumerate(FILTERS):
+            frame = sim.camera.render((utils.mm_to_steps(z), 1.0, simulator.FILTER_ANGLES[f]))
+            images.append((f"z={z} {f}", pipeline.bgr(frame, copy=True), idx))
+    return images
+
+
+def bench_detection(folder=None, repeat=20):
+    """
+    Per-image latency of the blob detection on 1080x1080 frames, with the
+    steps of compute_distances_to_center() timed separately, before and
+    after the vectorized centroids and the integer channel mean, and the
+    tracking mode of BlobTracker, which only looks around the last blobs.
+
+    Also checks that the new steps give the same results as the previous
+    ones on every image, and stops with an AssertionError if they do not.
+
+    Parameters
+    ----------
+    folder : str, optional
+        Folder with saved images, e.g. data/reference. Default is None,
+        which renders frames with the simulator.
+    repeat : int, optional
+        Number of calls timed per image. Default is 20.
+    """
+    import cv2
+    from focal_measurements import BlobTracker, compute_distances_to_center, weighted_centroids
+
+    images = _detection_images(folder)
+    if not images:
+        print(f"No PNG images in {folder}")
+        return
+
+    steps = {}
+
+    def timed(name, func, *args):
+        t = _per_call_time(lambda _: func(*args), range(repeat)) / 1e3
+        steps[name] = steps.get(name, 0) + t / len(images)
+        return func(*args)
+
+    max_diff = 0.0
+    for name, img, idx in images:
+        # Previous and new white conversions must be identical
+        old_gray = timed("gray, np.mean (previous)", lambda: np.mean(img, axis=2).astype(np.uint8))
+        new_gray = timed("gray, cv2 integer mean", lambda: (cv2.add(cv2.add(img[:, :, 0], img[:, :, 1], dtype=cv2.CV_16U),
+                                                                    img[:, :, 2], dtype=cv2.CV_16U) // 3).astype(np.uint8))
+        assert np.array_equal(old_gray, new_gray), name
+        gray = new_gray if idx == 0 else img[:, :, 3 - idx]
+
+        _, binary = timed("Otsu threshold", cv2.threshold, gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        n, label_map, stats, _ = timed("connected components", cv2.connectedComponentsWithStats, binary, None, 8)
+        labels = list(np.argsort(-stats[1:, cv2.CC_STAT_AREA])[:9] + 1)
+        old = timed("centroids, loop (previous)", _loop_centroids, gray, label_map, stats, labels)
+        new = timed("centroids, vectorized", weighted_centroids, gray, label_map, stats, labels)
+        max_diff = max(max_diff, float(np.abs(old - new).max()))
+        assert np.allclose(old, new, rtol=0, atol=1e-4), name
+
+        full = timed("compute_distances_to_center", compute_distances_to_center, img, idx)
+        # Tracking the blobs locked on the same image must give the same distances
+        tracker = BlobTracker()
+        tracker.locate(img, idx)
+        tracked = timed("BlobTracker.distances (tracked)", tracker.distances, img, idx)
+        assert tracker.stats["searches"] == 1 and np.array_equal(full, tracked), name
+
+    print(f"{len(images)} images, {images[0][1].shape[1]}x{images[0][1].shape[0]}")
+    print(f"{'step':<34}{'ms/image':>10}")
+    for name, ms in steps.items():
+        print(f"{name:<34}{ms:>10.3f}")
+    print(f"largest centroid difference: {max_diff:.2e} px")
+
+
+BENCHMARKS = {
+    "conversion": bench_conversion,
+    "detection": bench_detection,
+    "imports": bench_imports,
+    "preprocessing": bench_preprocessing,
+    "startup": bench_startup,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SlideBench micro-benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS), nargs="?",
+                        help="Benchmark to run. Runs all of them if omitted.")
+    parser.add_argument("--images", metavar="FOLDER",
+                        help="detection: use the PNG images of FOLDER instead of simulated frames")
+    args = parser.parse_args()
+
+    names = [args.benchmark] if args.benchmark else sorted(BENCHMARKS)
+    for name in names:
+        print(f"=== {name} ===")
+        if name == "detection":
+            BENCHMARKS[name](args.images)
+        else:
+            BENCHMARKS[name]()
+        print()
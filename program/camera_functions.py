@@ -1,12 +1,18 @@
-import cv2
 import os
 import time
-import threading
+from time import perf_counter
 from tkinter import simpledialog, messagebox
 from PIL import Image, ImageTk
 import numpy as np
-from pygrabber.dshow_graph import FilterGraph
 from utils import resource_path, external_folder
+from acquisition import Acquisition
+from preprocessing import FramePipeline, FrameStack
+from recorder import VideoRecorder
+
+# cv2 and pygrabber are imported inside the functions that use them instead
+# of here, so that importing this module (which happens before the connection
+# window opens) does not pay for loading OpenCV. They are only loaded the
+# first time the camera is actually used.
 
 # --- Global state variables --- #
 # These variables are shared across all functions in this module.
@@ -14,14 +20,64 @@ from utils import resource_path, external_folder
 
 camera_active = False       # True if the camera is currently streaming live video
 recording = False           # True if a video recording is currently in progress
-cap = None                  # OpenCV VideoCapture object, used to read frames from the camera
-video_writer = None         # OpenCV VideoWriter object, used to write frames to a video file
+cap = None                  # OpenCV VideoCapture object of the open camera, owned by the acquisition thread
+acquisition = None          # Acquisition thread publishing the camera frames, None when the camera is closed
+recorder = None             # VideoRecorder of the recording in progress, see recorder.py
 last_preview_image = None   # Stores the last captured still image (PIL Image) for saving
 image_path = None           # Stores the file path of the last saved image
 save_folder = external_folder("media")  # Default folder where images and videos are saved
 custom_folder_selected = False          # True if the user manually selected a save folder
 width, height = (1920, 1080)            # Resolution used when opening the camera
 camera_index = 2                        # Index of the camera device to use (0, 1, 2, ...)
+# Extra camera devices that are not real DirectShow cameras, such as the
+# virtual camera in simulator.py. Maps the name shown in the connection
+# window to a function that returns an object with the cv2.VideoCapture
+# interface (read, grab, retrieve, set, get, isOpened, release).
+camera_backends = {}
+
+# Crop and orientation of the frames, one pipeline per consumer because each
+# one reuses its own output buffer (see preprocessing.py)
+preview_pipeline = FramePipeline()      # live preview of the main window
+live_view_pipeline = FramePipeline()    # live view of the automatic measurement window
+record_pipeline = FramePipeline()       # video recording thread
+capture_pipeline = FramePipeline()      # still images and measurements, always copied
+
+# --- Live previews (see LivePreview) --- #
+# Maximum number of frames per second drawn by each live preview. The
+# camera delivers about 30, drawing more often would only repeat frames.
+PREVIEW_FPS = 30
+# Draw the achieved frame rate and the display latency on the previews
+PREVIEW_STATUS = True
+
+# --- Settle detection (see capture_stable_image_array) --- #
+# Two frames are considered equal when no block of STABLE_BLOCK x STABLE_BLOCK
+# pixels changed its mean gray level by more than STABLE_THRESHOLD. Averaging
+# over blocks removes most of the sensor noise, while a spot that moves by a
+# pixel or changes brightness still changes its blocks by several levels.
+STABLE_BLOCK = 8
+STABLE_THRESHOLD = 3.0
+# Number of consecutive equal frame pairs needed to call the image stable
+STABLE_FRAMES = 2
+# Upper bound in seconds for the wait, after which the last frame is used
+STABLE_TIMEOUT = 3.0
+# The measurement image is the mean or median (see FrameStack) of the last
+# run of equal frames, at least AVERAGE_FRAMES of them. Those frames are
+# read anyway to detect that the image is stable, so up to STABLE_FRAMES + 1
+# they reduce the noise without any extra wait, each frame above that adds
+# one frame period to every capture. 1 keeps only the last frame.
+AVERAGE_FRAMES = STABLE_FRAMES + 1
+# 'mean' or 'median'
+AVERAGE_METHOD = "mean"
+
+# Maximum time in seconds capture_image_array() waits for a frame
+CAPTURE_TIMEOUT = 2.0
+# Frame stack of capture_stable_image_array(), reused between captures
+_capture_stack = None
+# Acquisition metrics at the time of the last measurement capture, see
+# Acquisition.metrics for the keys. buffer_depth is the number of frames
+# that were waiting in the driver buffer, grab_to_retrieve the time in
+# seconds between the end of a grab and its decoded image.
+capture_metrics = {}
 
 
 # --- Camera setup --- #
@@ -31,7 +87,8 @@ def set_camera_index(index):
     Sets which camera device to use.
     When multiple cameras are connected, each is assigned a number (0, 1, 2...).
     This function updates the global index so all subsequent camera operations
-    use the correct device.
+    use the correct device. The name of one of the camera_backends can be
+    given instead of a number to use that device.
     """
     global camera_index
     # Overwrite the global camera_index with the new value
@@ -43,14 +100,83 @@ def refresh_cameras():
     Scans the computer for connected camera devices and returns their names.
     Called when the connection window opens so the user can select a camera.
     """
+    cameras = []
     try:
+        from pygrabber.dshow_graph import FilterGraph
         # Use pygrabber to query all connected camera devices
         graph = FilterGraph()
         cameras = graph.get_input_devices()
-        # Return the list if cameras were found, otherwise return a placeholder
-        return cameras if cameras else ["No cameras found"]
     except Exception as e:
-        messagebox.showwarning("Error", f"Error detecting cameras: {e}")
+        # Without real cameras the registered backends can still be used
+        if not camera_backends:
+            messagebox.showwarning("Error", f"Error detecting cameras: {e}")
+    # Registered backends are listed after the real cameras, so the
+    # indexes of the real cameras do not change
+    cameras = list(cameras) + list(camera_backends)
+    # Return the list if cameras were found, otherwise return a placeholder
+    return cameras if cameras else ["No cameras found"]
+
+
+def open_camera():
+    """
+    Opens the selected camera device and sets the capture resolution.
+    Uses the registered backend when camera_index is one of the names in
+    camera_backends, and cv2.VideoCapture otherwise.
+
+    Returns
+    -------
+    cv2.VideoCapture or compatible object
+        The opened device. Check isOpened() before reading from it.
+    """
+    import cv2
+
+    if camera_index in camera_backends:
+        device = camera_backends[camera_index]()
+    else:
+        device = cv2.VideoCapture(camera_index)
+    # Set the resolution
+    device.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    device.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    return device
+
+
+def start_acquisition():
+    """
+    Opens the camera and starts the acquisition thread that reads it, if
+    they are not running yet. All the functions that need frames (live
+    views, recording, measurements) read them from acquisition.ring
+    instead of calling cap.read() themselves, see acquisition.py.
+
+    Returns
+    -------
+    Acquisition or None
+        The running acquisition, or None if the camera could not be opened.
+    """
+    global cap, acquisition
+    if acquisition is not None and acquisition.running:
+        return acquisition
+    if acquisition is not None:
+        # The thread stopped by itself, e.g. the camera was unplugged. It
+        # released the device, or does as soon as its last grab returns
+        stop_acquisition()
+    cap = open_camera()
+    if not cap.isOpened():
+        return None
+    acquisition = Acquisition(cap).start()
+    return acquisition
+
+
+def stop_acquisition():
+    """Stops the acquisition thread and releases the camera."""
+    global cap, acquisition
+    if acquisition is not None:
+        # The thread releases the camera once it stopped using it
+        if not acquisition.stop():
+            print("The camera thread did not stop in time, the camera is released when its last read returns.")
+    elif cap is not None:
+        cap.release()
+    acquisition = None
+    cap = None
 
 
 # --- File management --- #
@@ -118,38 +244,121 @@ def get_filename():
 
 # --- Grid overlay --- #
 
+# Grids that can be drawn on the live preview, selected in the GUI
+GRID_TYPES = ["none", "4x4", "radial", "both", "crosshair"]
+GRID_COLOR = (255, 255, 0)  # yellow in RGB, the preview images are RGB
+grid_type = "both"          # Grid currently drawn on the live preview
+# Rendered grids, (grid_type, width, height) -> flat indices of the grid
+# pixels. A grid only depends on its type and the image size, so it is
+# drawn once and then only composited onto each preview frame, which sets
+# a few thousand pixels instead of drawing lines and circles.
+_grid_cache = {}
+
+
+def set_grid_type(value):
+    """
+    Selects the grid drawn on the live preview and on captured images.
+    Called when the user picks a grid in the GUI.
+
+    Parameters
+    ----------
+    value : str
+        One of GRID_TYPES.
+    """
+    global grid_type
+    if value in GRID_TYPES:
+        grid_type = value
+
+
+def _grid_pixels(kind, size):
+    """
+    Returns the pixels covered by a grid, drawing it only the first time a
+    grid type and size are requested.
+
+    Parameters
+    ----------
+    kind : str
+        One of GRID_TYPES:
+        - '4x4': vertical and horizontal lines dividing the image into a 4x4 grid.
+        - 'radial': concentric circles centered in the image.
+        - 'both': both of the above.
+        - 'crosshair': one vertical and one horizontal line through the center.
+        - 'none': no grid.
+    size : tuple (int, int)
+        Width and height of the image.
+
+    Returns
+    -------
+    numpy array
+        Indices of the grid pixels in the flattened height x width image.
+    """
+    import cv2
+
+    key = (kind, size[0], size[1])
+    if key not in _grid_cache:
+        w, h = size
+        layer = np.zeros((h, w), dtype=np.uint8)
+        thickness = 1           # line thickness in pixels
+
+        if kind in ['4x4', 'both']:
+            # Draw 3 vertical and 3 horizontal lines to create a 4x4 grid
+            for i in range(1, 4):
+                x = w * i // 4  # x position of vertical line
+                y = h * i // 4  # y position of horizontal line
+                cv2.line(layer, (x, 0), (x, h), 255, thickness)    # vertical line
+                cv2.line(layer, (0, y), (w, y), 255, thickness)    # horizontal line
+
+        if kind in ['radial', 'both']:
+            # Draw concentric circles from the center outward. The radii are
+            # given for the 1080 pixel wide image and scaled to this size:
+            # start at radius 50, increase by 100 until reaching the edge
+            center = (w // 2, h // 2)   # center of the image
+            scale = min(w, h) / 1080
+            for r in range(50, 540, 100):
+                cv2.circle(layer, center, int(round(r * scale)), 255, thickness)
+
+        if kind == 'crosshair':
+            # One vertical and one horizontal line through the center
+            cv2.line(layer, (w // 2, 0), (w // 2, h), 255, thickness)
+            cv2.line(layer, (0, h // 2), (w, h // 2), 255, thickness)
+
+        _grid_cache[key] = np.flatnonzero(layer)
+    return _grid_cache[key]
+
+
 def add_grid(img, grid_type="both"):
     """
     Draws a grid overlay on top of an image for alignment assistance.
-    Two types available:
-    - '4x4': vertical and horizontal lines dividing the image into a 4x4 grid.
-    - 'radial': concentric circles centered in the image.
-    - 'both': draws both (default).
+    See _grid_pixels() for the available grid types.
     Does not modify the original image, works on a copy.
     """
     # Work on a copy so the original image is not modified
-    img = img.copy()
-    # Get image dimensions
-    h, w, _ = img.shape
-    color = (255, 255, 0)   # yellow color for the grid lines
-    thickness = 1           # line thickness in pixels
-
-    if grid_type in ['4x4', 'both']:
-        # Draw 3 vertical and 3 horizontal lines to create a 4x4 grid
-        for i in range(1, 4):
-            x = w * i // 4  # x position of vertical line
-            y = h * i // 4  # y position of horizontal line
-            cv2.line(img, (x, 0), (x, h), color, thickness)    # vertical line
-            cv2.line(img, (0, y), (w, y), color, thickness)    # horizontal line
-
-    if grid_type in ['radial', 'both']:
-        # Draw concentric circles from the center outward
-        center = (w // 2, h // 2)   # center of the image
-        # Start at radius 50, increase by 100 until reaching the edge
-        for r in range(50, min(w, h) // 2, 100):
-            cv2.circle(img, center, r, color, thickness)
-
-    return img
+    return overlay_grid(np.ascontiguousarray(img).copy(), grid_type)
+
+
+def overlay_grid(image, kind=None):
+    """
+    Draws the cached grid onto an image in place. This is what the live
+    preview uses: the grid is composited on the downscaled preview, so its
+    cost does not depend on the camera resolution.
+
+    Parameters
+    ----------
+    image : numpy array
+        Contiguous height x width x 3 RGB image, modified in place.
+    kind : str, optional
+        One of GRID_TYPES. Default is the grid selected in the GUI.
+
+    Returns
+    -------
+    numpy array
+        The same image.
+    """
+    kind = grid_type if kind is None else kind
+    if kind != "none":
+        h, w, _ = image.shape
+        image.reshape(-1, 3)[_grid_pixels(kind, (w, h))] = GRID_COLOR
+    return image
 
 
 # --- Live camera preview --- #
@@ -160,15 +369,11 @@ def toggle_camera(camera_label, btn):
     When turned on: opens the camera, starts the live feed, updates button text.
     When turned off: stops the feed, releases the camera, shows placeholder image.
     """
-    global camera_active, cap
+    global camera_active
     if not camera_active:
-        # Open the camera device at the specified index
-        cap = cv2.VideoCapture(camera_index)
-        # Set the resolution
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-        # Check if the camera opened successfully
-        if not cap.isOpened():
+        # Open the camera device at the specified index and resolution
+        # and start reading its frames in the background
+        if start_acquisition() is None:
             messagebox.showwarning("Error", "Unable to open camera in toggle_camera.")
             return
         # Mark the camera as active and start the live frame loop
@@ -178,8 +383,11 @@ def toggle_camera(camera_label, btn):
     else:
         # Mark camera as inactive — this stops the update_frame loop
         camera_active = False
+        preview = getattr(camera_label, "preview", None)
+        if preview is not None:
+            preview.stop()
         # Release the camera resource so other programs can use it
-        cap.release()
+        stop_acquisition()
         btn.config(text="Activate Camera")
         try:
             # Load and display the default placeholder image
@@ -193,37 +401,149 @@ def toggle_camera(camera_label, btn):
             camera_label.config(image='')
 
 
+class LivePreview:
+    """
+    Live camera feed shown in a Tk label, drawn at most PREVIEW_FPS times
+    per second.
+
+    Each tick takes the newest frame of the acquisition ring. Frames that
+    arrived in between are dropped, and a tick that finds no new frame does
+    nothing, so a slow UI never works through a backlog of old frames. The
+    frame is downscaled before it is oriented (FramePipeline.preview) and
+    pasted into the same PhotoImage, instead of creating a new Tk image
+    for every frame.
+
+    Parameters
+    ----------
+    label : tk.Label
+        Label that displays the feed.
+    pipeline : FramePipeline
+        Pipeline used for the frames, with its own buffers.
+    size : tuple
+        (width, height) of the preview in pixels.
+    grid : bool, optional
+        Draw the grid selected in the GUI on the frames. Default is True.
+
+    Attributes
+    ----------
+    metrics : dict
+        Statistics of the preview:
+            fps: frames drawn per second over the last second
+            latency: seconds between the camera delivering the last frame
+                and the frame being on the label
+            shown: frames drawn since start()
+            dropped: camera frames that were never drawn
+    """
+
+    def __init__(self, label, pipeline, size, grid=True):
+        self.label = label
+        self.pipeline = pipeline
+        self.size = size
+        self.grid = grid
+        self.metrics = {"fps": 0.0, "latency": None, "shown": 0, "dropped": 0}
+        self._photo = None
+        self._after_id = None
+
+    def start(self):
+        """Starts drawing frames, restarting the loop if it was already running."""
+        self.stop()
+        # The label may show another image (the placeholder), so a new
+        # PhotoImage is created with the first frame
+        self._photo = None
+        self._last_seq = -1
+        self.metrics.update(fps=0.0, latency=None, shown=0, dropped=0)
+        # Pacing uses perf_counter, real time, since the UI always runs in
+        # real time. The latency uses time.monotonic(), the clock of the
+        # frame timestamps (replaced by simulator.py during simulations).
+        self._next_tick = self._window_start = perf_counter()
+        self._window_frames = 0
+        self._tick()
+
+    def stop(self):
+        """Stops drawing frames. The label keeps the last one."""
+        if self._after_id is not None:
+            self.label.after_cancel(self._after_id)
+            self._after_id = None
+
+    def _tick(self):
+        """Draws the newest frame if there is one, then schedules the next tick."""
+        self._after_id = None
+        if not camera_active:
+            return
+        latest = acquisition.ring.latest() if acquisition else None
+        if latest is not None and latest.seq != self._last_seq:
+            if self._last_seq >= 0:
+                self.metrics["dropped"] += max(latest.seq - self._last_seq - 1, 0)
+            self._last_seq = latest.seq
+            self._show(latest)
+
+        now = perf_counter()
+        # Achieved frame rate, counted over windows of one second
+        if now - self._window_start >= 1.0:
+            self.metrics["fps"] = self._window_frames / (now - self._window_start)
+            self._window_start = now
+            self._window_frames = 0
+
+        # Next tick one period after the previous one. If drawing took
+        # longer than that the UI fell behind: wait one millisecond so Tk
+        # can handle its events, and do not try to catch up
+        self._next_tick = max(self._next_tick + 1.0 / PREVIEW_FPS, now)
+        delay = max(int((self._next_tick - now) * 1000), 1)
+        self._after_id = self.label.after(delay, self._tick)
+
+    def _show(self, frame):
+        """Draws a frame of the acquisition ring on the label."""
+        # Crop to the region of interest, shrink to the preview size, flip
+        # vertically and horizontally and convert BGR to RGB
+        small = self.pipeline.preview(frame.image, self.size)
+        if self.grid:
+            # Add the selected alignment grid on top of the resized frame
+            overlay_grid(small)
+        if PREVIEW_STATUS:
+            self._draw_status(small)
+        img = Image.fromarray(small)
+        if self._photo is None:
+            # Convert to Tkinter compatible format, once
+            self._photo = ImageTk.PhotoImage(img)
+            # Keep a reference to prevent garbage collection
+            self.label.imgtk = self._photo
+            self.label.config(image=self._photo)
+        else:
+            # Update the existing Tk image in place
+            self._photo.paste(img)
+        self.metrics["latency"] = float(time.monotonic() - frame.timestamp)
+        self.metrics["shown"] += 1
+        self._window_frames += 1
+
+    def _draw_status(self, image):
+        """Writes the achieved frame rate and the latency of the previous frame in a corner of image."""
+        import cv2
+
+        latency = self.metrics["latency"]
+        text = f"{self.metrics['fps']:.0f} fps"
+        if latency is not None:
+            text += f"  {latency * 1000:.0f} ms"
+        position = (5, image.shape[0] - 6)
+        # Black outline so the text is readable on any background
+        cv2.putText(image, text, position, cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 3, cv2.LINE_AA)
+        cv2.putText(image, text, position, cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1, cv2.LINE_AA)
+
+
+def _start_preview(label, pipeline, size, grid=True):
+    """Starts the LivePreview of label, creating it the first time."""
+    preview = getattr(label, "preview", None)
+    if preview is None:
+        preview = label.preview = LivePreview(label, pipeline, size, grid)
+    preview.start()
+    return preview
+
+
 def update_frame(camera_label):
     """
-    Reads one frame from the camera and updates the live preview display.
-    Called repeatedly every 10ms using Tkinter's after() method to create
-    a smooth live feed. Stops automatically when camera_active is False.
+    Starts the live preview display of the main window, see LivePreview.
+    It runs with Tkinter's after() method until camera_active is False.
     """
-    if camera_active:
-        # Read the next frame from the camera
-        ret, frame = cap.read()
-        if ret:
-            # Flip vertically [::-1 on axis 0], horizontally [::-1 on axis 1]
-            # and convert BGR to RGB [::-1 on axis 2] all in one operation
-            frame = frame[::-1, ::-1, ::-1]
-            # Crop to the region of interest (removes black borders)
-            frame = frame[:, 420:1500, :]
-            # Make the array contiguous in memory for performance
-            frame = np.ascontiguousarray(frame)
-            # Add the alignment grid on top of the frame
-            frame_with_grid = add_grid(frame, grid_type='both')
-            # Convert to PIL Image and resize for display
-            img = Image.fromarray(frame_with_grid).resize((400, 400))
-            # Convert to Tkinter compatible format
-            img_tk = ImageTk.PhotoImage(img)
-            # Keep a reference to prevent garbage collection
-            camera_label.imgtk = img_tk
-            # Update the label with the new frame
-            camera_label.config(image=img_tk)
-
-        # Schedule this function to run again after 10ms
-        # this creates the continuous live feed loop
-        camera_label.after(10, lambda: update_frame(camera_label))
+    _start_preview(camera_label, preview_pipeline, (400, 400))
 
 
 # --- Image capture --- #
@@ -234,21 +554,21 @@ def take_image(camera_label, last_image_label, btn_save_image):
     Stores the image in memory for saving later and displays it
     in the image preview label. Shows the save button after capture.
     """
-    global cap, last_preview_image
-    # Read one frame from the camera
-    ret, frame = cap.read()
-    if ret:
-        # Flip vertically, horizontally and convert BGR to RGB for display
-        frame = frame[::-1, ::-1, ::-1]
-        # Crop to the region of interest
-        frame_rgb = frame[:, 420:1500, :]
+    import cv2
+
+    global last_preview_image
+    # Take the newest frame published by the acquisition thread
+    latest = acquisition.ring.latest() if acquisition else None
+    if latest is not None:
+        # Crop to the region of interest, flip vertically, horizontally and
+        # convert BGR to RGB for display. Copied because the image is kept
+        frame_rgb = capture_pipeline.rgb(latest.image, copy=True)
         # Store the image as a PIL Image in memory so it can be saved later
         # when the user clicks the Save button
         last_preview_image = Image.fromarray(frame_rgb)
-        # Add the alignment grid for the preview display
-        preview_frame = add_grid(frame_rgb, grid_type='both')
-        # Resize for display and convert to Tkinter format
-        img_resized = Image.fromarray(preview_frame).resize((400, 400))
+        # Resize for display and add the selected alignment grid
+        small = cv2.resize(frame_rgb, (400, 400), interpolation=cv2.INTER_AREA)
+        img_resized = Image.fromarray(overlay_grid(small))
         img_tk = ImageTk.PhotoImage(img_resized)
         # Keep a reference to prevent garbage collection
         last_image_label.imgtk = img_tk
@@ -311,68 +631,52 @@ def update_image_display(label, path):
 def start_recording():
     """
     Starts recording a video from the live camera feed.
-    Creates a new video file in a daily subfolder, reads the first frame
-    to determine the resolution, then starts a background recording thread.
+    Creates a new video file in a daily subfolder and starts a VideoRecorder,
+    which writes the frames of the acquisition thread in the background.
     """
-    global recording, video_writer
-    # Set recording flag to True so record_video loop keeps running
-    recording = True
-    # Define the video codec (MP4 format)
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    global recording, recorder
+    if acquisition is None or not acquisition.running:
+        messagebox.showwarning("Error", "Activate the camera before recording.")
+        return
     # Get today's folder and build the video file path
     day_folder = create_daily_folder()
     filename = time.strftime("video_%H%M%S.mp4")
     path = os.path.join(day_folder, filename)
-    # Read one frame to determine the actual frame dimensions
-    ret, frame = cap.read()
-    if not ret:
-        messagebox.showwarning("Error", "Could not read initial frame for recording.")
-        recording = False
+    # The recorder reads one frame to determine the frame dimensions
+    recorder = VideoRecorder(acquisition, record_pipeline, path)
+    if not recorder.start(timeout=CAPTURE_TIMEOUT):
+        messagebox.showwarning("Error", "Could not start the video recording.")
+        recorder = None
         return
-    # Process the frame the same way as the live feed
-    frame = frame[::-1, ::-1, :]
-    frame = frame[:, 420:1500, :]
-    frame = np.ascontiguousarray(frame)
-    # Use local variables to avoid overwriting the global width and height
-    frame_height, frame_width = frame.shape[:2]
-    # Create the VideoWriter object that will write frames to the file
-    video_writer = cv2.VideoWriter(path, fourcc, 15, (frame_width, frame_height))
-    # Start the recording loop in a background thread
-    # daemon=True means the thread will stop if the main program exits
-    threading.Thread(target=record_video, daemon=True).start()
+    recording = True
 
 
 def stop_recording():
     """
-    Stops the current video recording and releases the video writer.
-    Setting recording to False causes the record_video loop to exit.
-    """
-    global recording, video_writer
-    # Setting this to False stops the while loop in record_video()
-    recording = False
-    if video_writer:
-        # Release the writer to finalize and close the video file
-        video_writer.release()
+    Stops the current video recording. Waits until the queued frames are
+    written and the video file is closed, then reports the recording stats.
 
-
-def record_video():
-    """
-    Continuously reads frames from the camera and writes them to the video file.
-    Runs in a background thread. Stops when recording or camera_active is False.
+    Returns
+    -------
+    dict or None
+        VideoRecorder.stop() stats, None if nothing was being recorded.
     """
-    global cap
-    # Keep recording as long as both flags are True
-    while recording and camera_active:
-        ret, frame = cap.read()
-        if ret:
-            # Flip vertically and horizontally
-            # note: only 2 axes flipped here, BGR is kept for the video writer
-            frame = frame[::-1, ::-1, :]
-            # Crop to the region of interest
-            frame = frame[:, 420:1500, :]
-            frame = np.ascontiguousarray(frame)
-            # Write the frame to the video file
-            video_writer.write(frame)
+    global recording, recorder
+    recording = False
+    if recorder is None:
+        return None
+    # Waits for the recorder threads, then closes the file
+    stats = recorder.stop()
+    folder, filename = os.path.split(recorder.path)
+    message = (f"Video saved as {filename} in {folder}\n"
+               f"{stats['duration']:.1f} s at {recorder.fps:.0f} fps, "
+               f"{stats['duplicated']} frames repeated, "
+               f"{stats['dropped_queue'] + stats['dropped_stale']} camera frames lost")
+    if stats["encode_fps"]:
+        message += f"\nEncoder: {stats['encode_fps']:.0f} frames/s"
+    recorder = None
+    messagebox.showinfo("Recording saved", message)
+    return stats
 
 
 def toggle_recording(btn):
@@ -382,9 +686,10 @@ def toggle_recording(btn):
     """
     global recording
     if not recording:
-        # Start recording and update button text
+        # Start recording and update button text if it started
         start_recording()
-        btn.config(text="Stop Recording")
+        if recording:
+            btn.config(text="Stop Recording")
     else:
         # Stop recording and reset button text
         stop_recording()
@@ -398,10 +703,10 @@ def turn_off_camera_auto():
     Stops and releases the camera when the automatic measurement window is closed.
     Releases the camera resource so it can be reused by the main GUI.
     """
-    global cap, camera_active
-    if cap and camera_active:
-        # Release the camera hardware resource
-        cap.release()
+    global camera_active
+    if camera_active:
+        # Stop the acquisition and release the camera hardware resource
+        stop_acquisition()
         # Mark the camera as inactive
         camera_active = False
 
@@ -410,65 +715,180 @@ def start_live_view(target_label):
     """
     Starts a live camera preview in the automatic measurement window.
     Opens the camera if not already active, then continuously updates
-    the target label with live frames every 10ms.
+    the target label with live frames, see LivePreview.
     """
-    global cap, camera_active
+    global camera_active
 
     if not camera_active:
-        # Open the camera device
-        cap = cv2.VideoCapture(camera_index)
-        # Set the resolution using the global variables
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-        if not cap.isOpened():
+        # Open the camera device at the resolution set in the global variables
+        if start_acquisition() is None:
             messagebox.showwarning("Error", "Unable to open camera in start_live_view function.")
             return
         camera_active = True
 
-    def update():
-        """Inner function that reads and displays one frame, then schedules itself again."""
-        if camera_active:
-            ret, frame = cap.read()
-            if ret:
-                # Flip vertically, horizontally and convert BGR to RGB for display
-                frame = frame[::-1, ::-1, ::-1]
-                # Crop to the region of interest
-                frame = frame[:, 420:1500, :]
-                frame = np.ascontiguousarray(frame)
-                # Resize smaller than main GUI since this is a side panel view
-                img = Image.fromarray(frame).resize((300, 300))
-                img_tk = ImageTk.PhotoImage(img)
-                # Keep reference to prevent garbage collection
-                target_label.imgtk = img_tk
-                target_label.config(image=img_tk)
-            # Schedule the next frame update after 10ms
-            target_label.after(10, update)
-
-    # Start the update loop
-    update()
-
-
-def capture_image_array():
+    # Smaller than the main GUI since this is a side panel view, and
+    # without grid since it is only used to watch the measurement
+    _start_preview(target_label, live_view_pipeline, (300, 300), grid=False)
+
+
+def capture_image_array(after=None):
     """
     Captures a single frame from the camera and returns it as a NumPy array.
     Unlike take_image() which is for GUI preview, this is used for scientific
     measurements. Returns raw image data for processing by measurement functions.
     Opens the camera automatically if not already open.
-    """
-    global cap
-    # If the camera is not open, open it before capturing
-    if not cap or not cap.isOpened():
-        cap = cv2.VideoCapture(camera_index)
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-
-    ret, frame = cap.read()
-    if ret:
-        # Crop to the region of interest
-        frame = frame[:, 420:1500, :]
-        # Flip vertically, horizontally, it's in BGR format
-        frame = frame[::-1, ::-1]
-        return frame
-    else:
-        messagebox.showwarning("Error", "Failed to capture image in capture_image_array.")
-        return None
\ No newline at end of file
+
+    Parameters
+    ----------
+    after : float, optional
+        A time.monotonic() value. If given, the returned frame was exposed
+        after this time, see Acquisition.frame_after(). Default is None,
+        which returns the next frame published.
+
+    Returns
+    -------
+    numpy array or None
+        The BGR image, or None if the camera did not deliver a frame
+        within CAPTURE_TIMEOUT.
+    """
+    acq = start_acquisition()
+    frame = None
+    if acq is not None:
+        if after is None:
+            frame = acq.ring.next_after(acq.ring.latest_seq, timeout=CAPTURE_TIMEOUT)
+        else:
+            frame = acq.frame_after(after, timeout=CAPTURE_TIMEOUT)
+    if frame is not None:
+        capture_metrics.update(acq.metrics)
+        # Crop to the region of interest and flip vertically, horizontally,
+        # it's in BGR format. Copied because the ring slot will be reused
+        return capture_pipeline.bgr(frame.image, copy=True)
+    # No dialog here, this runs in the measurement threads. The callers
+    # report the failure, e.g. with a CaptureError
+    return None
+
+
+def _stability_signature(frame):
+    """
+    Reduces a frame to the block averaged gray image compared by
+    capture_stable_image_array(), a few thousand float32 values.
+    """
+    import cv2
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+    small = cv2.resize(gray, (w // STABLE_BLOCK, h // STABLE_BLOCK), interpolation=cv2.INTER_AREA)
+    return small.astype(np.float32)
+
+
+def _stack_for_capture(capacity, method):
+    """Returns the empty frame stack of capture_stable_image_array(), reallocated if needed."""
+    global _capture_stack
+    if _capture_stack is None or _capture_stack.capacity < capacity or _capture_stack.method != method:
+        _capture_stack = FrameStack(capacity, method)
+    _capture_stack.reset()
+    return _capture_stack
+
+
+def capture_stable_image_array(after=None, threshold=STABLE_THRESHOLD, frames=STABLE_FRAMES, timeout=STABLE_TIMEOUT,
+                               average=AVERAGE_FRAMES, method=AVERAGE_METHOD):
+    """
+    Reads frames until the image stops changing and returns the mean or
+    median of the last equal frames, cropped and flipped like
+    capture_image_array().
+
+    Used instead of a fixed delay after the filter wheel, the LED or the
+    motor moved: the wait ends as soon as the filter stopped vibrating and
+    the camera exposure adapted, and at most after timeout seconds.
+
+    The frames of the current run of equal frames are stacked while they
+    are compared (see FrameStack), so averaging them costs a few
+    milliseconds per frame and, up to frames + 1 frames, no extra wait.
+    A frame that differs from the previous one starts a new stack. On a
+    timeout the frames of the last run are combined.
+
+    Parameters
+    ----------
+    after : float, optional
+        A time.monotonic() value. If given, the first frame compared was
+        exposed after this time, see Acquisition.frame_after(). Default is None.
+    threshold : float, optional
+        Largest change of a block's mean gray level between two frames that
+        still counts as equal. Default is STABLE_THRESHOLD.
+    frames : int, optional
+        Number of consecutive equal frame pairs required. Default is STABLE_FRAMES.
+    timeout : float, optional
+        Maximum time to wait in seconds. Default is STABLE_TIMEOUT.
+    average : int, optional
+        Minimum number of equal frames combined into the image, 1 returns
+        the last frame. Default is AVERAGE_FRAMES.
+    method : str, optional
+        'mean' or 'median'. Default is AVERAGE_METHOD.
+
+    Returns
+    -------
+    tuple (numpy array or None, dict)
+        The image, or None if the camera did not deliver any frame, and a
+        dict with the number of 'frames' read, whether the image was
+        'stable' before the timeout, the number of frames 'averaged' into
+        the image, and the capture_metrics.
+    """
+    deadline = time.monotonic() + timeout
+    acq = start_acquisition()
+    frame = None
+    if acq is not None:
+        if after is None:
+            frame = acq.ring.next_after(acq.ring.latest_seq, timeout=timeout)
+        else:
+            frame = acq.frame_after(after, timeout=timeout)
+
+    # The stack never holds more than the frames of one run, which stops
+    # growing once it has both frames + 1 and average frames
+    stack = _stack_for_capture(max(frames + 1, average), method) if average > 1 else None
+    previous = None
+    image = None
+    equal = 0
+    count = 0
+    while frame is not None:
+        # Only the region of interest is compared, the orientation does not matter
+        roi = capture_pipeline.crop(frame.image)
+        signature = _stability_signature(roi)
+        same = previous is not None and np.max(np.abs(signature - previous)) <= threshold
+        if stack is None:
+            # Crop to the region of interest and flip vertically and horizontally,
+            # it's in BGR format. Copied because the ring slot will be reused
+            candidate = capture_pipeline.bgr(frame.image, copy=True)
+        else:
+            # Same crop and flip, written directly into the free slot of the
+            # stack. The frames already stacked are not touched
+            capture_pipeline.bgr(frame.image, out=stack.slot(roi.shape, roi.dtype))
+        if acq.ring.is_valid(frame):
+            count += 1
+            equal = equal + 1 if same else 0
+            previous = signature
+            if stack is None:
+                image = candidate
+            else:
+                if not same:
+                    # This frame starts a new run of equal frames
+                    stack.restart()
+                stack.push()
+            if equal >= frames and (stack is None or len(stack) >= average):
+                break
+        # else the slot was overwritten while it was read: the frame is
+        # skipped, and the run of equal frames stacked so far is kept
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        frame = acq.ring.next_after(frame.seq, timeout=remaining)
+
+    averaged = 0 if image is None else 1
+    if stack is not None and len(stack):
+        averaged = len(stack)
+        image = stack.result()
+
+    if acq is not None:
+        capture_metrics.update(acq.metrics)
+    info = {"frames": count, "stable": equal >= frames, "averaged": averaged}
+    info.update(capture_metrics)
+    return image, info
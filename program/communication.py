@@ -1,7 +1,9 @@
 import serial
 import time
+import queue
+import threading
 from serial.tools import list_ports
-from utils import steps_to_mm
+from utils import steps_to_mm, mm_to_steps
 from tkinter import messagebox
 
 # Global variable holding the active Arduino serial connection.
@@ -9,6 +11,356 @@ from tkinter import messagebox
 # object when a connection has been established.
 arduino = None
 
+# Extra serial devices that are not real COM ports, such as the simulated
+# Arduino in simulator.py. Maps the name shown in the connection window to a
+# function that takes the baudrate and returns an already open object with
+# the serial.Serial interface (read, write, in_waiting, is_open, close).
+port_backends = {}
+
+# --- Background serial I/O --- #
+# The Arduino streams 'POS:<steps>' lines several times per second. Reading
+# one line per GUI poll could not keep up, so the serial buffer grew without
+# bound and the displayed position lagged further and further behind.
+# Instead, a reader thread drains the port continuously and keeps only the
+# latest position, and a writer thread sends the queued commands one at a
+# time, so commands coming from the GUI and from the measurement threads
+# never interleave on the port.
+
+_reader_thread = None           # Thread running _reader_loop()
+_writer_thread = None           # Thread running _writer_loop()
+_write_queue = queue.Queue()    # Commands waiting to be sent, None stops the writer
+_stop_event = threading.Event() # Set to ask the reader thread to exit
+
+
+class PositionState:
+    """
+    Latest motor position reported by the Arduino.
+
+    Written by the serial reader thread and read by the GUI and the
+    measurement code. A lock protects the values, and a condition variable
+    wakes up the threads waiting for the motor to reach a position.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Notified every time a new position is stored
+        self._changed = threading.Condition(self._lock)
+        self.steps = None       # Last reported position in steps, None if none yet
+        self.timestamp = None   # time.monotonic() when it was received
+        self.count = 0          # Number of positions received since the connection
+
+    def reset(self):
+        """Forgets the stored position, used when a new connection is opened."""
+        with self._lock:
+            self.steps = None
+            self.timestamp = None
+            self.count = 0
+
+    def update(self, steps):
+        """
+        Stores a new position and wakes up every waiting thread.
+
+        Parameters
+        ----------
+        steps : int
+            The position in steps reported by the Arduino.
+        """
+        with self._changed:
+            self.steps = steps
+            self.timestamp = time.monotonic()
+            self.count += 1
+            self._changed.notify_all()
+
+    def latest(self):
+        """
+        Returns the latest position without blocking.
+
+        Returns
+        -------
+        tuple (int or None, float or None)
+            The position in steps and the time.monotonic() timestamp at
+            which it was received, or (None, None) if none was received yet.
+        """
+        with self._lock:
+            return self.steps, self.timestamp
+
+    def wait_for(self, predicate, timeout=None):
+        """
+        Blocks until predicate(steps) is True for the latest position.
+
+        Parameters
+        ----------
+        predicate : callable
+            Called with the position in steps every time a new one arrives.
+        timeout : float or None, optional
+            Maximum time to wait in seconds, None waits forever.
+
+        Returns
+        -------
+        bool
+            True if the condition was met, False if the timeout expired.
+        """
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: self.steps is not None and predicate(self.steps), timeout)
+
+
+# Shared position state, updated by the reader thread
+position_state = PositionState()
+
+
+# Acknowledgement lines sent by the Arduino, e.g. 'FILTER: r' when the
+# filter wheel finished turning and 'LED: 255' after a LED command
+ACK_KEYS = ("FILTER", "LED")
+
+
+class AckState:
+    """
+    Latest acknowledgement of each kind received from the Arduino.
+
+    Every acknowledgement gets a sequence number. A thread that wants to
+    wait for the answer to a command takes mark() before sending it, and
+    then waits for an acknowledgement newer than the mark, so an answer
+    that arrives before the wait starts is not missed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Notified every time a new acknowledgement is stored
+        self._changed = threading.Condition(self._lock)
+        self.count = 0      # Number of acknowledgements received since the connection
+        self._last = {}     # key -> (sequence number, value) of the latest one
+
+    def reset(self):
+        """Forgets the stored acknowledgements, used when a new connection is opened."""
+        with self._lock:
+            self.count = 0
+            self._last = {}
+
+    def mark(self):
+        """
+        Returns the sequence number of the latest acknowledgement, to be
+        passed as since to wait_for().
+        """
+        with self._lock:
+            return self.count
+
+    def update(self, key, value):
+        """
+        Stores a new acknowledgement and wakes up every waiting thread.
+
+        Parameters
+        ----------
+        key : str
+            The kind of acknowledgement, one of ACK_KEYS.
+        value : str
+            The text after the ':', e.g. 'r' for 'FILTER: r'.
+        """
+        with self._changed:
+            self.count += 1
+            self._last[key] = (self.count, value)
+            self._changed.notify_all()
+
+    def wait_for(self, key, since, value=None, timeout=None):
+        """
+        Blocks until an acknowledgement of the given kind newer than since
+        is received.
+
+        Parameters
+        ----------
+        key : str
+            The kind of acknowledgement, one of ACK_KEYS.
+        since : int
+            A value returned by mark() before the command was sent.
+        value : str or None, optional
+            If given, only an acknowledgement with this value counts.
+        timeout : float or None, optional
+            Maximum time to wait in seconds, None waits forever.
+
+        Returns
+        -------
+        bool
+            True if the acknowledgement was received, False if the timeout expired.
+        """
+        def received():
+            seq, last_value = self._last.get(key, (0, None))
+            return seq > since and (value is None or last_value == value)
+
+        with self._changed:
+            return self._changed.wait_for(received, timeout)
+
+
+# Shared acknowledgement state, updated by the reader thread
+acknowledgements = AckState()
+
+
+def _parse_position(line):
+    """
+    Extracts the step count from a position line sent by the Arduino.
+
+    Two kinds of lines carry a position:
+        'POS:<steps>'   periodic position report
+        'DONE:<steps>'  sent once when a move finishes ('ARRIVED:' is
+                        accepted as well)
+
+    The Arduino reports positions as negative numbers (its origin is at the
+    limit switch), so the absolute value is returned.
+
+    Parameters
+    ----------
+    line : str
+        One line received from the Arduino, without the newline.
+
+    Returns
+    -------
+    int or None
+        The position in steps, or None if the line is not a valid position.
+    """
+    if not line.startswith(("POS:", "DONE:", "ARRIVED:")):
+        return None
+    try:
+        # Split on ':' and take the second part to get the step count
+        # e.g. 'POS: -1250' → '-1250' → 1250
+        return abs(int(line.split(":")[1].strip()))
+    except ValueError:
+        # Malformed or truncated line — ignore it
+        return None
+
+
+def _parse_ack(line):
+    """
+    Splits an acknowledgement line sent by the Arduino, e.g. 'FILTER: r'.
+
+    Parameters
+    ----------
+    line : str
+        One line received from the Arduino, without the newline.
+
+    Returns
+    -------
+    tuple (str, str) or None
+        The key and the value, or None if the line is not an acknowledgement.
+    """
+    key, sep, value = line.partition(":")
+    if not sep or key not in ACK_KEYS:
+        return None
+    return key, value.strip()
+
+
+def _handle_lines(lines):
+    """
+    Processes the complete lines received in one read from the port.
+    Only the last position of the batch is stored, older ones are stale.
+    Since a DONE line is handled like any other position, the threads
+    waiting in wait_until_position() wake up as soon as a move finishes,
+    instead of waiting for the next periodic POS line.
+    Acknowledgements are all stored, in the order they were received.
+
+    Parameters
+    ----------
+    lines : list of str
+        The decoded lines, without newlines, oldest first.
+    """
+    latest = None
+    for line in lines:
+        steps = _parse_position(line)
+        if steps is not None:
+            latest = steps
+            continue
+        ack = _parse_ack(line)
+        if ack is not None:
+            acknowledgements.update(*ack)
+    if latest is not None:
+        position_state.update(latest)
+
+
+def _reader_loop(port):
+    """
+    Runs in a background thread while the Arduino is connected.
+    Reads everything waiting in the serial buffer in one call, splits it
+    into lines and hands the complete lines to _handle_lines(). An
+    incomplete last line is kept until the rest of it arrives.
+
+    Parameters
+    ----------
+    port : serial.Serial
+        The open serial connection.
+    """
+    pending = b""
+    while not _stop_event.is_set():
+        try:
+            # Read all the bytes already waiting, or block until at least one
+            # arrives (at most the port timeout) when the buffer is empty
+            data = port.read(port.in_waiting or 1)
+        except (serial.SerialException, OSError, TypeError, AttributeError):
+            # The port was closed or the device was unplugged
+            break
+        if not data:
+            continue
+        pending += data
+        *complete, pending = pending.split(b"\n")
+        if complete:
+            _handle_lines([raw.decode("utf-8", errors="replace").strip() for raw in complete])
+
+
+def _writer_loop(port, commands):
+    """
+    Runs in a background thread while the Arduino is connected.
+    Sends the queued commands one at a time, in the order they were queued.
+    A None in the queue stops the thread once all earlier commands are sent.
+
+    Parameters
+    ----------
+    port : serial.Serial
+        The open serial connection.
+    commands : queue.Queue
+        The write queue of this connection.
+    """
+    while True:
+        command = commands.get()
+        if command is None:
+            break
+        try:
+            # Encode the command as bytes and send it over the serial port
+            # The newline '\n' acts as the command terminator for the Arduino
+            port.write((command + '\n').encode())
+        except (serial.SerialException, OSError) as e:
+            print(f"Command '{command}' not sent: {e}")
+
+
+def _start_io_threads(port):
+    """Starts the reader and writer threads for a newly opened port."""
+    global _reader_thread, _writer_thread, _write_queue
+    _stop_event.clear()
+    position_state.reset()
+    acknowledgements.reset()
+    # Every connection has its own queue: commands left over by a previous
+    # writer that did not stop in time are never sent to this port
+    _write_queue = queue.Queue()
+    # daemon=True means the threads stop if the main program exits
+    _reader_thread = threading.Thread(target=_reader_loop, args=(port,), daemon=True)
+    _writer_thread = threading.Thread(target=_writer_loop, args=(port, _write_queue), daemon=True)
+    _reader_thread.start()
+    _writer_thread.start()
+
+
+def _stop_io_threads():
+    """
+    Stops the reader and writer threads. Commands already queued are sent
+    before the writer exits, so e.g. the 'off' sent when the window closes
+    still reaches the Arduino. The commands a writer could not send in
+    time are dropped with its queue, see _start_io_threads().
+    """
+    global _reader_thread, _writer_thread
+    if _writer_thread is not None:
+        _write_queue.put(None)
+        _writer_thread.join(timeout=2)
+    _stop_event.set()
+    if _reader_thread is not None:
+        _reader_thread.join(timeout=2)
+    _reader_thread = None
+    _writer_thread = None
+
 
 def refresh_ports():
     """
@@ -25,14 +377,17 @@ def refresh_ports():
     # list_ports.comports() returns a list of port info objects
     # We extract just the device name (e.g. 'COM3') from each one
     ports = [port.device for port in list_ports.comports()]
-    return ports
+    # Registered backends are listed after the real ports
+    return ports + list(port_backends)
 
 
 def connect_arduino(port, baudrate=115200):
     """
     Attempts to establish a serial connection with the Arduino on the given port.
     If successful, stores the connection in the global arduino variable so all
-    other functions in this module can use it.
+    other functions in this module can use it, and starts the background
+    reader and writer threads. The names registered in port_backends are
+    opened with their backend instead of as a real COM port.
 
     A 2 second delay is added after opening the port because the Arduino
     resets itself when a serial connection is opened, and needs time to boot
@@ -52,13 +407,22 @@ def connect_arduino(port, baudrate=115200):
         True if the connection was established successfully, False otherwise.
     """
     global arduino
+    if port in port_backends:
+        # Registered backend e.g. the simulator: already open and ready,
+        # there is no board that needs time to reset
+        arduino = port_backends[port](baudrate)
+        _start_io_threads(arduino)
+        return True
     try:
         # Open the serial port with the specified settings
-        # timeout=1 means read operations will wait at most 1 second
-        arduino = serial.Serial(port, baudrate, timeout=1)
+        # timeout=0.1 means a read waits at most 100ms, so the reader thread
+        # notices quickly when it is asked to stop
+        arduino = serial.Serial(port, baudrate, timeout=0.1)
         # Wait for the Arduino to finish resetting after the port is opened
         # Without this delay, the first commands sent may be missed
         time.sleep(2)
+        # Start reading positions and sending commands in the background
+        _start_io_threads(arduino)
         return True
     except serial.SerialException:
         # Connection failed (port busy, wrong port, device not found, etc.)
@@ -70,12 +434,15 @@ def connect_arduino(port, baudrate=115200):
 def disconnect_arduino():
     """
     Safely closes the Arduino serial connection if it is currently open.
-    Resets the global arduino variable to None after closing.
+    Stops the background threads, sending any command still queued first,
+    and resets the global arduino variable to None after closing.
     Should be called when the application closes to release the serial port
     so other programs can use it.
     """
     global arduino
     if arduino and arduino.is_open:
+        # Let the writer send the pending commands and stop both threads
+        _stop_io_threads()
         # Close the serial port to release the hardware resource
         arduino.close()
         # Reset the global so other functions know there is no active connection
@@ -88,6 +455,10 @@ def send_command(command):
     A newline character is appended to the command because the Arduino sketch
     uses readline() to read incoming commands and expects a newline terminator.
 
+    The command is queued and written by the writer thread, so this function
+    returns immediately and commands from different threads are sent one
+    after another in the order they were queued.
+
     If the Arduino is not connected, the command is not sent and a message
     is printed to the console for debugging purposes.
 
@@ -98,27 +469,39 @@ def send_command(command):
         Do not include the newline — it is added automatically.
     """
     if arduino and arduino.is_open:
-        # Encode the command as bytes and send it over the serial port
-        # The newline '\n' acts as the command terminator for the Arduino
-        arduino.write((command + '\n').encode())
+        # Hand the command to the writer thread
+        _write_queue.put(command)
     else:
         # Arduino is not connected — show a debug message so the developer
         # knows the command was not delivered
         messagebox.showwarning("Error", f"Command '{command}' not sent: Arduino not connected.")
 
 
+def read_current_steps():
+    """
+    Returns the latest motor position reported by the Arduino, in steps.
+    Does not block and does not touch the serial port.
+
+    Returns
+    -------
+    int or None
+        The position in steps, or None if no position was received yet.
+    """
+    steps, _ = position_state.latest()
+    return steps
+
+
 def read_current_position():
     """
-    Reads the current motor position reported by the Arduino and converts
-    it from steps to millimeters.
+    Returns the latest motor position reported by the Arduino, converted
+    from steps to millimeters.
 
     The Arduino continuously sends position updates in the format:
         'POS:<steps>'
     For example: 'POS:1250' means the motor is at 1250 steps from origin.
 
-    This function checks if data is available in the serial buffer,
-    reads one line, validates the format, extracts the step count,
-    and converts it to millimeters using steps_to_mm().
+    These lines are read and parsed by the reader thread, so this function
+    only looks up the stored value and converts it using steps_to_mm().
 
     Called repeatedly every 50ms by the position update loop in the GUI
     to keep the digital position display up to date.
@@ -127,26 +510,86 @@ def read_current_position():
     -------
     float or None
         The current motor position in millimeters, or None if no valid
-        position data is available in the serial buffer.
-    """
-    # Only attempt to read if the Arduino is connected and data is waiting
-    if arduino and arduino.in_waiting:
-        # Read one line from the serial buffer and decode it from bytes to string
-        # strip() removes any trailing whitespace or newline characters
-        line = arduino.readline().decode('utf-8').strip()
-
-        # Check that the line follows the expected 'POS:<steps>' format
-        if line.startswith("POS:"):
-            try:
-                # Split on ':' and take the second part to get the step count
-                # e.g. 'POS:1250' → '1250' → 1250
-                steps = abs(int(line.split(":")[1].strip()))
-                # Convert the step count to millimeters using the utility function
-                return steps_to_mm(steps)
-            except Exception as e:
-                # If parsing fails (malformed data, unexpected format, etc.)
-                # show the error and return None gracefully
-                messagebox.showwarning("Error", f"Error parsing position data: {e}")
-
-    # Return None if no data was available or parsing failed
-    return None
\ No newline at end of file
+        position has been received yet.
+    """
+    steps = read_current_steps()
+    if steps is None:
+        return None
+    # Convert the step count to millimeters using the utility function
+    return steps_to_mm(steps)
+
+
+def wait_until_position(target, timeout=None, tolerance=0):
+    """
+    Blocks until the Arduino reports a position equal to the target,
+    without polling: the calling thread sleeps until the reader thread
+    receives a new position.
+
+    The Arduino sends a 'DONE:<steps>' line the moment a move finishes, so
+    this returns as soon as the motor stops. If the motor is already at the
+    target it returns immediately. Positions are compared in steps, so
+    there are no floating point equality issues.
+
+    Parameters
+    ----------
+    target : float
+        The target position in millimeters.
+    timeout : float or None, optional
+        Maximum time to wait in seconds. None waits forever.
+    tolerance : int, optional
+        Accepted difference in steps between the reported and the target
+        position. Default is 0 (exact match).
+
+    Returns
+    -------
+    bool
+        True if the position was reached, False if the timeout expired.
+
+    Raises
+    ------
+    ValueError
+        If the target is outside the conversion table.
+    """
+    target_steps = mm_to_steps(target)
+    return position_state.wait_for(lambda steps: abs(steps - target_steps) <= tolerance, timeout)
+
+
+def ack_marker():
+    """
+    Returns a marker to pass to wait_for_ack(). Take it before sending the
+    command whose acknowledgement will be waited for.
+
+    Returns
+    -------
+    int
+        The sequence number of the latest acknowledgement received.
+    """
+    return acknowledgements.mark()
+
+
+def wait_for_ack(key, since, value=None, timeout=None):
+    """
+    Blocks until the Arduino acknowledges a command, without polling.
+
+    The sketch sends 'FILTER: <x>' once the filter wheel has finished
+    turning to filter x, and 'LED: <pwm>' after every LED command. Older
+    sketches send neither, in which case this waits for the full timeout.
+
+    Parameters
+    ----------
+    key : str
+        'FILTER' or 'LED'.
+    since : int
+        The value returned by ack_marker() before the command was sent.
+    value : str or None, optional
+        If given, only an acknowledgement with this value counts, e.g. the
+        filter letter.
+    timeout : float or None, optional
+        Maximum time to wait in seconds. None waits forever.
+
+    Returns
+    -------
+    bool
+        True if the acknowledgement was received, False if the timeout expired.
+    """
+    return acknowledgements.wait_for(key, since, value, timeout)
@@ -1,6 +1,12 @@
+import sys
 from main_gui import open_window_conexion
 
 APP_VERSION = "1.0.1"
 
 if __name__ == "__main__":
+    if "--simulator" in sys.argv:
+        # List a simulated Arduino and camera in the connection window,
+        # so the program can be used without the device (see simulator.py)
+        import simulator
+        simulator.enable()
     open_window_conexion()
\ No newline at end of file
@@ -8,13 +8,13 @@ from controller import (move_left, move_right, stop_motor, set_speed, move_motor
     activate_filter, led_on, led_off, led_intensity)
 from communication import (send_command, read_current_position, arduino, refresh_ports, connect_arduino, disconnect_arduino)
 from camera_functions import (set_camera_index, toggle_camera, take_image, capture_image_array, set_save_folder, save_current_image,
-    toggle_recording, update_image_display, refresh_cameras)
+    toggle_recording, update_image_display, refresh_cameras, set_grid_type)
 import camera_functions
 from automatic_gui import open_auto_mode_window
 from utils import resource_path
-from focal_measurements import compute_distances_to_center, format_distances
+from focal_measurements import BlobTracker, MeasurementError, format_distances
+from persistence import close_writer
 from utils import check_for_updates
-import numpy as np
 
 
 def open_window_conexion():
@@ -96,6 +96,10 @@ def open_window_conexion():
             # If camera is not found, default to index 0
             cam_index = 0
 
+        if selected_camera in camera_functions.camera_backends:
+            # Simulated or other non DirectShow camera, selected by name
+            cam_index = selected_camera
+
         # Update the global camera index in camera_functions
         set_camera_index(cam_index)
 
@@ -117,8 +121,8 @@ def open_window_conexion():
     # Automatically scan for ports and cameras when the window first opens
     refresh()
     
-    # Check for updates when the app first opens
-    win.after(1000, check_for_updates)
+    # Check for updates in the background when the app first opens
+    check_for_updates(win)
     win.mainloop()
     
     # Start the Tkinter event loop for this window
@@ -270,6 +274,16 @@ def build_camera_controls(parent, font, camera_label, last_image_label):
     btn_measurement = tk.Button(btns_frame, text="Measure distances", width=20, height=2)
     btn_measurement.grid(row=6, column=0, padx=5, pady=5)
 
+    # --- Grid selector --- #
+    # Grid drawn on the live preview to help aligning the bench
+    grid_frame = tk.Frame(btns_frame)
+    grid_frame.grid(row=7, column=0, pady=5)
+    tk.Label(grid_frame, text="Grid:").pack(side="left")
+    grid_var = tk.StringVar(value=camera_functions.grid_type)
+    grid_menu = tk.OptionMenu(grid_frame, grid_var, *camera_functions.GRID_TYPES, command=set_grid_type)
+    grid_menu.config(width=10)
+    grid_menu.pack(side="left", padx=5)
+
     # --- Reference image --- #
     # Load the reference image showing the 3x3 blob grid layout
     # This helps the user understand which points are being measured
@@ -292,6 +306,10 @@ def build_camera_controls(parent, font, camera_label, last_image_label):
     result_text.grid(row=11, column=0, pady=10)
     result_text.configure(state='disabled')
 
+    # Repeated measurements at the same position only look for the blobs
+    # around their last position, see BlobTracker
+    tracker = BlobTracker()
+
     def test_measurement():
         """
         Captures an image from the camera, computes the distances between
@@ -305,12 +323,12 @@ def build_camera_controls(parent, font, camera_label, last_image_label):
             messagebox.showwarning("Error", "Could not capture image.")
             return
 
-        # Run the blob detection and distance calculation on the captured image
-        distances = compute_distances_to_center(img, 0)
-
-        if np.all(distances == 0):
-            # All distances are zero means no valid blobs were detected
-            messagebox.showwarning("Error", "Could not find blobs in image.")
+        try:
+            # Run the blob detection and distance calculation on the captured image
+            distances = tracker.distances(img, 0)
+        except MeasurementError as e:
+            # No valid blobs were detected
+            messagebox.showwarning("Error", f"Could not find blobs in image.\n{e}")
             return
 
         # Enable the text widget temporarily to update its content
@@ -600,16 +618,20 @@ def start_interface():
         """
         Handles cleanup when the user closes the main window.
         Turns off the LED, releases the camera and video writer if active,
-        closes the Arduino serial connection, and destroys the window.
+        waits for the measurements being saved, closes the Arduino serial
+        connection, and destroys the window.
         """
         # Turn off the LED light source before closing
         led_off()
-        # Release the camera if it is currently open
-        if camera_functions.cap:
-            camera_functions.cap.release()
-        # Release the video writer if a recording is in progress
-        if camera_functions.recording and camera_functions.video_writer:
-            camera_functions.video_writer.release()
+        # Finish the video file if a recording is in progress, before the
+        # camera stops delivering frames
+        if camera_functions.recorder is not None:
+            camera_functions.recorder.stop()
+        # Stop reading the camera and release it if it is currently open
+        camera_functions.stop_acquisition()
+        # Wait until the measurements being saved are completely written
+        if not close_writer():
+            messagebox.showwarning("Warning", "Some measurement files could not be saved in time.")
         # Close the Arduino serial connection if it is open
         disconnect_arduino()
         # Destroy the main window and exit the application
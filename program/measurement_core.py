@@ -0,0 +1,702 @@
+"""
+Image analysis and focal length calculation of SlideBench, without any
+GUI or hardware code.
+
+Everything here works on images and arrays only: finding the 9 blobs of
+the spot pattern, measuring their distances to the center, and computing
+the focal length from the distances at two screen positions. Nothing
+opens a dialog: a failed detection raises a MeasurementError subclass,
+which the GUI turns into a warning (see focal_measurements.py and the
+windows). This makes the functions usable from scripts, worker threads
+and process pools, e.g. to analyze saved measurements without a display.
+
+focal_measurements.py re-exports these functions, so existing imports
+from there keep working.
+"""
+import numpy as np
+
+# cv2 and pandas are imported inside the functions that use them, like in
+# focal_measurements.py, so importing this module stays cheap.
+
+# List of optical filters used in measurements, in order
+# w = white, r = red, g = green, b = blue
+FILTERS = ['w', 'r', 'g', 'b']
+
+# Largest spread of the 9 blob areas, as median absolute deviation over the
+# median, for a detection to be accepted
+MAX_AREA_SPREAD = 0.2
+
+# Blob tracking (see BlobTracker): pixels added on each side of a blob to
+# get the window it is looked for in, about the distance a spot can drift
+# between two frames at the same position
+TRACK_MARGIN = 8
+# Relative change of a blob area above which the tracker searches the whole
+# image again, the blobs change size when the screen moves
+TRACK_AREA_TOLERANCE = 0.25
+
+
+# --- Errors --- #
+
+class MeasurementError(Exception):
+    """
+    A measurement step could not give a result.
+
+    Attributes
+    ----------
+    filter : str or None
+        The filter of the image that failed, set by the procedures that
+        go through several filters. None if unknown.
+    """
+    filter = None
+
+
+class CaptureError(MeasurementError):
+    """The camera did not deliver an image."""
+
+
+class BlobCountError(MeasurementError):
+    """
+    Fewer than the 9 blobs of the pattern were found in an image, e.g.
+    because the LED was off or the image is saturated by ambient light.
+
+    Attributes
+    ----------
+    found : int
+        Number of blobs found.
+    """
+
+    def __init__(self, found):
+        self.found = found
+        super().__init__(f"Less than 10 blobs found ({found} blobs and the background)")
+
+
+class BlobSimilarityError(MeasurementError):
+    """
+    The 9 largest blobs have too different areas to be the spots of the
+    pattern, e.g. because of reflections or a partly covered spot.
+
+    Attributes
+    ----------
+    spread : float
+        Median absolute deviation of the areas over their median.
+    """
+
+    def __init__(self, spread):
+        self.spread = spread
+        super().__init__(f"There's not similitude between the blobs "
+                         f"(area spread {spread:.0%}, at most {MAX_AREA_SPREAD:.0%})")
+
+
+# --- Blob detection --- #
+
+def weighted_centroids(gray_img, label_map, stats, labels):
+    """
+    Computes the intensity-weighted centroid of several blobs in one pass.
+
+    Each blob is read through a window the size of the largest blob
+    bounding box, placed at the top left corner of its own bounding box,
+    and all the windows are stacked into one array. The pixels of other
+    blobs, or outside the image, are given zero weight, so every centroid
+    is sum(coordinate * intensity) / sum(intensity) over its own pixels,
+    the same as looping over the blobs, but without a Python loop and
+    reading only the pixels around the blobs.
+
+    Parameters
+    ----------
+    gray_img : numpy array
+        Grayscale image (HxW) whose values weight the pixels.
+    label_map : numpy array
+        Label map from cv2.connectedComponentsWithStats.
+    stats : numpy array
+        Stats from cv2.connectedComponentsWithStats.
+    labels : sequence of int
+        Labels of the blobs.
+
+    Returns
+    -------
+    numpy array
+        (len(labels), 2) array of (x, y) centroids in image coordinates.
+    """
+    labels = np.asarray(labels)
+    # Bounding boxes: x, y = top left corner, w, h = size
+    x, y, w, h = stats[labels, :4].T
+    height, width = label_map.shape
+    # Image coordinates of the rows and columns of each window
+    rows = y[:, None] + np.arange(h.max())
+    cols = x[:, None] + np.arange(w.max())
+    # Windows can reach past the image edge: those pixels are read at the
+    # edge and masked out below
+    r = np.minimum(rows, height - 1)[:, :, None]
+    c = np.minimum(cols, width - 1)[:, None, :]
+    inside = (rows < height)[:, :, None] & (cols < width)[:, None, :]
+    # Intensity of the pixels belonging to each blob, 0 everywhere else
+    mask = (label_map[r, c] == labels[:, None, None]) & inside
+    intensity = np.where(mask, gray_img[r, c], 0).astype(np.float64)
+    # Sum of all intensity values, used as the weight denominator
+    total_intensity = intensity.sum(axis=(1, 2))
+    # Weighted centroid: sum(coordinate * intensity) / sum(intensity)
+    cx = np.einsum("bij,bj->b", intensity, cols) / total_intensity
+    cy = np.einsum("bij,bi->b", intensity, rows) / total_intensity
+    return np.column_stack([cx, cy])
+
+
+def order_grid(centers):
+    """
+    Orders the 9 blob centers of the 3x3 grid in reading order: left to
+    right, top to bottom, so the center blob is at index 4.
+
+    The centers are sorted by Y and split into three rows of three, then
+    each row is sorted by X. The result only depends on the coordinates,
+    and it is correct as long as the lowest blob of a row is above the
+    highest blob of the next row, which holds for rotations of the
+    pattern up to about 26 degrees (tan = 1/2).
+
+    Parameters
+    ----------
+    centers : numpy array
+        (9, 2) array of (x, y) centers in any order. More columns can
+        follow x and y, they are reordered with their center.
+
+    Returns
+    -------
+    numpy array
+        Array of the same shape with the centers in reading order.
+    """
+    # Rows from top to bottom (higher Y value = lower on screen)
+    rows = centers[np.argsort(centers[:, 1], kind="stable")].reshape(3, 3, -1)
+    # Within each row, points from left to right by X coordinate
+    order = np.argsort(rows[:, :, 0], axis=1, kind="stable")
+    return np.take_along_axis(rows, order[:, :, None], axis=1).reshape(centers.shape)
+
+
+def grayscale(img, idx):
+    """
+    Returns the grayscale image analyzed for a filter.
+
+    Parameters
+    ----------
+    img : numpy array
+        BGR image (HxWx3), or a region of it.
+    idx : int
+        Index of the filter in FILTERS. The white filter uses the mean of
+        the three channels, the color filters their own channel.
+
+    Returns
+    -------
+    numpy array
+        HxW uint8 image. A view of img for the color filters.
+    """
+    import cv2
+
+    if idx == 0:
+        # Integer mean of the channels, the same values as
+        # np.mean(img, axis=2).astype(np.uint8) but several times faster
+        b, g, r = cv2.split(img)
+        total = cv2.add(cv2.add(b, g, dtype=cv2.CV_16U), r, dtype=cv2.CV_16U)
+        return (total // 3).astype(np.uint8)
+    # Red, green and blue filters: channels 2, 1 and 0 of the BGR image
+    return img[:, :, 3 - idx]
+
+
+def find_blobs(gray_img):
+    """
+    Finds the 9 blobs of the 3x3 grid in a whole grayscale image.
+
+    The function performs the following steps:
+    1. Binarize using Otsu thresholding
+    2. Find connected components (blobs)
+    3. Select the 9 largest blobs
+    4. Validate blob similarity
+    5. Compute intensity-weighted center for each blob
+    6. Order blobs left to right, top to bottom (see order_grid)
+
+    Parameters
+    ----------
+    gray_img : numpy array
+        Grayscale image, see grayscale().
+
+    Returns
+    -------
+    tuple (numpy array, float)
+        (9, 5) array with one (x, y, area, width, height) row per blob in
+        reading order, and the Otsu threshold used.
+
+    Raises
+    ------
+    BlobCountError
+        If fewer than 9 blobs are found.
+    BlobSimilarityError
+        If the areas of the 9 largest blobs are too different.
+    """
+    import cv2
+
+    # Binarize the grayscale image using Otsu's method
+    # Otsu automatically finds the optimal threshold value
+    # Result: binary image where blobs are white (255) and background is black (0)
+    threshold, binary = cv2.threshold(gray_img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # Find all connected white regions (blobs) in the binary image
+    # Returns: number of blobs, a label map, stats per blob, and centroids
+    # connectivity=8 means diagonal pixels are considered connected
+    num_labels, label_map, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+
+    # We expect exactly 9 blobs (the 3x3 grid) plus 1 for the background
+    # If fewer than 10 labels found, the detection failed
+    if num_labels < 10:
+        raise BlobCountError(num_labels - 1)
+
+    # Build a list of (label_index, area) for all blobs except background (index 0)
+    areas = [(i, stats[i, cv2.CC_STAT_AREA]) for i in range(1, num_labels)]
+    # Sort by area descending and keep only the 9 largest blobs
+    # This filters out any small noise blobs
+    top_areas = sorted(areas, key=lambda x: x[1], reverse=True)[:9]
+
+    # Validate that the 9 selected blobs have similar areas
+    # If they are very different, the detection is unreliable
+    area_values = np.array([a[1] for a in top_areas])
+    median = np.median(area_values)
+    # MAD (Median Absolute Deviation) measures how spread out the areas are
+    mad = np.median(np.abs(area_values - median))
+
+    # If the spread is more than MAX_AREA_SPREAD of the median, reject the detection
+    if mad / median > MAX_AREA_SPREAD:
+        raise BlobSimilarityError(mad / median)
+
+    # Compute the intensity-weighted centroid for each of the 9 blobs
+    # This gives a more accurate center position than a simple geometric center
+    labels = [i for i, _ in top_areas]
+    centers = weighted_centroids(gray_img, label_map, stats, labels)
+    blobs = np.column_stack([centers, stats[labels, cv2.CC_STAT_AREA],
+                             stats[labels, cv2.CC_STAT_WIDTH], stats[labels, cv2.CC_STAT_HEIGHT]])
+
+    # Order the 9 blobs in reading order, see order_grid():
+    # [1, 2, 3, 4, 5, 6, 7, 8, 9] where 5 is the center
+    return order_grid(blobs), threshold
+
+
+def distances_from_grid(ordered_grid):
+    """
+    Computes the distances from each of the 8 outer blobs to the center
+    blob.
+
+    Parameters
+    ----------
+    ordered_grid : numpy array
+        (9, 2) array of (x, y) centers in reading order, see order_grid().
+
+    Returns
+    -------
+    numpy array
+        Array of 8 distances in pixels, rounded to 2 decimal places.
+    """
+    # The center blob is always at index 4 (position 5 in the grid)
+    center = ordered_grid[4]
+
+    # Compute Euclidean distance from each of the 8 outer blobs to the center
+    # Skip index 4 (the center itself)
+    offsets = np.delete(ordered_grid, 4, axis=0) - center
+    distances = np.hypot(offsets[:, 0], offsets[:, 1])
+
+    # Round to 2 decimal places and return as a NumPy array
+    return np.round(distances, 2)
+
+
+def compute_distances_to_center(img, idx):
+    """
+    Analyzes an image to find 9 blob points arranged in a 3x3 grid
+    and computes the distances from each of the 8 outer blobs to the
+    center blob using intensity-weighted centroids.
+
+    The function performs the following steps:
+    1. Convert to grayscale (see grayscale)
+    2. Find and order the 9 blobs in the whole image (see find_blobs)
+    3. Compute distances from each outer blob to the center blob
+
+    Parameters
+    ----------
+    img : numpy array
+        The input image as a NumPy array (BGR, shape HxWx3).
+    idx : int
+        Index of the filter in FILTERS.
+
+    Returns
+    -------
+    numpy array
+        Array of 8 distances in pixels, rounded to 2 decimal places.
+
+    Raises
+    ------
+    BlobCountError, BlobSimilarityError
+        If the blobs can not be found, see find_blobs().
+    """
+    blobs, _ = find_blobs(grayscale(img, idx))
+    return distances_from_grid(blobs[:, :2])
+
+
+class BlobTracker:
+    """
+    Finds the 9 blobs in a series of images where they barely move, such
+    as the frames taken at the same screen position.
+
+    The first image of each filter is searched completely with
+    find_blobs(), which locks the tracker on the blobs. In the following
+    images each blob is only looked for in a window around its last
+    position, TRACK_MARGIN pixels larger than the blob on each side: the
+    window is thresholded at the Otsu level of the lock, its largest
+    component is the blob and its intensity-weighted centroid the new
+    sub-pixel position. This is the same estimator as the full search, so
+    tracked and searched distances agree.
+
+    The tracker searches the whole image again when a blob is not found
+    in its window, touches the window edge (it moved too far) or changed
+    its area by more than TRACK_AREA_TOLERANCE (e.g. the screen moved).
+
+    Parameters
+    ----------
+    margin : int, optional
+        Pixels added around the blob bounding box. Default is TRACK_MARGIN.
+    area_tolerance : float, optional
+        Relative change of area accepted. Default is TRACK_AREA_TOLERANCE.
+
+    Attributes
+    ----------
+    stats : dict
+        tracked: images located by tracking
+        searches: images searched completely
+    """
+
+    def __init__(self, margin=TRACK_MARGIN, area_tolerance=TRACK_AREA_TOLERANCE):
+        self.margin = margin
+        self.area_tolerance = area_tolerance
+        self.stats = {"tracked": 0, "searches": 0}
+        # Filter index -> (locked blobs as returned by find_blobs, Otsu threshold)
+        self._locks = {}
+
+    def reset(self):
+        """Forgets the locked blobs, the next image of every filter is searched completely."""
+        self._locks.clear()
+
+    def locate(self, img, idx):
+        """
+        Finds the 9 blob centers in an image.
+
+        Parameters
+        ----------
+        img : numpy array
+            BGR image (HxWx3).
+        idx : int
+            Index of the filter in FILTERS.
+
+        Returns
+        -------
+        numpy array
+            (9, 2) array of (x, y) centers in reading order.
+
+        Raises
+        ------
+        BlobCountError, BlobSimilarityError
+            If the full search fails too, see find_blobs().
+        """
+        lock = self._locks.get(idx)
+        if lock is not None:
+            centers = self._track(img, idx, *lock)
+            if centers is not None:
+                self.stats["tracked"] += 1
+                # The area and size of the lock are kept as the reference
+                lock[0][:, :2] = centers
+                return centers
+        self.stats["searches"] += 1
+        # A failed search forgets the lock, the blobs may have changed
+        self._locks.pop(idx, None)
+        self._locks[idx] = find_blobs(grayscale(img, idx))
+        return self._locks[idx][0][:, :2].copy()
+
+    def distances(self, img, idx):
+        """
+        Same as compute_distances_to_center(), using the tracked blobs.
+
+        Returns
+        -------
+        numpy array
+            Array of 8 distances in pixels, rounded to 2 decimal places.
+
+        Raises
+        ------
+        BlobCountError, BlobSimilarityError
+            If the blobs can not be found, see find_blobs().
+        """
+        return distances_from_grid(self.locate(img, idx))
+
+    def _track(self, img, idx, blobs, threshold):
+        """Locates each locked blob in its window, returns None if one of them is lost."""
+        import cv2
+
+        height, width = img.shape[:2]
+        centers = np.empty((9, 2))
+        for i, (cx, cy, area, w, h) in enumerate(blobs):
+            # Window around the last position, larger than the blob
+            x0, x1 = int(cx - w / 2 - self.margin), int(cx + w / 2 + self.margin) + 1
+            y0, y1 = int(cy - h / 2 - self.margin), int(cy + h / 2 + self.margin) + 1
+            if x0 < 0 or y0 < 0 or x1 > width or y1 > height:
+                return None
+            gray = grayscale(img[y0:y1, x0:x1], idx)
+            _, binary = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY)
+            num_labels, label_map, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+            if num_labels < 2:
+                return None
+            # The blob is the largest component, smaller ones are noise
+            label = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+            bx, by, bw, bh, b_area = stats[label]
+            if bx == 0 or by == 0 or bx + bw == x1 - x0 or by + bh == y1 - y0:
+                # Cut by the window edge: the blob moved too far
+                return None
+            if abs(b_area - area) > self.area_tolerance * area:
+                return None
+            centers[i] = weighted_centroids(gray, label_map, stats, [label])[0] + (x0, y0)
+        return centers
+
+
+# --- Focal length --- #
+
+def focal_distance_from_distances(y0, y1, y2, dz, modo=1):
+    """
+    Computes the effective focal length from the blob distances measured
+    at two different screen positions and a reference distance array.
+
+    The focal length is computed using the formula:
+        f = (y0 / (y1 - y2)) * dz
+
+    where y0 is the reference distance, y1 and y2 are the distances at
+    positions z1 and z2, and dz = |z2 - z1| is the screen displacement.
+
+    Three calculation modes are available depending on the physical
+    configuration of the lens and screen positions:
+    - Mode 1: both z1 and z2 are before the focal point
+    - Mode 2: z1 is before and z2 is after the focal point
+    - Mode 3: both z1 and z2 are after the focal point
+
+    Parameters
+    ----------
+    y0 : numpy array
+        Reference distances (8 values) captured at position 0.
+    y1 : numpy array
+        Distances (8 values) measured in the image captured at position z1.
+    y2 : numpy array
+        Distances (8 values) measured in the image captured at position z2.
+    dz : float
+        The absolute distance between z1 and z2 in mm.
+    modo : int
+        Calculation mode (1, 2, or 3). Default is 1.
+
+    Returns
+    -------
+    tuple
+        (results_array, final_table)
+        results_array: [effective_f, err_effective_f, delta_f] rounded to 3 decimals
+        final_table: pandas DataFrame with the full measurement table
+    """
+    import pandas as pd
+
+    # Define which distance indices belong to the p and l measurement groups
+    # These correspond to specific blob positions in the 3x3 grid
+    spots_p = np.array([4, 1, 3, 6])   # indices for p group blobs
+    spots_l = np.array([2, 0, 5, 7])   # indices for l group blobs
+    # Inverse indices used when the screen is past the focal point
+    inv_p = np.array([3, 6, 4, 1])
+    inv_l = np.array([5, 7, 2, 0])
+
+    # Each mode applies different sign conventions and index orderings
+    # to account for whether the distances are measured before or after
+    # the focal point where the image flips
+    modos = {
+        1: (y1,  y2,  spots_p, spots_l, spots_p, spots_l),  # both before focal point
+        2: (y1, -y2,  spots_p, spots_l, inv_p,   inv_l),    # z1 before, z2 after
+        3: (-y1, -y2, inv_p,   inv_l,   inv_p,   inv_l)     # both after focal point
+    }
+
+    # Unpack the effective y values and index arrays for the selected mode
+    y1_eff, y2_eff, idx_y1p, idx_y1l, idx_y2p, idx_y2l = modos[modo]
+
+    # Compute focal lengths for p and l groups using the focal length formula
+    # f = (y0 / (y1 - y2)) * dz
+    f_p = (y0[spots_p] / (y1_eff[idx_y1p] - y2_eff[idx_y2p])) * dz
+    f_l = (y0[spots_l] / (y1_eff[idx_y1l] - y2_eff[idx_y2l])) * dz
+
+    def stats_and_table(name, idx, idx_y1, idx_y2, y1v, y2v, f_vals):
+        """
+        Computes statistics and builds a formatted DataFrame for one
+        measurement group (either p or l).
+
+        Parameters
+        ----------
+        name : str
+            The group name ('p' or 'l'), shown in the first column.
+        idx : numpy array
+            The blob indices for this group, used to look up y0 values.
+        idx_y1 : numpy array
+            The indices to use when looking up y1 values.
+        idx_y2 : numpy array
+            The indices to use when looking up y2 values.
+        y1v : numpy array
+            The effective y1 distance array (may be negated depending on mode).
+        y2v : numpy array
+            The effective y2 distance array (may be negated depending on mode).
+        f_vals : numpy array
+            The 4 computed focal length values for this group.
+
+        Returns
+        -------
+        tuple (float, float, pd.DataFrame)
+            mean_f: mean focal length
+            std_f: standard deviation of focal lengths
+            table: formatted DataFrame with all measurement details
+        """
+        # Compute mean and standard deviation of the focal lengths
+        mean_f = np.mean(f_vals)
+        std_f = np.std(f_vals)
+
+        # Build the results table with one row per spot
+        table = pd.DataFrame({
+            '': [name, '', '', ''],         # group name only in first row
+            'Spot Number': [1, 2, 3, 4],    # spot numbers 1 to 4
+            'y0 (px)': y0[idx],             # reference distances
+            'y1 (px)': y1v[idx_y1],         # distances at z1
+            'y2 (px)': y2v[idx_y2],         # distances at z2
+            'f (mm)': np.round(f_vals, 2),  # individual focal lengths
+            # Mean ± std shown only in the first row, rest left empty
+            'f ± δf (mm)': [f'{round(mean_f, 2)} ± {round(std_f, 2)}', '', '', '']
+        })
+        return mean_f, std_f, table
+
+    # Build the tables and compute statistics for both groups
+    mean_fp, std_fp, tab_p = stats_and_table('p', spots_p, idx_y1p, idx_y2p, y1_eff, y2_eff, f_p)
+    mean_fl, std_fl, tab_l = stats_and_table('l', spots_l, idx_y1l, idx_y2l, y1_eff, y2_eff, f_l)
+
+    # Compute the effective focal length and its uncertainty
+    # delta_f is the difference between the two group focal lengths
+    delta_f = mean_fp - mean_fl
+    # Error propagation: combine uncertainties in quadrature (sqrt of sum of squares)
+    err_delta_f = np.hypot(std_fp, std_fl)
+    # Effective focal length combines both group results
+    effective_f = mean_fp + delta_f
+    # Propagate the uncertainty of effective_f
+    err_effective_f = np.hypot(std_fp, err_delta_f)
+
+    # Build a summary DataFrame with the final results
+    sum_ef = pd.DataFrame([
+        {
+            # First row shows the effective focal length result
+            'Spot Number': '',
+            'y0 (px)': '',
+            'y1 (px)': '',
+            'y2 (px)': 'effective focal length',
+            'f (mm)': '',
+            'f ± δf (mm)': f"{round(effective_f, 2)} ± {round(err_effective_f, 2)}"
+        },
+        {
+            # Second row shows delta_f
+            'Spot Number': '',
+            'y0 (px)': '',
+            'y1 (px)': '',
+            'y2 (px)': 'delta_f',
+            'f (mm)': '',
+            'f ± δf (mm)': f"{round(delta_f, 2)} ± {round(err_delta_f, 2)}"
+        }
+    ])
+
+    # Add 2 empty rows between the measurement tables and the summary
+    # for visual separation in the Excel output
+    empty_rows = pd.DataFrame([
+        {col: '' for col in tab_p.columns}
+        for _ in range(2)
+    ])
+
+    # Stack all tables vertically: p group, l group, spacer, summary
+    final_table = pd.concat([tab_p, tab_l, empty_rows, sum_ef], ignore_index=True)
+
+    # Return the key results rounded to 3 decimals and the full table
+    return (
+        np.round([effective_f, err_effective_f, delta_f], 3),
+        final_table
+    )
+
+
+def focal_distance_with_table(y0, img1, img2, dz, idx, modo=1):
+    """
+    Computes the effective focal length from two images taken at different
+    screen positions and a reference distance array.
+
+    Measures the blob distances in both images with
+    compute_distances_to_center() and passes them to
+    focal_distance_from_distances(), see there for the formula and modes.
+
+    Parameters
+    ----------
+    y0 : numpy array
+        Reference distances (8 values) captured at position 0.
+    img1 : numpy array
+        Image captured at position z1.
+    img2 : numpy array
+        Image captured at position z2.
+    dz : float
+        The absolute distance between z1 and z2 in mm.
+    idx : int
+        Index of the filter in FILTERS, selects the color channel.
+    modo : int
+        Calculation mode (1, 2, or 3). Default is 1.
+
+    Returns
+    -------
+    tuple
+        (results_array, final_table), see focal_distance_from_distances().
+    """
+    # Compute the blob distances for both images
+    y1 = compute_distances_to_center(img1, idx)
+    y2 = compute_distances_to_center(img2, idx)
+    return focal_distance_from_distances(y0, y1, y2, dz, modo)
+
+
+def format_distances(distances):
+    """
+    Formats the 8 computed distances into a human readable string
+    showing which blob points are being measured relative to the center.
+
+    The 9 blobs are arranged in a 3x3 grid numbered 1-9:
+        1 | 2 | 3
+        ---------
+        4 | 5 | 6
+        ---------
+        7 | 8 | 9
+
+    Point 5 is always the center. The 8 distances are split into two
+    groups (p and l) which correspond to the two sets of measurement
+    points used in the focal length calculation.
+
+    Parameters
+    ----------
+    distances : numpy array
+        Array of 8 distances in pixels computed by compute_distances_to_center().
+
+    Returns
+    -------
+    str
+        A formatted string showing each point pair and its distance.
+    """
+    # p points: the 4 distances used for the p measurement
+    # Each tuple is (point_a, center_point, index_in_distances_array)
+    p_map = [(6,5,4), (2,5,1), (4,5,3), (8,5,6)]
+    # l points: the 4 distances used for the l measurement
+    l_map = [(3,5,2), (1,5,0), (7,5,5), (9,5,7)]
+
+    # Build the formatted string for p points
+    text = "p points:\n"
+    for i, (a, c, idx) in enumerate(p_map):
+        # Format: "  1: 6─5  12.34 px"
+        text += f"  {i+1}: {a}─{c}  {distances[idx]} px\n"
+
+    # Build the formatted string for l points
+    text += "\nl points:\n"
+    for i, (a, c, idx) in enumerate(l_map):
+        text += f"  {i+1}: {a}─{c}  {distances[idx]} px\n"
+
+    return text            
@@ -0,0 +1,392 @@
+"""
+Saving of measurement results in the background.
+
+Saving a measurement writes 8 full resolution PNG images and an Excel
+file, which takes from half a second to several seconds depending on the
+computer and the disk. A BackgroundWriter does it outside the Tk main
+thread, so the windows keep responding:
+
+1. save jobs wait in a queue and are written one after the other by a
+   writer thread, in the order they were submitted
+2. the files of a job are encoded and written in parallel by a small pool
+   of threads. cv2.imencode and the file writes release the GIL, so the 8
+   images are encoded on several cores at the same time
+3. every file is first written under a temporary name in the same folder
+   and then renamed, so a file with the final name is always complete,
+   even if the program or the computer stops in the middle of a save
+4. the caller can follow each job with a progress and a completion
+   callback or by polling it, and close() waits for the queued jobs before
+   the program exits
+
+The images are saved as PNG, which is lossless at any compression level.
+The compression level only trades encoding time for file size, see
+PNG_COMPRESSION and PNG_STRATEGY.
+"""
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from measurement_core import FILTERS
+
+# --- Configuration --- #
+# zlib level of the PNG images, from 0 (no compression, fastest, about
+# 3.5 MB per image) to 9 (smallest, several seconds per image). Level 1
+# encodes a 1080x1080 image in about 60 ms.
+PNG_COMPRESSION = 1
+# zlib strategy of the PNG images: 'default', 'filtered', 'huffman' or 'rle'.
+# The camera noise makes the images hard to compress with repeated
+# strings, so 'huffman' (no string matching) is as fast as the default and
+# gives files about 35% smaller.
+PNG_STRATEGY = "huffman"
+# Number of threads encoding and writing the files of a job
+WRITE_WORKERS = 4
+# Maximum time in seconds close() waits for the queued jobs when the
+# program exits
+CLOSE_TIMEOUT = 30.0
+
+# Names of the saved files and folders, to find the runs again, e.g. in
+# batch_analysis.py and run_index.py. z1 and z2 as written in the Excel
+# filename by measurement_files(): focal_z1_10.00_z2_50.00.xlsx
+EXCEL_PATTERN = re.compile(r"^focal_z1_(-?\d+(?:\.\d+)?)_z2_(-?\d+(?:\.\d+)?)\.xlsx$")
+# and in the default folder name: measurement_z1_10.0_z2_50.0_20250101_120000
+FOLDER_PATTERN = re.compile(r"^measurement_z1_(-?\d+(?:\.\d+)?)_z2_(-?\d+(?:\.\d+)?)(?:_(\d{8}_\d{6}))?$")
+
+# The BackgroundWriter of the program, created by get_writer()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def png_params(compression=PNG_COMPRESSION, strategy=PNG_STRATEGY):
+    """
+    Returns the cv2.imencode parameters of a PNG image.
+
+    Parameters
+    ----------
+    compression : int, optional
+        zlib level from 0 to 9. Default is PNG_COMPRESSION.
+    strategy : str, optional
+        'default', 'filtered', 'huffman' or 'rle'. Default is PNG_STRATEGY.
+
+    Returns
+    -------
+    list of int
+    """
+    import cv2
+
+    strategies = {
+        "default": cv2.IMWRITE_PNG_STRATEGY_DEFAULT,
+        "filtered": cv2.IMWRITE_PNG_STRATEGY_FILTERED,
+        "huffman": cv2.IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY,
+        "rle": cv2.IMWRITE_PNG_STRATEGY_RLE,
+    }
+    return [cv2.IMWRITE_PNG_COMPRESSION, int(compression), cv2.IMWRITE_PNG_STRATEGY, strategies[strategy]]
+
+
+def atomic_write(path, write):
+    """
+    Writes a file under a temporary name in its folder and renames it to
+    path once it is complete, replacing an existing file.
+
+    Parameters
+    ----------
+    path : str or Path
+        Final path of the file.
+    write : callable
+        Called with the temporary path, must write the whole file there.
+        The temporary name keeps the extension of path, e.g. for pandas to
+        choose the Excel engine.
+    """
+    path = os.fspath(path)
+    folder, name = os.path.split(path)
+    root, ext = os.path.splitext(name)
+    # Hidden, and in the same folder so the rename does not move any data
+    tmp_path = os.path.join(folder, f".{root}.tmp{ext}")
+    try:
+        write(tmp_path)
+        # Make sure the content is on the disk before the name points to it
+        with open(tmp_path, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_png(path, image, params=None):
+    """
+    Encodes an image as PNG and writes it atomically.
+
+    Parameters
+    ----------
+    path : str or Path
+        File to write.
+    image : numpy array
+        BGR image.
+    params : list of int, optional
+        cv2.imencode parameters. Default is png_params().
+
+    Raises
+    ------
+    IOError
+        If the image could not be encoded.
+    """
+    import cv2
+
+    ok, data = cv2.imencode(".png", image, png_params() if params is None else params)
+    if not ok:
+        raise IOError(f"Could not encode {os.path.basename(os.fspath(path))}")
+
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+    atomic_write(path, write)
+
+
+def write_excel(path, tables):
+    """
+    Writes the results tables to an Excel file atomically, one sheet per
+    filter named Filter_W, Filter_R, etc.
+
+    Parameters
+    ----------
+    path : str or Path
+        File to write, ending in .xlsx.
+    tables : dict
+        Dictionary of DataFrames with results per filter.
+    """
+    import pandas as pd
+
+    def write(tmp_path):
+        with pd.ExcelWriter(tmp_path) as writer:
+            for flt, tabla in tables.items():
+                tabla.to_excel(writer, sheet_name=f"Filter_{flt.upper()}", index=False)
+
+    atomic_write(path, write)
+
+
+def measurement_files(images_z1, images_z2, tables, path_base, z1, z2, params=None, images=True, excel=True):
+    """
+    Lists the files of a saved measurement, without writing them.
+
+    Parameters
+    ----------
+    images_z1, images_z2 : numpy array
+        Arrays of 4 images captured at z1 and z2.
+    tables : dict
+        Dictionary of DataFrames with results per filter.
+    path_base : str or Path
+        The folder of the measurement.
+    z1, z2 : float
+        The positions in mm, used in the Excel filename.
+    params : list of int, optional
+        cv2.imencode parameters of the images. Default is png_params().
+    images : bool, optional
+        Include the 8 PNG images. Default is True.
+    excel : bool, optional
+        Include the Excel file. Default is True.
+
+    Returns
+    -------
+    list of tuple
+        (path, write) for each file, where write() writes it.
+    """
+    params = png_params() if params is None else params
+    files = []
+    for idx, img_set in enumerate([images_z1, images_z2] if images else []):
+        for i, f in enumerate(FILTERS):
+            if i < len(img_set):
+                # z1_w.png, z1_r.png, z2_w.png, etc.
+                path = os.path.join(path_base, f"z{idx+1}_{f}.png")
+                files.append((path, lambda p=path, img=img_set[i]: write_png(p, img, params)))
+    if excel:
+        path = os.path.join(path_base, f"focal_z1_{z1:.2f}_z2_{z2:.2f}.xlsx")
+        files.append((path, lambda p=path: write_excel(p, tables)))
+    return files
+
+
+class SaveJob:
+    """
+    A group of files saved together by a BackgroundWriter.
+
+    Attributes
+    ----------
+    name : str
+        Name of the job, e.g. the measurement folder.
+    paths : list of str
+        The files of the job.
+    done : int
+        Number of files already written or failed.
+    errors : list of tuple
+        (path, exception) of every file that could not be written.
+    """
+
+    def __init__(self, name, files, on_progress=None, on_done=None):
+        self.name = name
+        self.files = files
+        self.paths = [path for path, _ in files]
+        self.done = 0
+        self.errors = []
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self._finished = threading.Event()
+
+    @property
+    def finished(self):
+        """True once every file was written or failed and on_done returned."""
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """Waits until the job is finished, see finished. Returns False if the timeout expired."""
+        return self._finished.wait(timeout)
+
+
+class BackgroundWriter:
+    """
+    Writes SaveJobs in a background thread, the files of each job in
+    parallel.
+
+    The callbacks of a job run in the writer thread and must not call Tk,
+    not even window.after(): with a threaded Tcl the call waits for the
+    main loop, which is blocked while close() waits for the writer. A Tk
+    window polls job.done and job.finished from its main thread instead.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of threads writing the files of a job. Default is WRITE_WORKERS.
+    """
+
+    def __init__(self, workers=WRITE_WORKERS):
+        self._queue = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._closed = False
+        # daemon=True means the thread stops if the main program exits,
+        # close() is what waits for the pending jobs
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """Number of jobs submitted and not finished yet."""
+        return self._queue.unfinished_tasks
+
+    def submit(self, files, name="", on_progress=None, on_done=None):
+        """
+        Queues files to be written.
+
+        Parameters
+        ----------
+        files : list of tuple
+            (path, write) for each file, see measurement_files(). The data
+            the write functions use must not change until the job finished.
+        name : str, optional
+            Name of the job. Default is ''.
+        on_progress : callable, optional
+            Called after each file with (job, path, error), error being
+            None if the file was written.
+        on_done : callable, optional
+            Called with the job once every file was written or failed,
+            before the job is marked finished.
+
+        Returns
+        -------
+        SaveJob
+
+        Raises
+        ------
+        RuntimeError
+            If the writer was closed.
+        """
+        if self._closed:
+            raise RuntimeError("The background writer is closed.")
+        job = SaveJob(name, files, on_progress, on_done)
+        self._queue.put(job)
+        return job
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """
+        Stops accepting jobs and waits until the queued ones are written.
+
+        Parameters
+        ----------
+        timeout : float or None, optional
+            Maximum time to wait in seconds. Default is CLOSE_TIMEOUT.
+
+        Returns
+        -------
+        bool
+            True if every job was written, False if the timeout expired.
+        """
+        self._closed = True
+        # The writer thread exits after the jobs queued before this marker
+        self._queue.put(None)
+        self._thread.join(timeout)
+        finished = not self._thread.is_alive()
+        if finished:
+            self._pool.shutdown()
+        return finished
+
+    def _run(self):
+        """Writes the queued jobs one after the other, until close() is called."""
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._write(job)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, job):
+        """Writes the files of a job in parallel and reports each one as it is done."""
+        futures = {self._pool.submit(write): path for path, write in job.files}
+        for future in as_completed(futures):
+            path = futures[future]
+            error = future.exception()
+            if error is not None:
+                job.errors.append((path, error))
+            job.done += 1
+            _call(job.on_progress, job, path, error)
+        # Finished only after on_done, which e.g. indexes the saved run, so
+        # wait() returns once everything the job does is done
+        _call(job.on_done, job)
+        job._finished.set()
+
+
+def _call(callback, *args):
+    """Calls a job callback, a failing callback does not stop the writer."""
+    if callback is None:
+        return
+    try:
+        callback(*args)
+    except Exception as e:
+        print(f"Save callback failed: {e}")
+
+
+def get_writer():
+    """Returns the BackgroundWriter of the program, starting it the first time."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = BackgroundWriter()
+        return _writer
+
+
+def close_writer(timeout=CLOSE_TIMEOUT):
+    """
+    Waits for the pending saves and stops the writer of the program, if it
+    was started. Called when the program closes.
+
+    Returns
+    -------
+    bool
+        False if some files were still being written when the timeout expired.
+    """
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    return True if writer is None else writer.close(timeout)
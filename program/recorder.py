@@ -0,0 +1,223 @@
+"""
+Video recording from the camera acquisition thread.
+
+A VideoRecorder runs two threads:
+
+1. feeder: takes every frame the acquisition thread publishes in its ring,
+   with its capture timestamp, and decides which frame of the video it
+   is: frame k of the video shows the scene at start + k / fps. Frames
+   that arrive before their slot is due are dropped, the others are
+   cropped and oriented and put in a bounded queue.
+2. encoder: takes the frames from the queue and writes them with the
+   OpenCV VideoWriter. When slots were skipped (the camera was slower
+   than fps, or the queue was full) the previous frame is written again,
+   so the video always has exactly fps frames per second of recording
+   and plays back at the right speed.
+
+The queue decouples the camera from the encoder: a slow encoder makes the
+feeder drop frames instead of delaying the acquisition or the previews.
+stop() waits for both threads and only then releases the writer, so the
+file is never closed while a frame is being written.
+"""
+import queue
+import threading
+import time
+
+# Frames per second of the recorded videos
+RECORD_FPS = 15
+# Number of frames waiting for the encoder, about one second at RECORD_FPS.
+# Each frame of the region of interest takes 3.5 MB.
+QUEUE_SIZE = 16
+# Codec of the video files
+FOURCC = "mp4v"
+# Maximum time in seconds the feeder waits for a frame before checking
+# whether it must stop
+FRAME_TIMEOUT = 0.5
+
+
+class VideoRecorder:
+    """
+    Records the frames of an Acquisition to a video file at a constant
+    frame rate.
+
+    Parameters
+    ----------
+    acquisition : Acquisition
+        Running acquisition whose ring provides the frames.
+    pipeline : FramePipeline
+        Crop and orientation applied to the frames, used only by this
+        recorder.
+    path : str
+        Video file to write.
+    fps : float, optional
+        Frame rate of the video. Default is RECORD_FPS.
+    queue_size : int, optional
+        Maximum number of frames waiting for the encoder. Default is
+        QUEUE_SIZE.
+
+    Attributes
+    ----------
+    stats : dict
+        Statistics of the recording, updated while it runs:
+            received: camera frames seen by the feeder
+            written: frames written to the video, duplicates included
+            duplicated: frames written again to fill a slot without a new frame
+            dropped_rate: camera frames dropped because their slot was
+                already filled (camera faster than fps)
+            dropped_queue: camera frames dropped because the queue was full
+                (encoder slower than the camera)
+            dropped_stale: camera frames overwritten in the ring before the
+                feeder could copy them
+            encode_time: seconds the encoder spent writing
+    """
+
+    def __init__(self, acquisition, pipeline, path, fps=RECORD_FPS, queue_size=QUEUE_SIZE):
+        self.acquisition = acquisition
+        self.pipeline = pipeline
+        self.path = path
+        self.fps = float(fps)
+        self.stats = {"received": 0, "written": 0, "duplicated": 0, "dropped_rate": 0,
+                      "dropped_queue": 0, "dropped_stale": 0, "encode_time": 0.0}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._running = False
+        self._feeder = None
+        self._encoder = None
+        self._start_time = None
+
+    @property
+    def running(self):
+        """True while the recorder takes new frames."""
+        return self._running
+
+    def start(self, timeout=2.0):
+        """
+        Opens the video file with the size of the next frame and starts
+        the feeder and encoder threads.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum time in seconds to wait for the first frame. Default is 2.0.
+
+        Returns
+        -------
+        bool
+            False if no frame arrived or the file could not be opened.
+        """
+        import cv2
+
+        ring = self.acquisition.ring
+        first = ring.next_after(ring.latest_seq, timeout=timeout)
+        if first is None:
+            return False
+        # The cropped and oriented size, which is the size of the video
+        frame = self.pipeline.bgr(first.image)
+        frame_height, frame_width = frame.shape[:2]
+        self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*FOURCC),
+                                       self.fps, (frame_width, frame_height))
+        if not self._writer.isOpened():
+            self._writer = None
+            return False
+
+        self._running = True
+        # The video starts with the first frame, at its capture time
+        self._start_time = first.timestamp
+        # daemon=True means the threads stop if the main program exits
+        self._feeder = threading.Thread(target=self._feed, args=(first,), daemon=True)
+        self._encoder = threading.Thread(target=self._encode, daemon=True)
+        self._encoder.start()
+        self._feeder.start()
+        return True
+
+    def stop(self):
+        """
+        Stops taking frames, waits until the queued frames are written and
+        releases the video file.
+
+        Returns
+        -------
+        dict
+            The final stats, plus:
+                duration: seconds of video
+                encode_fps: frames the encoder can write per second
+        """
+        self._running = False
+        if self._feeder is not None:
+            self._feeder.join()
+            self._feeder = None
+        if self._encoder is not None:
+            # The encoder exits after the frames queued before this marker
+            self._queue.put(None)
+            self._encoder.join()
+            self._encoder = None
+        if self._writer is not None:
+            # Release the writer to finalize and close the video file
+            self._writer.release()
+            self._writer = None
+        return self.summary()
+
+    def summary(self):
+        """Returns stats plus the duration of the video and the encoder throughput."""
+        summary = dict(self.stats)
+        summary["duration"] = self.stats["written"] / self.fps
+        encode_time = self.stats["encode_time"]
+        summary["encode_fps"] = self.stats["written"] / encode_time if encode_time > 0 else None
+        return summary
+
+    def _feed(self, frame):
+        """Assigns the camera frames to video slots and queues them, until stop() is called."""
+        ring = self.acquisition.ring
+        next_slot = 0
+        while self._running and self.acquisition.running:
+            if frame is None:
+                frame = ring.next_after(seq, timeout=FRAME_TIMEOUT)
+                if frame is None:
+                    continue
+            seq = frame.seq
+            self.stats["received"] += 1
+            # Video frame showing the scene at the capture time of this one
+            slot = round((frame.timestamp - self._start_time) * self.fps)
+            if slot < next_slot:
+                # This slot already has a frame, the camera is faster than fps
+                self.stats["dropped_rate"] += 1
+            else:
+                # Crop to the region of interest and flip vertically and
+                # horizontally, BGR is kept for the video writer. Copied
+                # because the frame waits in the queue
+                image = self.pipeline.bgr(frame.image, copy=True)
+                if not ring.is_valid(frame):
+                    # Overwritten while it was copied, the copy may be torn
+                    self.stats["dropped_stale"] += 1
+                else:
+                    try:
+                        self._queue.put_nowait((slot, image))
+                        next_slot = slot + 1
+                    except queue.Full:
+                        # The encoder is behind: the slot is filled with a
+                        # duplicate later instead of delaying the camera
+                        self.stats["dropped_queue"] += 1
+            frame = None
+        self._running = False
+
+    def _encode(self):
+        """Writes the queued frames, duplicating the last one over skipped slots."""
+        next_slot = 0
+        last = None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            slot, image = item
+            start = time.perf_counter()
+            if last is not None:
+                # Slots without their own frame show the previous one
+                for _ in range(next_slot, slot):
+                    self._writer.write(last)
+                    self.stats["written"] += 1
+                    self.stats["duplicated"] += 1
+            self._writer.write(image)
+            self.stats["written"] += 1
+            self.stats["encode_time"] += time.perf_counter() - start
+            next_slot = slot + 1
+            last = image
@@ -0,0 +1,315 @@
+"""
+Single file archive of a measurement run.
+
+A run archive (.slbrun) holds everything a measurement produced: the 8
+images, the reference and measured blob distances, the results and
+tables of every filter and the metadata of the run (positions, mode,
+time, hashes of the calibration and of the reference). It is written in
+one sequential pass and read without decoding anything but a small
+header. The Excel file and the PNG images become optional views that can
+be exported from it.
+
+Layout of the file:
+
+    magic           8 bytes, MAGIC
+    header length   8 bytes, little endian unsigned integer
+    data start      8 bytes, little endian unsigned integer
+    header          UTF-8 JSON: metadata, results, tables and the
+                    position, type and shape of every array
+    arrays          raw C ordered arrays, each starting at a multiple of
+                    ALIGNMENT bytes from the start of the file
+
+Because the arrays are stored raw and aligned, RunArchive.array() maps
+them into memory with np.memmap: reading one filter's image only reads
+the 3.5 MB of that image from the disk, and nothing has to be decoded.
+
+With image_codec='png' the images are stored instead as one PNG chunk per
+filter, three to five times smaller but slower to write and read. One
+filter's image still decodes only its own chunk.
+"""
+import hashlib
+import io
+import json
+import os
+import struct
+
+import numpy as np
+
+from measurement_core import FILTERS
+from persistence import atomic_write, measurement_files, png_params
+
+# --- Configuration --- #
+# First bytes of every run archive, the last two are the format version
+MAGIC = b"SLBRUN01"
+# Arrays start at multiples of this many bytes, the memory page size
+ALIGNMENT = 4096
+# File extension and default name of the archive in a run folder
+ARCHIVE_EXTENSION = ".slbrun"
+ARCHIVE_FILENAME = "measurement" + ARCHIVE_EXTENSION
+# How the images are stored: 'raw' (fast, memory mapped, 3.5 MB per image)
+# or 'png' (lossless, about 0.7 MB per image)
+IMAGE_CODEC = "raw"
+
+# Fixed part of the file before the header: magic, header length, data start
+_PREFIX = struct.Struct("<8sQQ")
+
+
+def _aligned(offset):
+    """Rounds offset up to the next multiple of ALIGNMENT."""
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def array_sha1(array):
+    """Returns the SHA-1 hex digest of an array's values, e.g. to identify a reference."""
+    return hashlib.sha1(np.ascontiguousarray(array, dtype=np.float64).tobytes()).hexdigest()
+
+
+def _json_results(results):
+    """Returns the results dict of a measurement with JSON types only."""
+    clean = {}
+    for flt, res in (results or {}).items():
+        if "error" in res:
+            # The exception object itself can not be stored, its message is
+            clean[flt] = {"error": str(res["error"])}
+        else:
+            clean[flt] = {key: float(res[key]) for key in ("effective_focal", "error_effective_focal", "delta_f")
+                          if key in res}
+    return clean
+
+
+def write_archive(path, images_z1, images_z2, metadata, results=None, tables=None, y0=None,
+                  y1=None, y2=None, image_codec=IMAGE_CODEC):
+    """
+    Writes a run archive atomically, see persistence.atomic_write().
+
+    Parameters
+    ----------
+    path : str or Path
+        File to write, normally ARCHIVE_FILENAME in the run folder.
+    images_z1, images_z2 : numpy array
+        Arrays of 4 images captured at z1 and z2, (4, height, width, 3) uint8.
+    metadata : dict
+        JSON serializable description of the run, e.g. z1, z2, modo,
+        timestamp, calibration_sha1. The reference_sha1 of y0 is added.
+    results : dict, optional
+        Results per filter as returned by automatic_measurement().
+    tables : dict, optional
+        Dictionary of DataFrames with results per filter.
+    y0 : numpy array, optional
+        4x8 reference distances used for the results.
+    y1, y2 : numpy array, optional
+        4x8 distances measured at z1 and z2, NaN for the filters that failed.
+    image_codec : str, optional
+        'raw' or 'png'. Default is IMAGE_CODEC.
+
+    Raises
+    ------
+    ValueError
+        If image_codec is unknown.
+    """
+    if image_codec not in ("raw", "png"):
+        raise ValueError(f"Unknown image codec {image_codec!r}, use 'raw' or 'png'.")
+
+    # (name, bytes or array, header entry without the offset)
+    blocks = []
+    for name, images in (("images_z1", images_z1), ("images_z2", images_z2)):
+        images = np.ascontiguousarray(images)
+        entry = {"dtype": images.dtype.str, "shape": list(images.shape), "codec": image_codec}
+        if image_codec == "raw":
+            blocks.append((name, images, entry))
+        else:
+            import cv2
+
+            params = png_params()
+            # One chunk per filter, so one image can be decoded alone
+            chunks = []
+            for image in images:
+                ok, data = cv2.imencode(".png", image, params)
+                if not ok:
+                    raise IOError(f"Could not encode {name}")
+                chunks.append(data)
+            blocks.append((name, chunks, entry))
+    for name, values in (("y0", y0), ("y1", y1), ("y2", y2)):
+        if values is not None:
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            blocks.append((name, values, {"dtype": values.dtype.str, "shape": list(values.shape), "codec": "raw"}))
+
+    # Positions of the arrays relative to the data start, which depends on
+    # the length of the header that lists them
+    offset = 0
+    for _, data, entry in blocks:
+        if entry["codec"] == "raw":
+            entry["offset"] = offset
+            offset = _aligned(offset + data.nbytes)
+        else:
+            entry["chunks"] = []
+            for chunk in data:
+                entry["chunks"].append([offset, chunk.nbytes])
+                offset = _aligned(offset + chunk.nbytes)
+
+    metadata = dict(metadata)
+    if y0 is not None:
+        metadata["reference_sha1"] = array_sha1(y0)
+    header = json.dumps({
+        "metadata": metadata,
+        "results": _json_results(results),
+        "tables": {flt: table.to_json(orient="split", index=False) for flt, table in (tables or {}).items()},
+        "arrays": {name: entry for name, _, entry in blocks},
+    }).encode("utf-8")
+    data_start = _aligned(_PREFIX.size + len(header))
+
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(_PREFIX.pack(MAGIC, len(header), data_start))
+            f.write(header)
+            for _, data, entry in blocks:
+                pieces = [data] if entry["codec"] == "raw" else data
+                positions = [entry["offset"]] if entry["codec"] == "raw" else [c[0] for c in entry["chunks"]]
+                for piece, position in zip(pieces, positions):
+                    # The gap up to the aligned position is left as a hole
+                    f.seek(data_start + position)
+                    f.write(memoryview(piece).cast("B"))
+            # Extends the file over the padding of the last array
+            f.truncate(data_start + offset)
+
+    atomic_write(path, write)
+
+
+class RunArchive:
+    """
+    Reads a run archive. Only the header is read when it is opened, the
+    arrays are read when they are used.
+
+    Parameters
+    ----------
+    path : str or Path
+        The .slbrun file.
+
+    Attributes
+    ----------
+    path : str
+    metadata : dict
+        Description of the run, e.g. z1, z2, modo, timestamp,
+        calibration_sha1, reference_sha1.
+    results : dict
+        Results per filter: effective_focal, error_effective_focal and
+        delta_f, or error with the message of a failed filter.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a run archive.
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        with open(self.path, "rb") as f:
+            prefix = f.read(_PREFIX.size)
+            if len(prefix) < _PREFIX.size:
+                raise ValueError(f"{self.path} is not a run archive.")
+            magic, header_length, self._data_start = _PREFIX.unpack(prefix)
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} is not a run archive.")
+            self._header = json.loads(f.read(header_length).decode("utf-8"))
+        self.metadata = self._header["metadata"]
+        self.results = self._header["results"]
+        self._arrays = self._header["arrays"]
+
+    @property
+    def names(self):
+        """Names of the arrays in the archive."""
+        return list(self._arrays)
+
+    def array(self, name):
+        """
+        Returns an array of the archive.
+
+        Parameters
+        ----------
+        name : str
+            'images_z1', 'images_z2', 'y0', 'y1' or 'y2'.
+
+        Returns
+        -------
+        numpy array
+            A read only np.memmap for the raw arrays, nothing is read
+            before its values are used. The PNG images are decoded.
+
+        Raises
+        ------
+        KeyError
+            If the archive has no such array.
+        """
+        entry = self._arrays[name]
+        shape = tuple(entry["shape"])
+        if entry["codec"] == "raw":
+            return np.memmap(self.path, dtype=np.dtype(entry["dtype"]), mode="r",
+                             offset=self._data_start + entry["offset"], shape=shape)
+        return np.stack([self._decode_chunk(entry, i) for i in range(shape[0])])
+
+    def image(self, position, flt):
+        """
+        Returns the image of one filter at one position, reading only that image.
+
+        Parameters
+        ----------
+        position : int
+            1 for z1, 2 for z2.
+        flt : str
+            Filter name, one of FILTERS.
+
+        Returns
+        -------
+        numpy array
+            The BGR image, a read only memory mapped view for raw images.
+        """
+        name = f"images_z{position}"
+        idx = FILTERS.index(flt)
+        entry = self._arrays[name]
+        if entry["codec"] == "raw":
+            return self.array(name)[idx]
+        return self._decode_chunk(entry, idx)
+
+    def _decode_chunk(self, entry, idx):
+        """Reads and decodes the PNG chunk idx of an array."""
+        import cv2
+
+        offset, length = entry["chunks"][idx]
+        with open(self.path, "rb") as f:
+            f.seek(self._data_start + offset)
+            data = np.frombuffer(f.read(length), dtype=np.uint8)
+        return cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+
+    def tables(self):
+        """Returns the results tables as a dictionary of DataFrames per filter."""
+        import pandas as pd
+
+        return {flt: pd.read_json(io.StringIO(table), orient="split")
+                for flt, table in self._header["tables"].items()}
+
+    def export(self, folder=None, images=True, excel=True):
+        """
+        Writes the PNG images and the Excel file of the run, the same
+        files save_measurement_data() writes without an archive.
+
+        Parameters
+        ----------
+        folder : str or Path, optional
+            Where to write them. Default is the folder of the archive.
+        images : bool, optional
+            Write the 8 PNG images. Default is True.
+        excel : bool, optional
+            Write the Excel file. Default is True.
+
+        Returns
+        -------
+        list of str
+            The files written.
+        """
+        folder = os.path.dirname(self.path) if folder is None else folder
+        os.makedirs(folder, exist_ok=True)
+        files = measurement_files(self.array("images_z1"), self.array("images_z2"), self.tables(), folder,
+                                  self.metadata["z1"], self.metadata["z2"], images=images, excel=excel)
+        for _, write in files:
+            write()
+        return [path for path, _ in files]
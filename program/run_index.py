@@ -0,0 +1,423 @@
+"""
+SQLite index of the saved measurements.
+
+Every saved run is a folder in data/, with a run archive (see
+run_archive.py) or, for older runs, PNG images and an Excel file. Finding
+all the runs of a lens or the trend of a filter used to mean opening every
+folder. The index keeps one row per run and one row per run and filter in
+data/run_index.sqlite:
+
+    runs:    path, timestamp, lens_id, z1, z2, dz, modo, reference_id,
+             calibration_id, the archive and Excel files, and the size and
+             modification time of the file the row was read from
+    results: run_id, filter, effective_focal, error_effective_focal,
+             delta_f, error
+
+with indexes on the time, the lens and the filter, so the usual questions
+("all the runs of lens X in the last month", "red against blue focal
+length over time") are answered in milliseconds.
+
+A run is added when it is saved (see focal_measurements.py). update()
+brings the index up to date with the folders: new and modified runs are
+read, deleted ones removed, and the others skipped after comparing the
+size and modification time of their file, so it can run over thousands of
+runs at every start.
+
+Run from the program/ folder, for example:
+    python run_index.py                       # update the index of data/
+    python run_index.py --lens L-42 --days 30 # runs of a lens in the last 30 days
+    python run_index.py --trend r b           # red and blue focal lengths over time
+"""
+import argparse
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from measurement_core import FILTERS
+from persistence import EXCEL_PATTERN, FOLDER_PATTERN
+from run_archive import ARCHIVE_FILENAME, RunArchive
+
+# --- Configuration --- #
+# Database file in the data directory
+INDEX_FILENAME = "run_index.sqlite"
+# Version of the tables, a database with another version is rebuilt
+SCHEMA_VERSION = 1
+# Format of the timestamps in the folder names and in the archives
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,      -- folder, relative to the data directory
+    timestamp TEXT,                 -- local time, 'YYYY-MM-DD HH:MM:SS'
+    lens_id TEXT,
+    z1 REAL,
+    z2 REAL,
+    dz REAL,
+    modo INTEGER,
+    reference_id TEXT,              -- SHA-1 of the reference distances
+    calibration_id TEXT,            -- SHA-1 of the mm/steps table
+    archive TEXT,                   -- file names in the folder, NULL if missing
+    excel TEXT,
+    source_size INTEGER,            -- size and mtime of the file the row was read from
+    source_mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    filter TEXT NOT NULL,
+    effective_focal REAL,
+    error_effective_focal REAL,
+    delta_f REAL,
+    error TEXT,
+    PRIMARY KEY (run_id, filter)
+);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (timestamp);
+CREATE INDEX IF NOT EXISTS runs_lens ON runs (lens_id, timestamp);
+CREATE INDEX IF NOT EXISTS results_filter ON results (filter, run_id);
+"""
+
+
+def connect(data_dir):
+    """
+    Opens the index of a data directory, creating it if needed.
+
+    Parameters
+    ----------
+    data_dir : str
+        The data directory.
+
+    Returns
+    -------
+    sqlite3.Connection
+        Use it as a context manager to commit, and close it when done.
+        Each thread must open its own connection.
+    """
+    conn = sqlite3.connect(os.path.join(data_dir, INDEX_FILENAME), timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    # Readers do not block the writer, e.g. a query while a run is saved
+    conn.execute("PRAGMA journal_mode = WAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        conn.executescript("DROP TABLE IF EXISTS results; DROP TABLE IF EXISTS runs;")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _timestamp(value):
+    """Converts a 'YYYYmmdd_HHMMSS' time stamp to the format of the index, None if invalid."""
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT).strftime("%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+
+
+def _excel_results(path):
+    """
+    Reads the effective focal length and delta_f of every filter from
+    the Excel file of an older run, see focal_distance_from_distances().
+    """
+    from openpyxl import load_workbook
+
+    results = {}
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            flt = sheet.title.replace("Filter_", "").lower()
+            values = {}
+            for row in sheet.iter_rows(values_only=True):
+                if row and row[0] == "Error":
+                    continue
+                if len(row) == 1 and row[0] is not None:
+                    # Sheet of a failed filter: a single 'Error' column
+                    results[flt] = {"error": str(row[0])}
+                    break
+                # The summary rows name the value in the 'y2 (px)' column
+                # and hold 'value ± error' in the last one
+                if len(row) >= 7 and row[4] in ("effective focal length", "delta_f") and row[6]:
+                    value, _, error = str(row[6]).partition("±")
+                    values[row[4]] = (float(value), float(error))
+            if "effective focal length" in values:
+                results[flt] = {"effective_focal": values["effective focal length"][0],
+                                "error_effective_focal": values["effective focal length"][1],
+                                "delta_f": values.get("delta_f", (None, None))[0]}
+    finally:
+        workbook.close()
+    return results
+
+
+def read_run(folder, data_dir):
+    """
+    Reads the description of a run folder for the index.
+
+    Parameters
+    ----------
+    folder : str
+        The run folder.
+    data_dir : str
+        The data directory, the run is identified by its path relative to it.
+
+    Returns
+    -------
+    tuple (dict, dict) or None
+        The runs row and the results per filter, None if the folder holds
+        neither a run archive nor an Excel file of a run.
+    """
+    names = os.listdir(folder)
+    excel = next((n for n in sorted(names) if EXCEL_PATTERN.match(n)), None)
+    archive = ARCHIVE_FILENAME if ARCHIVE_FILENAME in names else None
+    source = archive or excel
+    if source is None:
+        return None
+    stat = os.stat(os.path.join(folder, source))
+    row = {"path": os.path.relpath(folder, data_dir), "timestamp": None, "lens_id": None,
+           "z1": None, "z2": None, "dz": None, "modo": None, "reference_id": None, "calibration_id": None,
+           "archive": archive, "excel": excel, "source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+    if archive:
+        run = RunArchive(os.path.join(folder, archive))
+        metadata = run.metadata
+        row.update(timestamp=_timestamp(metadata.get("timestamp")), lens_id=metadata.get("lens_id") or None,
+                   z1=metadata.get("z1"), z2=metadata.get("z2"), dz=metadata.get("dz"), modo=metadata.get("modo"),
+                   reference_id=metadata.get("reference_sha1"), calibration_id=metadata.get("calibration_sha1"))
+        results = run.results
+    else:
+        # Older run: the positions are in the names, the results in the Excel file
+        excel_match = EXCEL_PATTERN.match(excel)
+        row["z1"], row["z2"] = float(excel_match.group(1)), float(excel_match.group(2))
+        row["dz"] = abs(row["z2"] - row["z1"])
+        folder_match = FOLDER_PATTERN.match(os.path.basename(folder))
+        if folder_match:
+            row["timestamp"] = _timestamp(folder_match.group(3))
+        results = _excel_results(os.path.join(folder, excel))
+    if row["timestamp"] is None:
+        # Renamed folder without a time stamp: the time the run was written
+        row["timestamp"] = datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+    return row, results
+
+
+def _store(conn, row, results):
+    """Inserts or replaces a run and its results, in the order of results."""
+    conn.execute("DELETE FROM runs WHERE path = ?", (row["path"],))
+    columns = ", ".join(row)
+    cursor = conn.execute(f"INSERT INTO runs ({columns}) VALUES ({', '.join('?' * len(row))})",
+                          list(row.values()))
+    conn.executemany(
+        "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)",
+        [(cursor.lastrowid, flt, res.get("effective_focal"), res.get("error_effective_focal"),
+          res.get("delta_f"), res.get("error")) for flt, res in results.items()])
+
+
+def add_run(folder, data_dir):
+    """
+    Adds or updates one run in the index of data_dir, e.g. after it was saved.
+
+    Parameters
+    ----------
+    folder : str or Path
+        The run folder.
+    data_dir : str or Path
+        The data directory.
+
+    Returns
+    -------
+    bool
+        False if the folder is not a run.
+    """
+    data_dir, folder = os.fspath(data_dir), os.fspath(folder)
+    run = read_run(folder, data_dir)
+    if run is None:
+        return False
+    conn = connect(data_dir)
+    try:
+        with conn:
+            _store(conn, *run)
+    finally:
+        conn.close()
+    return True
+
+
+def update(data_dir, progress=None):
+    """
+    Brings the index up to date with the run folders below data_dir.
+
+    New runs and runs whose archive or Excel file changed are read,
+    runs whose folder disappeared are removed, the others are skipped.
+
+    Parameters
+    ----------
+    data_dir : str
+        The data directory.
+    progress : callable, optional
+        Called with a message every 500 runs read. Default is None.
+
+    Returns
+    -------
+    dict
+        Number of runs 'added' (new or changed), 'removed' and 'unchanged'.
+    """
+    conn = connect(data_dir)
+    try:
+        known = {r["path"]: r for r in
+                 conn.execute("SELECT path, archive, excel, source_size, source_mtime_ns FROM runs")}
+        seen = set()
+        stats = {"added": 0, "removed": 0, "unchanged": 0}
+        with conn:
+            for folder, subfolders, files in os.walk(data_dir):
+                subfolders.sort()
+                if ARCHIVE_FILENAME not in files and not any(EXCEL_PATTERN.match(n) for n in files):
+                    continue
+                path = os.path.relpath(folder, data_dir)
+                seen.add(path)
+                entry = known.get(path)
+                if entry is not None:
+                    source = ARCHIVE_FILENAME if ARCHIVE_FILENAME in files else entry["excel"]
+                    if source == (entry["archive"] or entry["excel"]):
+                        try:
+                            stat = os.stat(os.path.join(folder, source))
+                            if (stat.st_size, stat.st_mtime_ns) == (entry["source_size"], entry["source_mtime_ns"]):
+                                stats["unchanged"] += 1
+                                continue
+                        except OSError:
+                            pass
+                try:
+                    run = read_run(folder, data_dir)
+                except Exception as e:
+                    # An unreadable run does not stop the update
+                    print(f"Run {path} not indexed: {e}")
+                    continue
+                if run is not None:
+                    _store(conn, *run)
+                    stats["added"] += 1
+                    if progress and stats["added"] % 500 == 0:
+                        progress(f"{stats['added']} runs indexed")
+            removed = [(path,) for path in known if path not in seen]
+            conn.executemany("DELETE FROM runs WHERE path = ?", removed)
+            stats["removed"] = len(removed)
+    finally:
+        conn.close()
+    return stats
+
+
+def _conditions(lens_id=None, days=None):
+    """
+    Returns the WHERE conditions on the runs table and their parameters,
+    see _where(). Only the conditions that apply are included, so SQLite
+    can use the index on the lens or on the time.
+    """
+    conditions, params = [], []
+    if lens_id is not None:
+        conditions.append("runs.lens_id = ?")
+        params.append(lens_id)
+    if days is not None:
+        conditions.append("runs.timestamp >= ?")
+        params.append((datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S"))
+    return conditions, params
+
+
+def _where(conditions):
+    """Returns the WHERE clause of the conditions, empty if there are none."""
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+def runs_for_lens(conn, lens_id, days=None):
+    """
+    Returns the runs of a lens with their results, newest first.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Returned by connect().
+    lens_id : str or None
+        The lens ID given when the runs were saved. None returns the runs
+        of every lens.
+    days : float, optional
+        Only the runs of the last days. Default is None, all the runs.
+
+    Returns
+    -------
+    pandas DataFrame
+        One row per run and filter: timestamp, path, z1, z2, modo, filter,
+        effective_focal, error_effective_focal, delta_f, error.
+    """
+    import pandas as pd
+
+    conditions, params = _conditions(lens_id, days)
+    query = f"""
+        SELECT runs.timestamp, runs.path, runs.z1, runs.z2, runs.modo, results.filter,
+               results.effective_focal, results.error_effective_focal, results.delta_f, results.error
+        FROM runs JOIN results ON results.run_id = runs.id
+        {_where(conditions)}
+        ORDER BY runs.timestamp DESC, runs.path, results.rowid
+    """
+    # The results of a run are stored in the order of FILTERS, see _store()
+    return pd.read_sql_query(query, conn, params=params)
+
+
+def focal_trend(conn, filters=("r", "b"), lens_id=None, days=None):
+    """
+    Returns the effective focal length of some filters over time, one
+    column per filter, e.g. to compare red and blue.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Returned by connect().
+    filters : sequence of str, optional
+        Filter names. Default is ('r', 'b').
+    lens_id : str, optional
+        Only the runs of this lens. Default is None, all the runs.
+    days : float, optional
+        Only the runs of the last days. Default is None, all the runs.
+
+    Returns
+    -------
+    pandas DataFrame
+        Indexed by timestamp and path, oldest first, with the effective
+        focal length of each filter, NaN where it failed.
+    """
+    import pandas as pd
+
+    filters = list(filters)
+    conditions, params = _conditions(lens_id, days)
+    conditions.append(f"results.filter IN ({', '.join('?' * len(filters))})")
+    query = f"""
+        SELECT runs.timestamp, runs.path, results.filter, results.effective_focal
+        FROM runs JOIN results ON results.run_id = runs.id
+        {_where(conditions)}
+        ORDER BY runs.timestamp
+    """
+    table = pd.read_sql_query(query, conn, params=params + filters)
+    # One row per run and filter, so each cell has a single value
+    trend = table.pivot(index=["timestamp", "path"], columns="filter", values="effective_focal")
+    return trend.reindex(columns=filters)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index and query the saved SlideBench measurements")
+    parser.add_argument("data_dir", nargs="?",
+                        help="folder with the measurement folders. Default is the data/ folder of the application")
+    parser.add_argument("--lens", metavar="ID", help="show the runs of this lens")
+    parser.add_argument("--trend", nargs="+", metavar="FILTER", choices=FILTERS,
+                        help="show the effective focal length of these filters over time, of the --lens only if given")
+    parser.add_argument("--days", type=float, help="only the runs of the last days")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir
+    if data_dir is None:
+        # Imported here, utils loads the mm/steps table when imported
+        from utils import external_folder
+        data_dir = external_folder("data")
+
+    stats = update(data_dir, progress=print)
+    print(f"Index updated: {stats['added']} runs added, {stats['removed']} removed, "
+          f"{stats['unchanged']} unchanged")
+
+    conn = connect(data_dir)
+    try:
+        if args.lens:
+            print(runs_for_lens(conn, args.lens, args.days).to_string(index=False))
+        if args.trend:
+            print(focal_trend(conn, args.trend, args.lens, args.days).to_string())
+    finally:
+        conn.close()
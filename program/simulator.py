@@ -0,0 +1,748 @@
+"""
+Software simulator of the SlideBench device.
+
+Provides a simulated Arduino that understands the same serial commands as
+arduino/arduino.ino, and a virtual camera that renders the 3x3 spot pattern
+for the current screen position, lens and filter. Both plug into the
+backend registries of communication.py and camera_functions.py, so the rest
+of the program runs unchanged without any hardware connected.
+
+Time can be accelerated: with time_scale=20 the motor moves and the servo
+turns 20 times faster than on the real device. The camera is not
+accelerated, it delivers its frames in real time like a real camera would,
+since the program has to process them in real time.
+
+Run a full headless measurement from the program/ folder with e.g.:
+    python simulator.py --z1 10 --z2 50 --focal 100 --time-scale 20
+
+Or start the GUI with the simulator listed as a COM port and a camera:
+    python main.py --simulator
+"""
+import argparse
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import acquisition
+import communication
+import camera_functions
+import utils
+
+# --- Constants copied from arduino/arduino.ino --- #
+STEPS_PER_REVOLUTION = 200 * 16     # stepsPerRevolution * microSteps
+MAX_STEPS = 93000                   # maxSteps
+# 'vel' in the sketch. It is computed once with the initial factorVel = 5,
+# and the actual speed is vel * factorVel steps per second
+BASE_SPEED = STEPS_PER_REVOLUTION * 0.1 * 5
+POSITION_PERIOD = 0.2               # a POS line is printed every 200 ms
+FILTER_ANGLES = {'w': 0, 'r': 57, 'g': 120, 'b': 180}   # servo angle of each filter
+SERVO_SPEED = 600                   # deg/s, about 0.1 s per 60 degrees
+SERVO_MS_PER_DEGREE = 3             # msPorGrado, turn time estimated by the sketch
+SERVO_MARGIN = 0.05                 # msMargen, in seconds
+BOOT_TIME = 0.5                     # setup() delay and homing, shortened
+
+# Names under which the simulated devices appear in the connection window
+SIMULATED_PORT = "Simulator"
+SIMULATED_CAMERA = "Simulated camera"
+
+# --- Optical model of the virtual camera --- #
+SPOT_PITCH = 300.0      # reference distance y0 in pixels between the center and a side spot
+SPOT_SIGMA = 8.0        # Gaussian radius of each spot in pixels
+DRIVER_BUFFER = 4       # frames kept by the camera driver until they are grabbed
+# BGR weights of the light that goes through each filter
+FILTER_COLORS = {
+    'w': (1.0, 1.0, 1.0),
+    'r': (0.05, 0.1, 1.0),
+    'g': (0.1, 1.0, 0.1),
+    'b': (1.0, 0.15, 0.05),
+}
+
+
+class SimulatedClock:
+    """
+    Simulated time running time_scale times faster than real time.
+
+    Has the same sleep/monotonic/perf_counter/time functions as the time
+    module, so it can stand in for it in the measurement code.
+    """
+
+    def __init__(self, time_scale=1.0):
+        self.time_scale = float(time_scale)
+        self._real_start = time.monotonic()
+        self._wall_start = time.time()
+
+    def monotonic(self):
+        """Seconds of simulated time since the clock was created."""
+        return (time.monotonic() - self._real_start) * self.time_scale
+
+    perf_counter = monotonic
+
+    def time(self):
+        """Simulated wall clock time, in seconds since the epoch."""
+        return self._wall_start + self.monotonic()
+
+    def sleep(self, seconds):
+        """Sleeps for the given number of simulated seconds."""
+        if seconds > 0:
+            time.sleep(seconds / self.time_scale)
+
+
+class SimulatedLens:
+    """
+    Thin lens model used by the virtual camera.
+
+    A collimated spot pattern going through a lens of focal length f
+    shrinks linearly with the distance d to the lens:
+        y(d) = y0 * (1 - d / f)
+    which is the relation the measurement formula f = y0 * dz / (y1 - y2)
+    is based on. The side spots (p group) and the corner spots (l group)
+    see slightly different focal lengths, as with spherical aberration.
+
+    Parameters
+    ----------
+    focal : float
+        Effective focal length in mm, the value the measurement should find.
+    delta_f : float
+        Difference between the p and l group focal lengths in mm.
+    offset : float
+        Distance in mm from the lens to the screen at position 0.
+    dispersion : dict, optional
+        Relative change of the focal length for each filter, e.g. a value
+        of 0.01 for 'r' makes the red focal length 1% longer.
+    """
+
+    def __init__(self, focal=100.0, delta_f=0.5, offset=20.0, dispersion=None):
+        self.focal = focal
+        self.delta_f = delta_f
+        self.offset = offset
+        self.dispersion = dispersion if dispersion is not None else {'w': 0.0, 'r': 0.01, 'g': 0.0, 'b': -0.01}
+
+    def scales(self, z_mm, flt):
+        """
+        Returns the factors y / y0 for the p and l spots.
+
+        Parameters
+        ----------
+        z_mm : float
+            Screen position in mm.
+        flt : str
+            The active filter ('w', 'r', 'g' or 'b').
+
+        Returns
+        -------
+        tuple (float, float)
+            Scale of the p (side) spots and of the l (corner) spots.
+            Negative when the screen is past the focal point.
+        """
+        focal = self.focal * (1 + self.dispersion.get(flt, 0.0))
+        # effective_f = 2 * f_p - f_l and delta_f = f_p - f_l
+        f_p = focal - self.delta_f
+        f_l = focal - 2 * self.delta_f
+        d = z_mm + self.offset
+        return 1 - d / f_p, 1 - d / f_l
+
+
+class SimulatedArduino:
+    """
+    Simulated Arduino running the SlideBench sketch.
+
+    Has the parts of the serial.Serial interface used by communication.py
+    (read, write, in_waiting, is_open, close, readline). A firmware thread
+    executes the received commands with the speeds of the real motor, and
+    prints the same messages as the sketch: 'POS: <steps>' every 200 ms,
+    'DONE: <steps>' at the end of each move, 'FILTER: <x>' when the
+    estimated filter turn time has passed and 'LED: <pwm>' after each LED
+    command.
+
+    As in the sketch, positions are negative (the origin is at the limit
+    switch), and p/g moves block the loop: no command is processed and no
+    POS line is printed until the move is finished.
+
+    Parameters
+    ----------
+    clock : SimulatedClock
+        Clock that sets the pace of the simulation.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.timeout = 0.1
+        self.is_open = True
+
+        # Bytes waiting to be read by the host, and the commands received
+        self._output = bytearray()
+        self._output_ready = threading.Condition()
+        self._input = b""
+        self._commands = queue.Queue()
+
+        # Hardware state, mirrors the globals of the sketch
+        self._lock = threading.Lock()
+        self.factor_vel = 5
+        self.led_on = False
+        self.led_level = 5
+        self._position = 0.0        # motor.currentPosition(), in steps
+        self._direction = 0         # motorDirection for the r/l commands
+        self._move = None           # (start time, start position, target, speed) of a p/g move
+        self._servo_from = 0.0      # servo angle when the last f: command arrived
+        self._servo_to = 0.0        # angle requested by the last f: command
+        self._servo_time = 0.0      # simulated time of the last f: command
+        self._filter_pending = None # (filter, time) of the FILTER line still to print
+
+        self._thread = threading.Thread(target=self._firmware_loop, daemon=True)
+        self._thread.start()
+
+    # --- serial.Serial interface --- #
+
+    @property
+    def in_waiting(self):
+        with self._output_ready:
+            return len(self._output)
+
+    def read(self, size=1):
+        """Returns up to size bytes, waiting at most timeout seconds for the first one."""
+        with self._output_ready:
+            self._output_ready.wait_for(lambda: self._output or not self.is_open, self.timeout)
+            data = bytes(self._output[:size])
+            del self._output[:size]
+            return data
+
+    def readline(self):
+        """Returns one line including its newline, or b'' after the timeout."""
+        with self._output_ready:
+            self._output_ready.wait_for(lambda: b"\n" in self._output or not self.is_open, self.timeout)
+            end = self._output.find(b"\n") + 1
+            if end == 0:
+                return b""
+            data = bytes(self._output[:end])
+            del self._output[:end]
+            return data
+
+    def write(self, data):
+        """Receives bytes from the host. Each complete line is one command."""
+        self._input += bytes(data)
+        *commands, self._input = self._input.split(b"\n")
+        for command in commands:
+            self._commands.put(command.decode("utf-8", errors="replace").strip())
+        return len(data)
+
+    def close(self):
+        self.is_open = False
+        with self._output_ready:
+            self._output_ready.notify_all()
+
+    # --- State read by the virtual camera --- #
+
+    def snapshot(self):
+        """
+        Returns the physical state of the bench right now.
+
+        Returns
+        -------
+        tuple (float, float, float)
+            Screen position in steps (positive), LED brightness from 0 to 1,
+            and current servo angle in degrees.
+        """
+        now = self.clock.monotonic()
+        with self._lock:
+            position = self._position_at(now)
+            brightness = self._led_brightness()
+            angle = self._servo_angle(now)
+        return abs(position), brightness, angle
+
+    # --- Firmware --- #
+
+    def _println(self, text):
+        """Equivalent of Serial.println() in the sketch."""
+        with self._output_ready:
+            self._output += (text + "\r\n").encode()
+            self._output_ready.notify_all()
+
+    def _speed(self):
+        # A factorVel of 0 would make the real motor hang, use the slowest speed
+        return BASE_SPEED * max(self.factor_vel, 1)
+
+    def _position_at(self, now):
+        """Position in steps at simulated time now, including a move in progress."""
+        if self._move is None:
+            return self._position
+        start, origin, target, speed = self._move
+        travelled = (now - start) * speed
+        if travelled >= abs(target - origin):
+            return target
+        return origin + np.sign(target - origin) * travelled
+
+    def _led_pwm(self):
+        if not self.led_on:
+            return 0
+        # analogWrite(ledPin, map(ledIntensity, 1, 10, 25, 255)), integer math as in map()
+        return 25 + (self.led_level - 1) * (255 - 25) // 9
+
+    def _led_brightness(self):
+        return self._led_pwm() / 255
+
+    def _servo_angle(self, now):
+        travelled = (now - self._servo_time) * SERVO_SPEED
+        if travelled >= abs(self._servo_to - self._servo_from):
+            return self._servo_to
+        return self._servo_from + np.sign(self._servo_to - self._servo_from) * travelled
+
+    def _start_move(self, target, now):
+        """Starts a blocking p/g move towards target (negative steps)."""
+        # activarMotor(true) waits 5 ms before the motor starts
+        self._move = (now + 0.005, self._position, float(target), self._speed())
+
+    def _execute(self, command, now):
+        """Runs one command, following the if/else chain of loop() in the sketch."""
+        if command.startswith("v"):
+            self.factor_vel = _to_int(command[1:])
+        elif command == "r":
+            self._direction = 1 if self._position < 0 else 0
+        elif command == "l":
+            self._direction = -1 if self._position > -MAX_STEPS else 0
+        elif command == "s":
+            self._direction = 0
+        elif command.startswith("p") and len(command) > 1:
+            steps = _to_int(command[1:-1])
+            direction = command[-1]
+            if direction == 'f' and self._position + steps <= 0:
+                self._start_move(self._position + steps, now)
+            elif direction == 'b' and self._position - steps >= -MAX_STEPS:
+                self._start_move(self._position - steps, now)
+        elif command == "on":
+            self.led_on = True
+            self._println(f"LED: {self._led_pwm()}")
+        elif command == "off":
+            self.led_on = False
+            self._println(f"LED: {self._led_pwm()}")
+        elif command.startswith("led"):
+            level = _to_int(command[3:])
+            if 1 <= level <= 10:
+                self.led_level = level
+            self._println(f"LED: {self._led_pwm()}")
+        elif command.startswith("g"):
+            target = _to_int(command[1:])
+            if 0 <= target <= MAX_STEPS:
+                if -target == self._position:
+                    self._println(f"DONE: {int(self._position)}")
+                else:
+                    self._start_move(-target, now)
+        elif command.startswith("f:") and len(command) > 2:
+            flt = command[2]
+            if flt in FILTER_ANGLES:
+                # The sketch estimates the turn time from the last angle it sent
+                turn = abs(FILTER_ANGLES[flt] - self._servo_to) * SERVO_MS_PER_DEGREE / 1000
+                self._servo_from = self._servo_angle(now)
+                self._servo_to = FILTER_ANGLES[flt]
+                self._servo_time = now
+                self._filter_pending = (flt, now + turn + SERVO_MARGIN)
+                self._println(f"Filtro cambiado a: {flt}")
+
+    def _firmware_loop(self):
+        """Main loop of the simulated sketch, runs in its own thread."""
+        self.clock.sleep(BOOT_TIME)
+        self._println("Iniciando Homing...")
+        self._println("Homing completado. Posición actual: 0")
+        self._println("Iniciado con exito.")
+
+        last_time = self.clock.monotonic()
+        last_print = last_time
+        while self.is_open:
+            now = self.clock.monotonic()
+            with self._lock:
+                if self._move is not None:
+                    # A p/g move blocks the loop until it is finished
+                    if self._position_at(now) == self._move[2]:
+                        self._position = self._move[2]
+                        self._move = None
+                        self._println(f"DONE: {int(self._position)}")
+                else:
+                    # Continuous r/l movement
+                    if self._direction:
+                        self._position += self._direction * self._speed() * (now - last_time)
+                        if not -MAX_STEPS <= self._position <= 0:
+                            self._position = float(np.clip(self._position, -MAX_STEPS, 0))
+                            self._direction = 0
+                    # Commands are only read when no p/g move is running
+                    while self._move is None:
+                        try:
+                            self._execute(self._commands.get_nowait(), now)
+                        except queue.Empty:
+                            break
+                    if self._filter_pending is not None and now >= self._filter_pending[1]:
+                        self._println(f"FILTER: {self._filter_pending[0]}")
+                        self._filter_pending = None
+                    if now - last_print > POSITION_PERIOD:
+                        self._println(f"POS: {int(round(self._position))}")
+                        last_print = now
+            last_time = now
+            time.sleep(0.001)
+
+
+def _to_int(text):
+    """Same as String.toInt() in Arduino: leading integer, or 0 if there is none."""
+    digits = ""
+    for ch in text.strip():
+        if ch.isdigit() or (ch == "-" and not digits):
+            digits += ch
+        else:
+            break
+    try:
+        return int(digits)
+    except ValueError:
+        return 0
+
+
+class VirtualCamera:
+    """
+    Virtual USB camera that films the screen of the simulated bench.
+
+    Has the parts of the cv2.VideoCapture interface used by the program
+    (read, grab, retrieve, set, get, isOpened, release). Frames are 1920x1080
+    BGR images with the 3x3 spot pattern drawn for the screen position, LED
+    brightness and filter at the time the frame was exposed.
+
+    Like a USB camera driver, a sensor thread exposes fps frames per real
+    second, whatever the time scale, and keeps the last DRIVER_BUFFER
+    frames. grab() returns the oldest buffered frame at once, and only
+    blocks until the next exposure when the buffer is empty, so frames
+    read right after a move can show the bench before the move.
+
+    Parameters
+    ----------
+    device : SimulatedArduino
+        The simulated Arduino whose state is filmed.
+    clock : SimulatedClock
+        Clock that sets the frame rate.
+    lens : SimulatedLens or None, optional
+        Lens under test. None films the pattern without a lens, which is
+        how the reference is taken.
+    fps : float, optional
+        Frame rate in frames per real second. Default is 30.
+    noise : float, optional
+        Standard deviation of the sensor noise in gray levels. Default is 2.
+    """
+
+    def __init__(self, device, clock, lens=None, fps=30.0, noise=2.0):
+        self.device = device
+        self.clock = clock
+        self.lens = lens
+        self.fps = fps
+        self.width, self.height = 1920, 1080
+        self._opened = False
+        # Exposed frames waiting to be grabbed, as (time, device snapshot)
+        self._buffer = deque(maxlen=DRIVER_BUFFER)
+        self._buffer_ready = threading.Condition()
+        self._sensor = None
+        self._grabbed = None
+        self.frame_time = None  # simulated time at which the last grabbed frame was exposed
+        # A few precomputed noise fields, reused in turn to keep rendering fast
+        rng = np.random.default_rng(0)
+        self._noise = [np.clip(rng.normal(0, noise, (self.height, self.width, 3)), 0, 255).astype(np.uint8)
+                       for _ in range(4)] if noise > 0 else []
+        self._frame_count = 0
+        self.open()
+
+    def open(self):
+        """(Re)opens the camera and starts the sensor. Returns the camera itself."""
+        self._opened = True
+        if self._sensor is None or not self._sensor.is_alive():
+            self._sensor = threading.Thread(target=self._sensor_loop, daemon=True)
+            self._sensor.start()
+        return self
+
+    def isOpened(self):
+        return self._opened
+
+    def release(self):
+        with self._buffer_ready:
+            self._opened = False
+            self._buffer.clear()
+            self._buffer_ready.notify_all()
+
+    def set(self, prop, value):
+        import cv2
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            self.width = int(value)
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            self.height = int(value)
+        elif prop == cv2.CAP_PROP_FPS:
+            self.fps = float(value)
+        else:
+            return False
+        return True
+
+    def get(self, prop):
+        import cv2
+        # The frame rate is reported per simulated second, the clock the
+        # program uses when it runs on the simulator
+        return {cv2.CAP_PROP_FRAME_WIDTH: self.width,
+                cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+                cv2.CAP_PROP_FPS: self.fps / self.clock.time_scale}.get(prop, 0.0)
+
+    def _sensor_loop(self):
+        """Exposes one frame per period while the camera is open, runs in its own thread."""
+        next_frame = time.monotonic()
+        while self._opened:
+            now = time.monotonic()
+            if next_frame > now:
+                time.sleep(next_frame - now)
+            # Only the state is stored, the image is rendered when retrieved
+            with self._buffer_ready:
+                self._buffer.append((self.clock.monotonic(), self.device.snapshot()))
+                self._buffer_ready.notify_all()
+            next_frame = max(next_frame + 1 / self.fps, now)
+
+    def grab(self):
+        """Takes the oldest buffered frame, waiting for the next exposure if there is none."""
+        with self._buffer_ready:
+            self._buffer_ready.wait_for(lambda: self._buffer or not self._opened)
+            if not self._opened:
+                return False
+            self.frame_time, self._grabbed = self._buffer.popleft()
+        return True
+
+    def retrieve(self, image=None):
+        """
+        Renders the frame taken by the last grab() call, into image if it
+        is given and has the frame size, like cv2.VideoCapture.retrieve().
+        """
+        if not self._opened or self._grabbed is None:
+            return False, None
+        return True, self.render(self._grabbed, image)
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def render(self, state=None, out=None):
+        """
+        Draws the bench.
+
+        Parameters
+        ----------
+        state : tuple, optional
+            A snapshot() of the simulated Arduino. Default is the current state.
+        out : numpy array, optional
+            Array to draw into, used if it has the frame shape. Default is None.
+
+        Returns
+        -------
+        numpy array
+            A height x width x 3 BGR image.
+        """
+        import cv2
+
+        steps, brightness, angle = state if state is not None else self.device.snapshot()
+        if out is not None and out.shape == (self.height, self.width, 3) and out.dtype == np.uint8:
+            frame = out
+            frame.fill(0)
+        else:
+            frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+
+        # The filter in front of the camera, None while the wheel is turning
+        flt = next((f for f, a in FILTER_ANGLES.items() if abs(angle - a) < 5), None)
+
+        if brightness > 0 and flt is not None:
+            z_mm = float(utils.steps_to_mm_array(steps))
+            scale_p, scale_l = self.lens.scales(z_mm, flt) if self.lens else (1.0, 1.0)
+            color = np.array(FILTER_COLORS[flt]) * 230 * brightness
+            cx, cy = self.width / 2, self.height / 2
+            for i in (-1, 0, 1):
+                for j in (-1, 0, 1):
+                    # Side spots belong to the p group, corners to the l group
+                    scale = scale_l if i and j else scale_p
+                    self._draw_spot(frame, cx + i * SPOT_PITCH * scale, cy + j * SPOT_PITCH * scale, color)
+
+        if self._noise:
+            cv2.add(frame, self._noise[self._frame_count % len(self._noise)], dst=frame)
+        self._frame_count += 1
+        return frame
+
+    def _draw_spot(self, frame, x, y, color):
+        """Adds one Gaussian spot centered at (x, y) to the frame."""
+        r = int(4 * SPOT_SIGMA)
+        x0, y0 = int(x) - r, int(y) - r
+        x1, y1 = x0 + 2 * r + 1, y0 + 2 * r + 1
+        if x0 < 0 or y0 < 0 or x1 > frame.shape[1] or y1 > frame.shape[0]:
+            return
+        xx = np.arange(x0, x1) - x
+        yy = np.arange(y0, y1) - y
+        spot = np.exp(-(yy[:, None] ** 2 + xx[None, :] ** 2) / (2 * SPOT_SIGMA ** 2))
+        patch = frame[y0:y1, x0:x1].astype(np.float32) + spot[:, :, None] * color
+        frame[y0:y1, x0:x1] = np.clip(patch, 0, 255)
+
+
+class Simulation:
+    """
+    A simulated bench: clock, Arduino, camera and lens.
+
+    register() makes the devices available under SIMULATED_PORT and
+    SIMULATED_CAMERA in the connection window. connect() selects them
+    directly, for headless use.
+
+    Parameters
+    ----------
+    time_scale : float, optional
+        How many times faster than real time the bench runs. Default is 1.
+    lens : SimulatedLens, optional
+        Lens under test. Default is a 100 mm lens.
+    """
+
+    def __init__(self, time_scale=1.0, lens=None):
+        self.clock = SimulatedClock(time_scale)
+        self.lens = lens if lens is not None else SimulatedLens()
+        self.device = None
+        self.camera = None
+
+    def _open_device(self, baudrate):
+        # A new connection resets the board, like the real Arduino
+        if self.device is not None:
+            self.device.close()
+        self.device = SimulatedArduino(self.clock)
+        if self.camera is None:
+            self.camera = VirtualCamera(self.device, self.clock, self.lens)
+        self.camera.device = self.device
+        return self.device
+
+    def _open_camera(self):
+        if self.camera is None:
+            # The camera films the bench, so the bench must exist first
+            self._open_device(115200)
+        return self.camera.open()
+
+    def register(self):
+        """Adds the simulated devices to the communication and camera backends."""
+        communication.port_backends[SIMULATED_PORT] = self._open_device
+        camera_functions.camera_backends[SIMULATED_CAMERA] = self._open_camera
+
+    def connect(self):
+        """Connects to the simulated Arduino and selects the virtual camera."""
+        self.register()
+        communication.connect_arduino(SIMULATED_PORT)
+        camera_functions.set_camera_index(SIMULATED_CAMERA)
+
+    def close(self):
+        """Disconnects the simulated Arduino and releases the camera."""
+        communication.disconnect_arduino()
+        camera_functions.stop_acquisition()
+
+    def measure_reference(self):
+        """
+        Takes the reference measurement at position 0 without the lens,
+        the same sequence as do_reference() but without saving to disk.
+
+        Returns
+        -------
+        numpy array
+            4x8 array of reference distances, one row per filter.
+        """
+        import focal_measurements as fm
+
+        lens, self.camera.lens = self.camera.lens, None
+        try:
+            fm.move_to_position(0)
+            fm.desired_position(0)
+            fm.led_on()
+            fm.led_intensity(10)
+            y0 = np.zeros((4, 8))
+            for idx, f in enumerate(fm.FILTERS):
+                since = fm.ack_marker()
+                fm.activate_filter(f)
+                img = fm.settle(f"reference {f}", [], ("FILTER", f), since)
+                y0[idx] = fm.compute_distances_to_center(img, idx)
+            fm.led_off()
+            fm.activate_filter('w')
+            return y0
+        finally:
+            self.camera.lens = lens
+
+    def run_measurement(self, z1, z2, modo=1, workers=None):
+        """
+        Runs a full automatic measurement on the simulated bench: takes the
+        reference, then calls automatic_measurement() with the time module
+        of the measurement, camera and acquisition code replaced by the simulated clock,
+        so their waits are accelerated too.
+
+        Parameters
+        ----------
+        z1, z2 : float
+            Screen positions in mm.
+        modo : int, optional
+            Calculation mode (1, 2 or 3). Default is 1.
+        workers : int, optional
+            Number of image processing threads. Default is
+            DETECTION_WORKERS of focal_measurements.py.
+
+        Returns
+        -------
+        tuple
+            The values returned by automatic_measurement().
+        """
+        import focal_measurements as fm
+
+        self.connect()
+        # The camera functions and the acquisition thread time their waits
+        # and frames too, they use the same clock
+        real_time = fm.time
+        fm.time = camera_functions.time = acquisition.time = self.clock
+        try:
+            y0 = self.measure_reference()
+            return fm.automatic_measurement(z1, z2, modo, reference=y0,
+                                            workers=workers or fm.DETECTION_WORKERS)
+        finally:
+            # Stop the acquisition thread before it goes back to real time
+            self.close()
+            fm.time = camera_functions.time = acquisition.time = real_time
+
+
+def enable(time_scale=1.0):
+    """
+    Makes a simulated bench available in the connection window.
+    Called by main.py when started with --simulator.
+
+    Returns
+    -------
+    Simulation
+        The registered simulation.
+    """
+    simulation = Simulation(time_scale)
+    simulation.register()
+    return simulation
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a measurement on the simulated SlideBench")
+    parser.add_argument("--z1", type=float, default=10.0, help="first screen position in mm")
+    parser.add_argument("--z2", type=float, default=50.0, help="second screen position in mm")
+    parser.add_argument("--modo", type=int, default=1, choices=[1, 2, 3], help="calculation mode")
+    parser.add_argument("--focal", type=float, default=100.0, help="effective focal length of the simulated lens in mm")
+    parser.add_argument("--delta-f", type=float, default=0.5, help="difference between the p and l focal lengths in mm")
+    parser.add_argument("--offset", type=float, default=20.0, help="distance from the lens to position 0 in mm")
+    parser.add_argument("--time-scale", type=float, default=20.0, help="simulation speed relative to real time")
+    parser.add_argument("--workers", type=int, help="number of image processing threads")
+    args = parser.parse_args()
+
+    sim = Simulation(args.time_scale, SimulatedLens(args.focal, args.delta_f, args.offset))
+    start = time.perf_counter()
+    measurement = sim.run_measurement(args.z1, args.z2, args.modo, args.workers)
+    elapsed = time.perf_counter() - start
+    results, telemetry = measurement[0], measurement[-1]
+
+    for flt, res in results.items():
+        if "effective_focal" in res:
+            print(f"Filter {flt.upper()}: f = {res['effective_focal']:.3f} ± {res['error_effective_focal']:.3f} mm, "
+                  f"Δf = {res['delta_f']:.3f} mm")
+        else:
+            print(f"Filter {flt.upper()}: {res.get('error')}")
+    print(f"Wall time: {elapsed:.2f} s ({elapsed * args.time_scale:.1f} s of simulated time)")
+
+    # The measurement code ran on the simulated clock, so these are simulated seconds
+    print(f"Measurement: {telemetry['total_time']:.1f} s, image processing "
+          f"{telemetry['processing_time']:.1f} s ({telemetry['processing_share']:.0%}), "
+          f"settle waits {telemetry['wait_time']:.1f} s")
+    print(f"Results ready {telemetry['post_capture_latency'] * 1e3:.0f} ms after the last capture "
+          f"({telemetry['workers']} processing threads)")
@@ -1,55 +1,185 @@
 import sys
 import os
-import pandas as pd
-import requests
-import webbrowser
+import time
+import threading
+import numpy as np
+import json
+import hashlib
 from tkinter import messagebox
 
 APP_VERSION = "1.0.0"  
 GITHUB_REPO = "revitss/slidebench-app" 
 
-def check_for_updates():
+# GitHub API endpoint that describes the latest published release
+LATEST_RELEASE_URL = f"https://api.github.com/repos/{GITHUB_REPO}/releases/latest"
+# GitHub is asked at most once per day, the answer is cached in between
+UPDATE_CHECK_INTERVAL = 24 * 60 * 60
+# (connect, read) timeouts in seconds for the request. The connect timeout
+# is short so offline bench PCs give up quickly
+UPDATE_CHECK_TIMEOUT = (2, 5)
+# Interval in milliseconds at which the window checks if the answer arrived
+UPDATE_POLL_INTERVAL = 200
+
+
+def fetch_latest_version(url=LATEST_RELEASE_URL, timeout=UPDATE_CHECK_TIMEOUT):
     """
-    Checks GitHub for the latest release and compares it with the
-    current app version. If a newer version is available, asks the
-    user if they want to download it.
+    Asks GitHub for the tag of the latest release.
+
+    Parameters
+    ----------
+    url : str, optional
+        The releases API endpoint. Default is LATEST_RELEASE_URL.
+    timeout : float or tuple, optional
+        Timeout passed to requests, either one value or (connect, read).
+        Default is UPDATE_CHECK_TIMEOUT.
+
+    Returns
+    -------
+    str or None
+        The latest version tag e.g. 'v1.0.1', or None if it could not be
+        retrieved (no internet connection, timeout, unexpected response...).
     """
-    try:
-        # Call the GitHub API to get the latest release information
-        url = f"https://api.github.com/repos/{GITHUB_REPO}/releases/latest"
-        response = requests.get(url, timeout=5)
+    # requests is only needed here, so it is imported when the check runs
+    # instead of delaying the start of the program
+    import requests
 
+    try:
+        response = requests.get(url, timeout=timeout)
         # If the request failed, silently ignore
         if response.status_code != 200:
-            return
-
+            return None
         # Extract the latest version tag e.g. "v1.0.1"
-        latest_version = response.json()["tag_name"]
-        # Remove the 'v' prefix to compare with APP_VERSION
-        latest_clean = latest_version.lstrip("v")
-
-        # Compare with current version
-        if latest_clean != APP_VERSION:
-            # A new version is available — ask the user
-            answer = messagebox.askyesno(
-                "Update available",
-                f"A new version of SlideBench is available!\n\n"
-                f"Current version: v{APP_VERSION}\n"
-                f"New version: {latest_version}\n\n"
-                f"Do you want to download it?"
-            )
-            if answer:
-                # Open the browser at the latest release page
-                webbrowser.open(
-                    f"https://github.com/{GITHUB_REPO}/releases/latest"
-                )
-
-    except requests.ConnectionError:
-        # No internet connection — silently ignore
-        pass
+        return response.json()["tag_name"]
+    except requests.RequestException:
+        # No internet connection or timeout — silently ignore
+        return None
     except Exception as e:
         # Any other error — silently ignore so the app still launches
         print(f"Update check failed: {e}")
+        return None
+
+
+def get_latest_version(url=LATEST_RELEASE_URL, timeout=UPDATE_CHECK_TIMEOUT,
+                       max_age=UPDATE_CHECK_INTERVAL):
+    """
+    Returns the latest release tag, asking GitHub at most once every
+    max_age seconds. The time of the last check and its answer are stored
+    in data/update_check.json. Failed checks are also recorded, so a PC
+    without internet does not retry on every start; the last known
+    version is kept in that case.
+
+    Parameters
+    ----------
+    url : str, optional
+        The releases API endpoint. Default is LATEST_RELEASE_URL.
+    timeout : float or tuple, optional
+        Timeout passed to requests. Default is UPDATE_CHECK_TIMEOUT.
+    max_age : float, optional
+        How long in seconds a cached answer stays valid.
+        Default is UPDATE_CHECK_INTERVAL (one day).
+
+    Returns
+    -------
+    str or None
+        The latest version tag, or None if it has never been retrieved.
+    """
+    cache_path = os.path.join(external_folder("data"), "update_check.json")
+
+    # Read the answer of the previous check, if there is one
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    if time.time() - cache.get("checked_at", 0) < max_age:
+        # Checked recently — use the cached answer without any network access
+        return cache.get("latest_version")
+
+    latest_version = fetch_latest_version(url, timeout) or cache.get("latest_version")
+
+    try:
+        with open(cache_path, "w") as f:
+            json.dump({"checked_at": time.time(), "latest_version": latest_version}, f)
+    except OSError:
+        pass
+
+    return latest_version
+
+
+def is_newer_version(version):
+    """
+    Returns True if the given version tag (e.g. 'v1.0.1') is newer than
+    APP_VERSION. Falls back to a plain comparison for tags that are not
+    made only of numbers.
+    """
+    # Remove the 'v' prefix to compare with APP_VERSION
+    clean = version.lstrip("v")
+    try:
+        return tuple(map(int, clean.split("."))) > tuple(map(int, APP_VERSION.split(".")))
+    except ValueError:
+        return clean != APP_VERSION
+
+
+def ask_to_update(latest_version):
+    """
+    Tells the user a newer version is available and, if they accept,
+    opens the browser at the latest release page.
+    Must run in the Tkinter main thread.
+    """
+    import webbrowser
+
+    # A new version is available — ask the user
+    answer = messagebox.askyesno(
+        "Update available",
+        f"A new version of SlideBench is available!\n\n"
+        f"Current version: v{APP_VERSION}\n"
+        f"New version: {latest_version}\n\n"
+        f"Do you want to download it?"
+    )
+    if answer:
+        # Open the browser at the latest release page
+        webbrowser.open(
+            f"https://github.com/{GITHUB_REPO}/releases/latest"
+        )
+
+
+def check_for_updates(win):
+    """
+    Checks GitHub for the latest release and compares it with the
+    current app version. If a newer version is available, asks the
+    user if they want to download it.
+
+    The check runs in a background thread so a slow or missing internet
+    connection never freezes the window. The thread never calls Tk: the
+    window polls for its answer with after() and asks the question from
+    the main thread.
+
+    Parameters
+    ----------
+    win : tk.Tk
+        The window whose main loop polls for the answer.
+    """
+    # Filled by the thread, read by the main thread once the thread ended
+    answer = {}
+
+    def task():
+        """Runs the (possibly slow) check away from the main thread."""
+        answer["latest_version"] = get_latest_version()
+
+    def poll():
+        """Asks the user once the check finished, in the main thread."""
+        if thread.is_alive():
+            win.after(UPDATE_POLL_INTERVAL, poll)
+            return
+        latest_version = answer.get("latest_version")
+        if latest_version and is_newer_version(latest_version):
+            ask_to_update(latest_version)
+
+    # daemon=True means the thread will not keep the program alive
+    thread = threading.Thread(target=task, daemon=True)
+    thread.start()
+    win.after(UPDATE_POLL_INTERVAL, poll)
 
 # ==========================================================
 #  PATH UTILITY FUNCTIONS
@@ -176,23 +306,229 @@ def external_folder(folder_name):
 # A lookup table stored in a CSV file (mm_to_steps.csv) maps between the two.
 # The CSV has two columns: 'millimeters' and 'steps'.
 #
-# The table is loaded once when the module is first imported so it does not
-# need to be reloaded every time a conversion is requested.
+# The table is loaded once when the module is first imported and kept as two
+# compact NumPy arrays, so every conversion is a direct index or a binary
+# search instead of a scan over all 93,000 rows. Both columns grow
+# monotonically with the row number, which is what makes the binary search
+# and the interpolation between calibration points possible.
+#
+# To keep startup fast, the CSV is only parsed the first time (or when it
+# changes). The parsed table is stored as a binary .npy file that later
+# starts memory-map directly.
 
 # Build the path to the CSV file using resource_path to handle both
 # development and compiled exe environments
 csv_path = resource_path(os.path.join("resources", "mm_to_steps.csv"))
 
-# Load the conversion table from the CSV file into a pandas DataFrame
+
+def calibration_cache_path():
+    """
+    Returns the path of the precompiled binary copy of the conversion table.
+
+    When running from source the cache lives next to the CSV file.
+    When running as a compiled .exe the CSV is extracted to a temporary
+    folder that is deleted on exit, so the cache is stored in the external
+    data/ folder instead, where it survives between launches.
+
+    Returns
+    -------
+    str
+        The absolute path to the mm_to_steps.npy cache file.
+    """
+    if getattr(sys, "frozen", False):
+        return os.path.join(external_folder("data"), "mm_to_steps.npy")
+    return os.path.splitext(csv_path)[0] + ".npy"
+
+
+def _file_sha1(path):
+    """Returns the SHA-1 hex digest of a file's contents."""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def calibration_sha1():
+    """
+    Returns the SHA-1 hex digest of the mm/steps conversion table, stored
+    with every saved measurement to know which calibration it used.
+    """
+    global _calibration_sha1
+    if _calibration_sha1 is None:
+        _calibration_sha1 = _file_sha1(csv_path)
+    return _calibration_sha1
+
+
+# Digest of the conversion table, computed the first time it is needed
+_calibration_sha1 = None
+
+
+def load_calibration():
+    """
+    Loads the mm/steps conversion table as a (2, N) float64 array where
+    row 0 holds the millimeters and row 1 the steps.
+
+    Parsing the 93,000-row CSV is slow, so the table is compiled once into
+    a .npy file (see calibration_cache_path) and memory-mapped on every
+    later start. A small .key file stored next to the cache remembers the
+    modification time, size and SHA-1 hash of the CSV it was built from.
+    The cache is rebuilt automatically when the CSV changes:
+
+    - Same mtime and size: the cache is used without reading the CSV.
+    - Different mtime but same hash (e.g. file copied or touched):
+      the key is refreshed and the cache is used.
+    - Different hash: the CSV is parsed again and the cache rewritten.
+
+    If the cache cannot be written (read-only folder, file in use by
+    another instance...) the parsed table is simply kept in memory.
+
+    Returns
+    -------
+    numpy array
+        Array of shape (2, N) with the millimeters and steps columns.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the CSV file does not exist.
+    """
+    stat = os.stat(csv_path)
+    cache_path = calibration_cache_path()
+    key_path = os.path.splitext(cache_path)[0] + ".key"
+
+    # Read the key describing the CSV the existing cache was built from
+    try:
+        with open(key_path) as f:
+            key = json.load(f)
+    except (OSError, ValueError):
+        key = {}
+
+    if os.path.exists(cache_path) and key:
+        try:
+            if key.get("mtime_ns") == stat.st_mtime_ns and key.get("size") == stat.st_size:
+                # CSV untouched since the cache was built
+                return np.load(cache_path, mmap_mode="r")
+            if key.get("sha1") == _file_sha1(csv_path):
+                # CSV touched but its content is the same — just refresh the key
+                key.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                with open(key_path, "w") as f:
+                    json.dump(key, f)
+                return np.load(cache_path, mmap_mode="r")
+        except (OSError, ValueError):
+            # Unreadable or corrupted cache — fall through and rebuild it
+            pass
+
+    # Parse the CSV: header 'millimeters,steps' followed by one row per step
+    table = np.ascontiguousarray(np.loadtxt(csv_path, delimiter=",", skiprows=1, ndmin=2).T)
+
+    try:
+        # Write to a temporary file first and rename it, so a crash while
+        # writing never leaves a half written cache behind
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, table)
+        os.replace(tmp_path, cache_path)
+        with open(key_path, "w") as f:
+            json.dump({"mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                       "sha1": _file_sha1(csv_path)}, f)
+    except OSError:
+        # The cache is only an optimization, the parsed table works the same
+        pass
+
+    return table
+
+
+# Load the conversion table into two NumPy arrays
 # If the file is missing, show a clear error instead of crashing silently
 try:
-    conversion_df = pd.read_csv(csv_path)
+    calibration = load_calibration()
+    # Both rows are contiguous views, no data is copied
+    mm_table = np.asarray(calibration[0])
+    steps_table = np.asarray(calibration[1])
 except FileNotFoundError:
     messagebox.showwarning("Error", f"Error: conversion table not found at {csv_path}.")
     messagebox.showwarning("Error", "Motor step/mm conversions will not work until this file is present.")
-    # Create an empty DataFrame so the rest of the module can still be imported
+    # Create empty tables so the rest of the module can still be imported
     # without crashing — functions will raise errors when actually called
-    conversion_df = pd.DataFrame(columns=['millimeters', 'steps'])
+    mm_table = np.zeros(0, dtype=np.float64)
+    steps_table = np.zeros(0, dtype=np.float64)
+
+# When the steps column is exactly 0, 1, 2, ... (the normal case) the row
+# number IS the step count, so steps_to_mm can index the array directly
+steps_are_row_index = bool(np.array_equal(steps_table, np.arange(len(steps_table))))
+
+
+def mm_to_steps_array(mm_values):
+    """
+    Vectorized version of mm_to_steps() that converts many millimeter
+    values to motor steps at once.
+
+    Values that exist in the table return the step count of their first
+    matching row, exactly like mm_to_steps(). Values that fall between two
+    calibration points are linearly interpolated between the neighbouring
+    rows and rounded to the nearest step.
+
+    Parameters
+    ----------
+    mm_values : array_like
+        The distances in millimeters to convert.
+        Rounded to 2 decimal places to match the CSV precision.
+
+    Returns
+    -------
+    numpy array of int64
+        The corresponding motor steps, with the same shape as mm_values.
+
+    Raises
+    ------
+    ValueError
+        If any value lies outside the range covered by the conversion table.
+    """
+    # Round to 2 decimal places to match the precision stored in the CSV
+    mm_values = np.round(np.asarray(mm_values, dtype=np.float64), 2)
+
+    if len(mm_table) == 0 or np.any((mm_values < mm_table[0]) | (mm_values > mm_table[-1])):
+        raise ValueError(f"Value {mm_values} mm outside the conversion table.")
+
+    # Binary search for the first row whose mm value is >= the requested value
+    upper = np.searchsorted(mm_table, mm_values, side='left')
+    upper = np.minimum(upper, len(mm_table) - 1)
+    # The row just before it is the closest calibration point below the value
+    lower = np.maximum(upper - 1, 0)
+
+    exact = mm_table[upper] == mm_values
+    # Interpolate between the two neighbouring rows for in-between values
+    # np.where guards the division for the exact matches, where span is 0
+    span = mm_table[upper] - mm_table[lower]
+    fraction = np.where(exact, 0.0, (mm_values - mm_table[lower]) / np.where(span == 0, 1.0, span))
+    interpolated = steps_table[lower] + fraction * (steps_table[upper] - steps_table[lower])
+
+    return np.where(exact, steps_table[upper], np.rint(interpolated)).astype(np.int64)
+
+
+def steps_to_mm_array(steps_values):
+    """
+    Vectorized version of steps_to_mm() that converts many motor step
+    counts to millimeters at once.
+
+    Parameters
+    ----------
+    steps_values : array_like
+        The motor step counts to convert.
+
+    Returns
+    -------
+    numpy array of float64
+        The corresponding distances in millimeters, with the same shape
+        as steps_values. Step counts outside the table are returned as NaN.
+    """
+    steps_values = np.asarray(steps_values, dtype=np.float64)
+    if len(steps_table) == 0:
+        return np.full(steps_values.shape, np.nan)
+
+    # np.interp returns the table value for exact matches and interpolates
+    # between calibration points for anything in between
+    result = np.interp(steps_values, steps_table, mm_table)
+    # Values outside the table have no valid conversion
+    return np.where((steps_values < steps_table[0]) | (steps_values > steps_table[-1]), np.nan, result)
 
 
 def mm_to_steps(mm_value):
@@ -204,6 +540,10 @@ def mm_to_steps(mm_value):
     the relationship between mm and steps may be non-linear or calibrated
     empirically for this specific motor and leadscrew combination.
 
+    The lookup is a binary search over the sorted millimeters column. If the
+    value is not stored in the table but lies between two calibration points,
+    the step count is interpolated between them.
+
     Parameters
     ----------
     mm_value : float or int
@@ -218,23 +558,27 @@ def mm_to_steps(mm_value):
     Raises
     ------
     ValueError
-        If the given mm value is not found in the conversion table.
+        If the given mm value is outside the range of the conversion table.
     """
     # Round to 2 decimal places to match the precision stored in the CSV
     mm_value = round(float(mm_value), 2)
 
-    # Search the 'millimeters' column for a row matching the requested value
-    matches = conversion_df.index[conversion_df['millimeters'] == mm_value]
-
-    if not matches.empty:
-        # Get the index of the first matching row
-        index = matches[0]
-        # Return the corresponding step count as an integer
-        return int(conversion_df.loc[index, 'steps'])
-    else:
-        # No match found — raise an error so the caller knows the conversion failed
+    if len(mm_table) == 0 or not mm_table[0] <= mm_value <= mm_table[-1]:
+        # No calibration covers this value — raise an error so the caller knows
         raise ValueError(f"Value {mm_value} mm not found in conversion table.")
 
+    # Binary search for the first row with a matching or larger mm value
+    index = int(np.searchsorted(mm_table, mm_value, side='left'))
+
+    if mm_table[index] == mm_value:
+        # Exact match — return the step count of the first matching row
+        return int(steps_table[index])
+
+    # The value lies between rows index-1 and index — interpolate the steps
+    mm_low, mm_high = mm_table[index - 1], mm_table[index]
+    steps_low, steps_high = steps_table[index - 1], steps_table[index]
+    return int(round(steps_low + (mm_value - mm_low) / (mm_high - mm_low) * (steps_high - steps_low)))
+
 
 def steps_to_mm(steps_value):
     """
@@ -245,6 +589,10 @@ def steps_to_mm(steps_value):
     raw step count reported by the Arduino into a human readable mm value
     for display in the GUI.
 
+    Since the step column normally holds every step count in order, the
+    step count is used directly as the row index. Otherwise a binary search
+    over the step column is used.
+
     Parameters
     ----------
     steps_value : int
@@ -256,20 +604,19 @@ def steps_to_mm(steps_value):
         The corresponding distance in millimeters,
         or None if the step count is not found in the conversion table.
     """
-    # Search the 'steps' column for a row matching the requested step count
-    matches = conversion_df.index[conversion_df['steps'] == steps_value]
-
-    if not matches.empty:
-        # Get the index of the first matching row
-        index = matches[0]
-        # Return the corresponding mm value as a float
-        return float(conversion_df.loc[index, 'millimeters'])
-    else:
-        # No match found — show a warning and return None
-        # Unlike mm_to_steps, this does not raise an error because it is called
-        # continuously by the position update loop and a missing value is not critical
-        messagebox.showwarning("Error", f"Warning: step value {steps_value} not found in conversion table.")
-        return None
+    if steps_are_row_index and 0 <= steps_value < len(mm_table) and steps_value == int(steps_value):
+        # Fast path: the step count is the row number
+        return float(mm_table[int(steps_value)])
+
+    if len(steps_table) and steps_table[0] <= steps_value <= steps_table[-1]:
+        # Binary search in the step column, interpolating between rows if needed
+        return float(np.interp(steps_value, steps_table, mm_table))
+
+    # No match found — show a warning and return None
+    # Unlike mm_to_steps, this does not raise an error because it is called
+    # continuously by the position update loop and a missing value is not critical
+    messagebox.showwarning("Error", f"Warning: step value {steps_value} not found in conversion table.")
+    return None
 
 
 """
@@ -277,7 +624,6 @@ pyinstaller --onefile --windowed --name="SlideBench" --icon="program/resources/i
 --hidden-import cv2 \
 --collect-all cv2 \
 --hidden-import pygrabber \
---hidden-import sklearn \
 --hidden-import serial \
 --hidden-import requests \
 --add-data "program/resources;resources" \
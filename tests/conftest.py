@@ -0,0 +1,8 @@
+"""
+The program modules import each other by name from the program/ folder,
+as when the application is started from there.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "program"))
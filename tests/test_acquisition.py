@@ -0,0 +1,113 @@
+"""
+The acquisition thread owns the camera device: it is the only thread that
+calls it once started, and it releases it itself when it stops.
+"""
+import threading
+import time
+
+import numpy as np
+
+import acquisition
+import camera_functions
+from acquisition import Acquisition
+
+
+class FakeDevice:
+    """A cv2.VideoCapture-like device that records the calls made to it."""
+
+    def __init__(self, fps=100.0, grab_ok=True):
+        self.fps = fps
+        self.grab_ok = grab_ok
+        self.gate = threading.Event()
+        self.gate.set()
+        self.in_grab = threading.Event()
+        self.calls = []
+        self.released = 0
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        self.calls.append(("get", threading.current_thread()))
+        return self.fps
+
+    def grab(self):
+        self.calls.append(("grab", threading.current_thread()))
+        self.in_grab.set()
+        # Blocks while the gate is closed, like a driver waiting for the sensor
+        self.gate.wait()
+        time.sleep(1 / self.fps)
+        return self.grab_ok
+
+    def retrieve(self, image=None):
+        self.calls.append(("retrieve", threading.current_thread()))
+        frame = np.zeros((4, 4, 3), np.uint8)
+        if image is not None:
+            image[...] = frame
+            return True, image
+        return True, frame
+
+    def release(self):
+        # A release while a grab is running is what must never happen
+        assert not (self.in_grab.is_set() and not self.gate.is_set())
+        self.released += 1
+
+
+def test_stop_waits_for_the_grab_before_releasing():
+    device = FakeDevice()
+    acq = Acquisition(device).start()
+    assert acq.ring.next_after(-1, timeout=2) is not None
+
+    device.gate.clear()
+    device.in_grab.clear()
+    assert device.in_grab.wait(2)
+    # The thread is stuck in a grab: stop() reports it and does not release
+    assert not acq.stop(timeout=0.1)
+    assert device.released == 0
+
+    device.gate.set()
+    acq._thread.join(2)
+    assert device.released == 1
+
+
+def test_lost_device_is_released_by_the_thread(monkeypatch):
+    monkeypatch.setattr(acquisition, "MAX_FAILED_GRABS", 3)
+    device = FakeDevice(grab_ok=False)
+    acq = Acquisition(device).start()
+    acq._thread.join(2)
+    assert not acq.running
+    assert device.released == 1
+    assert acq.stop()
+    assert device.released == 1
+
+
+def test_consumers_never_call_the_device():
+    device = FakeDevice()
+    acq = Acquisition(device).start()
+    try:
+        for _ in range(5):
+            assert acq.frame_after(time.monotonic(), timeout=2) is not None
+    finally:
+        assert acq.stop()
+    # Only the fps was read, before the thread started; the rest by the thread
+    assert device.calls[0] == ("get", threading.main_thread())
+    assert {thread for _, thread in device.calls[1:]} == {acq._thread}
+
+
+def test_restart_after_the_thread_stopped_by_itself(monkeypatch):
+    monkeypatch.setattr(acquisition, "MAX_FAILED_GRABS", 3)
+    devices = [FakeDevice(grab_ok=False), FakeDevice()]
+    opened = iter(devices)
+    monkeypatch.setattr(camera_functions, "open_camera", lambda: next(opened))
+    monkeypatch.setattr(camera_functions, "acquisition", None)
+    monkeypatch.setattr(camera_functions, "cap", None)
+
+    first = camera_functions.start_acquisition()
+    first._thread.join(2)
+    second = camera_functions.start_acquisition()
+    try:
+        assert second is not first and second.running
+        assert devices[0].released == 1
+    finally:
+        camera_functions.stop_acquisition()
+    assert devices[1].released == 1
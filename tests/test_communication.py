@@ -0,0 +1,128 @@
+"""
+Motion completion over a simulated serial port: the Arduino of
+simulator.py sends 'DONE: <steps>' when a move ends, and the waiting
+thread must wake up right away, or give up after its timeout.
+"""
+import threading
+import time
+
+import pytest
+
+import communication
+import simulator
+from controller import move_to_position
+from focal_measurements import desired_position
+
+# Maximum delay between the DONE line and the waiting thread waking up
+MAX_LATENCY = 0.1
+
+
+@pytest.fixture
+def bench(monkeypatch):
+    """Connects to a simulated Arduino running in real time, so POS lines come every 200 ms."""
+    done_times = []
+    println = simulator.SimulatedArduino._println
+
+    def record_done(self, text):
+        if text.startswith("DONE"):
+            done_times.append(time.perf_counter())
+        println(self, text)
+
+    monkeypatch.setattr(simulator.SimulatedArduino, "_println", record_done)
+    simulation = simulator.Simulation(time_scale=1)
+    simulation.register()
+    communication.connect_arduino(simulator.SIMULATED_PORT)
+    # Wait for the first position report after the boot of the sketch
+    assert communication.position_state.wait_for(lambda steps: True, timeout=5)
+    yield done_times
+    communication.disconnect_arduino()
+
+
+def test_wakes_up_on_done(bench):
+    move_to_position(2)
+    start = time.perf_counter()
+    desired_position(2, timeout=10)
+    woke = time.perf_counter()
+
+    assert len(bench) == 1
+    # The move takes time, the waiter slept through it and woke on DONE
+    assert bench[0] > start
+    assert woke - bench[0] < MAX_LATENCY
+    assert communication.read_current_position() == pytest.approx(2, abs=0.01)
+
+
+def test_several_waiters_wake_up(bench):
+    woke = []
+
+    def waiter():
+        desired_position(1, timeout=10)
+        woke.append(time.perf_counter())
+
+    threads = [threading.Thread(target=waiter) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    move_to_position(1)
+    for thread in threads:
+        thread.join(10)
+
+    assert len(woke) == 3
+    assert max(woke) - bench[0] < MAX_LATENCY
+
+
+def test_already_at_target_returns_at_once(bench):
+    start = time.perf_counter()
+    desired_position(0, timeout=10)
+    assert time.perf_counter() - start < MAX_LATENCY
+
+
+def test_times_out_when_the_motor_does_not_arrive(bench):
+    # No move is commanded, so the position is never reached
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        desired_position(5, timeout=0.5)
+    elapsed = time.perf_counter() - start
+    assert 0.5 <= elapsed < 0.5 + MAX_LATENCY
+    assert not bench
+
+
+class StuckPort:
+    """A serial port whose writes hang, e.g. a board that stopped reading."""
+
+    def __init__(self, stuck):
+        self.is_open = True
+        self.in_waiting = 0
+        self.stuck = stuck
+        self.written = []
+        self.release = threading.Event()
+
+    def read(self, size=1):
+        time.sleep(0.01)
+        return b""
+
+    def write(self, data):
+        if self.stuck:
+            self.release.wait(10)
+        self.written.append(data)
+
+    def close(self):
+        self.is_open = False
+
+
+def test_stale_commands_are_not_sent_on_the_next_connection(monkeypatch):
+    ports = [StuckPort(stuck=True), StuckPort(stuck=False)]
+    opened = iter(ports)
+    monkeypatch.setitem(communication.port_backends, "stuck", lambda baudrate: next(opened))
+
+    communication.connect_arduino("stuck")
+    for command in ("a", "b", "c"):
+        communication.send_command(command)
+    # The writer is stuck in the first write, the join times out
+    communication.disconnect_arduino()
+
+    communication.connect_arduino("stuck")
+    communication.send_command("new")
+    time.sleep(0.2)
+    communication.disconnect_arduino()
+    ports[0].release.set()
+
+    assert ports[1].written == [b"new\n"]
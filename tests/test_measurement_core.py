@@ -0,0 +1,91 @@
+"""
+The vectorized weighted_centroids() must give the same centroids as the
+previous loop over the blobs, for every blob of every image: the images
+saved by the program in data/ and media/, simulated bench frames for
+every filter, and the spot grid of the resources.
+"""
+import glob
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import simulator
+import utils
+from measurement_core import FILTERS, weighted_centroids
+from preprocessing import FramePipeline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def loop_centroids(gray_img, label_map, stats, labels):
+    """The previous centroid computation of compute_distances_to_center, one blob at a time."""
+    centers = []
+    for i in labels:
+        x, y, w, h, _ = stats[i]
+        roi = gray_img[y:y+h, x:x+w]
+        mask = (label_map[y:y+h, x:x+w] == i).astype(np.uint8)
+        I = (roi * mask).astype(np.float32)
+        total_intensity = I.sum()
+        yy, xx = np.indices(I.shape)
+        centers.append(((xx * I).sum() / total_intensity + x, (yy * I).sum() / total_intensity + y))
+    return np.array(centers)
+
+
+def saved_images():
+    """PNG images saved by the program, e.g. data/reference/w.png or data/<run>/z1_r.png."""
+    paths = []
+    for folder in ("data", "media"):
+        paths += glob.glob(os.path.join(ROOT, folder, "**", "*.png"), recursive=True)
+    return sorted(paths)
+
+
+def simulated_images():
+    """1080x1080 frames of the simulated bench for every filter at a few positions."""
+    sim = simulator.Simulation()
+    sim._open_device(115200)
+    # Only render(), the sensor thread is not needed
+    sim.camera.release()
+    sim.device.close()
+    pipeline = FramePipeline()
+    return [(f"z={z} {f}", pipeline.bgr(sim.camera.render((utils.mm_to_steps(z), 1.0,
+                                                            simulator.FILTER_ANGLES[f])), copy=True))
+            for z in (0, 20, 40) for f in FILTERS]
+
+
+def gray_for(name, img):
+    """The channel the detection uses for the filter in the image name, white otherwise."""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    flt = stem[-1] if stem[-1] in FILTERS else "w"
+    if flt == "w":
+        return np.mean(img, axis=2).astype(np.uint8)
+    return img[:, :, 3 - FILTERS.index(flt)]
+
+
+def check_every_label(name, gray):
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    n, label_map, stats, _ = cv2.connectedComponentsWithStats(binary, None, 8)
+    labels = list(range(1, n))
+    assert labels, name
+    old = loop_centroids(gray, label_map, stats, labels)
+    new = weighted_centroids(gray, label_map, stats, labels)
+    assert new.shape == old.shape
+    np.testing.assert_allclose(new, old, rtol=0, atol=1e-4, err_msg=name)
+
+
+@pytest.mark.parametrize("path", saved_images())
+def test_saved_images(path):
+    check_every_label(path, gray_for(path, cv2.imread(path)))
+
+
+def test_simulated_frames():
+    for name, img in simulated_images():
+        check_every_label(name, gray_for(name, img))
+
+
+def test_spot_grid_resource():
+    # Dark numbered spots on white: inverted, the spots are bright blobs
+    # with holes, and the digits are blobs of their own
+    img = cv2.imread(os.path.join(ROOT, "program", "resources", "points.png"))
+    check_every_label("points.png", 255 - np.mean(img, axis=2).astype(np.uint8))
@@ -0,0 +1,43 @@
+"""
+Background saving: a job is finished only after its completion callback,
+and closing the writer waits for the queued jobs.
+"""
+import threading
+import time
+
+from persistence import BackgroundWriter, atomic_write
+
+
+def _slow_file(path, delay=0.2):
+    """A (path, write) pair that takes delay seconds to write a small file."""
+    def write():
+        time.sleep(delay)
+        atomic_write(path, lambda tmp_path: open(tmp_path, "w").write("data"))
+    return str(path), write
+
+
+def test_finished_after_on_done(tmp_path):
+    writer = BackgroundWriter(workers=2)
+    release = threading.Event()
+    calls = []
+
+    def on_done(job):
+        calls.append(job.finished)
+        release.wait(5)
+
+    job = writer.submit([_slow_file(tmp_path / "a.txt", 0)], on_done=on_done)
+    # on_done is running, e.g. indexing the run, so the job is not finished yet
+    assert not job.wait(0.5)
+    release.set()
+    assert job.wait(5)
+    assert calls == [False]
+    assert (tmp_path / "a.txt").read_text() == "data"
+    assert writer.close()
+
+
+def test_close_waits_for_queued_jobs(tmp_path):
+    writer = BackgroundWriter(workers=2)
+    jobs = [writer.submit([_slow_file(tmp_path / f"{i}_{j}.txt") for j in range(3)]) for i in range(2)]
+    assert writer.close(timeout=10)
+    assert all(job.finished and not job.errors for job in jobs)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [f"{i}_{j}.txt" for i in range(2) for j in range(3)]
@@ -0,0 +1,60 @@
+"""
+Queries of the run index on a few runs stored directly in the database.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import run_index
+
+
+def _run(path, days_ago, lens_id, focal):
+    """A runs row and its results, like read_run() returns them."""
+    timestamp = (datetime.now() - timedelta(days=days_ago)).strftime("%Y-%m-%d %H:%M:%S")
+    row = {"path": path, "timestamp": timestamp, "lens_id": lens_id, "z1": 10.0, "z2": 50.0, "dz": 40.0,
+           "modo": 1, "reference_id": None, "calibration_id": None, "archive": run_index.ARCHIVE_FILENAME,
+           "excel": None, "source_size": 1, "source_mtime_ns": 1}
+    results = {"w": {"effective_focal": focal, "error_effective_focal": 0.1, "delta_f": 0.5},
+               "r": {"effective_focal": focal + 1, "error_effective_focal": 0.1, "delta_f": 0.5},
+               "g": {"error": "Expected 8 blobs, found 6"},
+               "b": {"effective_focal": focal - 1, "error_effective_focal": 0.1, "delta_f": 0.5}}
+    return row, results
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = run_index.connect(tmp_path)
+    with conn:
+        run_index._store(conn, *_run("a", 40, "L-1", 100.0))
+        run_index._store(conn, *_run("b", 10, "L-1", 100.2))
+        run_index._store(conn, *_run("c", 5, "L-2", 50.0))
+    yield conn
+    conn.close()
+
+
+def test_runs_for_lens(conn):
+    table = run_index.runs_for_lens(conn, "L-1")
+    assert list(table["path"].unique()) == ["b", "a"]
+    assert list(table["filter"][:4]) == ["w", "r", "g", "b"]
+    assert table["error"][2] == "Expected 8 blobs, found 6"
+    assert list(run_index.runs_for_lens(conn, "L-1", days=30)["path"].unique()) == ["b"]
+
+
+def test_runs_of_every_lens(conn):
+    assert list(run_index.runs_for_lens(conn, None)["path"].unique()) == ["c", "b", "a"]
+    assert list(run_index.runs_for_lens(conn, None, days=30)["path"].unique()) == ["c", "b"]
+
+
+def test_focal_trend(conn):
+    trend = run_index.focal_trend(conn, lens_id="L-1")
+    assert list(trend.columns) == ["r", "b"]
+    assert list(trend.index.get_level_values("path")) == ["a", "b"]
+    assert trend["r"].tolist() == [101.0, pytest.approx(101.2)]
+    assert run_index.focal_trend(conn, ("g",), days=30)["g"].isna().all()
+
+
+def test_replaced_run_keeps_one_row(conn):
+    with conn:
+        run_index._store(conn, *_run("c", 5, "L-2", 51.0))
+    assert conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0] == 3
+    assert run_index.focal_trend(conn, ("w",), lens_id="L-2")["w"].tolist() == [51.0]
@@ -0,0 +1,72 @@
+"""
+Stable capture with frame stacking: a frame whose ring slot was
+overwritten while it was read must be skipped without losing the equal
+frames already stacked.
+"""
+import numpy as np
+import pytest
+
+import camera_functions
+from acquisition import Frame
+from preprocessing import FrameStack
+
+
+class FakeRing:
+    """A ring whose frames are given in advance, with some of them torn."""
+
+    def __init__(self, images, torn=()):
+        self.images = images
+        self.torn = set(torn)
+        self.latest_seq = -1
+
+    def next_after(self, seq, timeout=None):
+        if seq + 1 >= len(self.images):
+            return None
+        return Frame(seq + 1, 0.0, True, self.images[seq + 1])
+
+    def is_valid(self, frame):
+        return frame.seq not in self.torn
+
+
+class FakeAcquisition:
+    def __init__(self, ring):
+        self.ring = ring
+        self.metrics = {}
+
+
+def _frame(level, rng):
+    """A 1080x1920 camera frame of a still scene with a little noise."""
+    return np.clip(level + rng.normal(0, 1, (1080, 1920, 3)), 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("method", ["mean", "median"])
+def test_torn_frame_keeps_the_stacked_run(monkeypatch, method):
+    rng = np.random.default_rng(0)
+    still = [_frame(100, rng) for _ in range(4)]
+    # Frame 2 was overwritten while it was read: its content is garbage
+    images = [still[0], still[1], _frame(200, rng), still[2], still[3]]
+    ring = FakeRing(images, torn={2})
+    monkeypatch.setattr(camera_functions, "start_acquisition", lambda: FakeAcquisition(ring))
+
+    image, info = camera_functions.capture_stable_image_array(frames=2, average=3, method=method)
+
+    # Frames 0, 1 and 3 are equal: stable after 4 frames, all 3 averaged
+    assert info["stable"] and info["frames"] == 3 and info["averaged"] == 3
+    stack = FrameStack(3, method)
+    for i in range(3):
+        camera_functions.capture_pipeline.bgr(still[i], out=stack.slot(camera_functions.capture_pipeline.crop(still[i]).shape))
+        stack.push()
+    np.testing.assert_array_equal(image, stack.result())
+
+
+def test_restart_keeps_the_written_frame():
+    for method in ("mean", "median"):
+        stack = FrameStack(3, method)
+        for value in (10, 20):
+            stack.slot((2, 2))[...] = value
+            stack.push()
+        stack.slot((2, 2))[...] = 50
+        stack.restart()
+        stack.push()
+        assert len(stack) == 1
+        np.testing.assert_array_equal(stack.result(), np.full((2, 2), 50, np.uint8))
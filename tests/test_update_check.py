@@ -0,0 +1,140 @@
+"""
+Update check against a local stub of the GitHub releases API: fast, slow,
+failing and unreachable endpoints, the daily cache, and the question
+asked from the main thread only.
+"""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import utils
+
+# Timeouts of the requests in the tests, (connect, read)
+TIMEOUT = (0.5, 0.5)
+
+
+class ReleaseHandler(BaseHTTPRequestHandler):
+    """Answers like the releases API, after the delay set on the server."""
+
+    def do_GET(self):
+        self.server.requests += 1
+        time.sleep(self.server.delay)
+        body = json.dumps({"tag_name": self.server.tag}).encode()
+        try:
+            self.send_response(self.server.status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            # The client gave up waiting
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """A releases API stub on an ephemeral port of localhost."""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ReleaseHandler)
+    httpd.daemon_threads = True
+    httpd.requests, httpd.delay, httpd.status, httpd.tag = 0, 0.0, 200, "v99.0.0"
+    httpd.url = f"http://127.0.0.1:{httpd.server_port}/releases/latest"
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def closed_url():
+    """URL of a localhost port nothing listens on."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/releases/latest"
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Keeps update_check.json in a temporary folder."""
+    monkeypatch.setattr(utils, "external_folder", lambda name: str(tmp_path))
+    return tmp_path
+
+
+def test_fetch_latest_version(server):
+    assert utils.fetch_latest_version(server.url, TIMEOUT) == "v99.0.0"
+
+
+def test_slow_endpoint_times_out(server):
+    server.delay = 3
+    start = time.perf_counter()
+    assert utils.fetch_latest_version(server.url, TIMEOUT) is None
+    assert time.perf_counter() - start < 2
+
+
+def test_unreachable_endpoint(closed_url):
+    start = time.perf_counter()
+    assert utils.fetch_latest_version(closed_url, TIMEOUT) is None
+    assert time.perf_counter() - start < 2
+
+
+def test_error_status(server):
+    server.status = 503
+    assert utils.fetch_latest_version(server.url, TIMEOUT) is None
+
+
+def test_answer_cached_for_a_day(server, cache_dir):
+    assert utils.get_latest_version(server.url, TIMEOUT) == "v99.0.0"
+    server.tag = "v100.0.0"
+    assert utils.get_latest_version(server.url, TIMEOUT) == "v99.0.0"
+    assert server.requests == 1
+    # Once the cached answer is too old GitHub is asked again
+    assert utils.get_latest_version(server.url, TIMEOUT, max_age=0) == "v100.0.0"
+    assert server.requests == 2
+
+
+def test_failed_check_keeps_last_version(server, closed_url, cache_dir):
+    assert utils.get_latest_version(server.url, TIMEOUT) == "v99.0.0"
+    assert utils.get_latest_version(closed_url, TIMEOUT, max_age=0) == "v99.0.0"
+    # The failed check is recorded too, the next start does not retry
+    assert json.loads((cache_dir / "update_check.json").read_text())["latest_version"] == "v99.0.0"
+
+
+class FakeWindow:
+    """Stands in for the Tk window: runs the after() callbacks when pumped."""
+
+    def __init__(self):
+        self.pending = []
+        self.threads = set()
+
+    def after(self, ms, callback):
+        self.threads.add(threading.current_thread())
+        self.pending.append(callback)
+
+    def pump(self, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            self.pending.pop(0)()
+            time.sleep(0.01)
+
+
+def test_question_asked_from_the_main_thread(server, monkeypatch):
+    server.delay = 0.3
+    monkeypatch.setattr(utils, "get_latest_version", lambda: utils.fetch_latest_version(server.url, (1, 1)))
+    asked = []
+    monkeypatch.setattr(utils, "ask_to_update",
+                        lambda version: asked.append((version, threading.current_thread())))
+
+    window = FakeWindow()
+    utils.check_for_updates(window)
+    window.pump()
+
+    assert asked == [("v99.0.0", threading.main_thread())]
+    # Only the main thread scheduled callbacks on the window
+    assert window.threads == {threading.main_thread()}